@@ -0,0 +1,362 @@
+import asyncio
+import imaplib
+import re
+import socket
+import ssl
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from imap_deflate import IMAP4Deflate, IMAP4SSLDeflate
+
+# Expressões das respostas do servidor, as mesmas usadas pelo imaplib
+UNTAGGED_RESPONSE = re.compile(rb"\* (?P<type>[A-Z-]+)( (?P<data>.*))?")
+UNTAGGED_STATUS = re.compile(rb"\* (?P<data>\d+) (?P<type>[A-Z-]+)( (?P<data2>.*))?")
+RESPONSE_CODE = re.compile(rb"\[(?P<type>[A-Z-]+)( (?P<data>.*))?\]")
+LITERAL = re.compile(rb".*{(?P<size>\d+)}$")
+TAGGED = re.compile(rb"(?P<tag>A\d+) (?P<type>[A-Z]+) (?P<data>.*)")
+
+# Tamanho máximo de uma linha de resposta, sem os literais (o conteúdo das mensagens é lido
+# à parte, pelo tamanho anunciado). O StreamReader de cada conexão retém até o dobro disso
+# além do literal em leitura, de modo que a memória por sessão fica próxima de um lote FETCH.
+LINE_LIMIT = 1024 * 1024
+# Tamanho de cada leitura do socket com a compressão ativa
+READ_SIZE = 64 * 1024
+
+
+class AsyncIMAPClient:
+    """
+    Cliente IMAP sobre asyncio que cobre o subconjunto de comandos usado pelo downloader
+    (LOGIN, LIST, SELECT/EXAMINE, STATUS, UID SEARCH, UID FETCH com literais, COMPRESS e
+    LOGOUT).
+
+    As respostas seguem o formato do imaplib: (tipo, dados), com as respostas não
+    marcadas acumuladas em 'untagged_responses' e cada literal entregue como a tupla
+    (linha, conteúdo). Assim, o mesmo código do downloader conduz este cliente e o
+    ThreadedIMAPClient (imaplib).
+    Cada conexão mantém apenas o seu buffer de leitura, limitado por 'line_limit'; muitas
+    sessões podem ser conduzidas por um único laço de eventos.
+    """
+
+    error = imaplib.IMAP4.error
+    abort = imaplib.IMAP4.abort
+    readonly = imaplib.IMAP4.readonly
+
+    def __init__(self, timeout=None, line_limit: int = LINE_LIMIT):
+        self.timeout = timeout if timeout is not None else socket.getdefaulttimeout()
+        self.line_limit = line_limit
+        self.untagged_responses = {}
+        self.capabilities = ()
+        self.state = "LOGOUT"
+        self._reader = None
+        self._writer = None
+        self._tag_counter = 0
+        self._command_lock = asyncio.Lock()
+        # Camada COMPRESS=DEFLATE (RFC 4978), ativada por compress()
+        self._deflate = None
+        self._inflate = None
+        self._inflated = bytearray()
+        self.compressed_bytes_in = 0
+        self.decompressed_bytes_in = 0
+
+    async def connect(self, host: str, port: int, use_ssl: bool = False):
+        """
+        Abre a conexão, lê a saudação do servidor e obtém as suas capacidades.
+        """
+        # Mesmo contexto TLS do imaplib.IMAP4_SSL padrão
+        ssl_context = ssl._create_stdlib_context() if use_ssl else None
+        try:
+            self._reader, self._writer = await self._wait(asyncio.open_connection(
+                host, port, ssl=ssl_context, limit=self.line_limit
+            ))
+        except (OSError, asyncio.TimeoutError) as e:
+            raise self.abort(f"socket error: {e}") from e
+        greeting = await self._read_line()
+        if greeting.startswith(b"* PREAUTH"):
+            self.state = "AUTH"
+        elif greeting.startswith(b"* OK"):
+            self.state = "NONAUTH"
+        else:
+            raise self.error(greeting)
+        await self.capability()
+
+    async def capability(self):
+        typ, dat = await self._untagged_command("CAPABILITY", "CAPABILITY")
+        if dat and dat[-1]:
+            self.capabilities = tuple(dat[-1].decode("ascii").upper().split())
+        return typ, dat
+
+    async def login(self, user: str, password: str):
+        quoted = '"' + password.replace("\\", "\\\\").replace('"', '\\"') + '"'
+        typ, dat = await self._simple_command("LOGIN", user, quoted)
+        if typ != "OK":
+            raise self.error(dat[-1])
+        self.state = "AUTH"
+        return typ, dat
+
+    async def compress(self) -> bool:
+        """
+        Ativa COMPRESS=DEFLATE se o servidor anunciar a extensão (as capacidades são
+        consultadas novamente, pois muitos servidores só a anunciam após o login).
+        Retorna True se a compressão estiver ativa.
+        """
+        if self._inflate is not None:
+            return True
+        await self.capability()
+        if "COMPRESS=DEFLATE" not in self.capabilities:
+            return False
+        typ, _ = await self._simple_command("COMPRESS", "DEFLATE")
+        if typ != "OK":
+            return False
+        self._deflate = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+        self._inflate = zlib.decompressobj(-15)
+        return True
+
+    async def list(self, directory: str = '""', pattern: str = "*"):
+        return await self._untagged_command("LIST", "LIST", directory, pattern)
+
+    async def select(self, mailbox: str = "INBOX", readonly: bool = False):
+        self.untagged_responses = {}
+        name = "EXAMINE" if readonly else "SELECT"
+        typ, dat = await self._simple_command(name, mailbox)
+        if typ != "OK":
+            self.state = "AUTH"
+            return typ, dat
+        self.state = "SELECTED"
+        if "READ-ONLY" in self.untagged_responses and not readonly:
+            raise self.readonly(f"{mailbox} is not writable")
+        return typ, self.untagged_responses.get("EXISTS", [None])
+
+    async def status(self, mailbox: str, names: str):
+        return await self._untagged_command("STATUS", "STATUS", mailbox, names)
+
+    async def uid(self, command: str, *args):
+        command = command.upper()
+        name = command if command in ("SEARCH", "SORT", "THREAD") else "FETCH"
+        return await self._untagged_command(name, "UID", command, *args)
+
+    def response(self, code: str):
+        return self._untagged_response(code, [None], code.upper())
+
+    async def logout(self):
+        self.state = "LOGOUT"
+        try:
+            typ, dat = await self._simple_command("LOGOUT")
+        except (self.abort, OSError):
+            typ, dat = "NO", [b"connection already closed"]
+        self.close()
+        return typ, dat
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    async def _untagged_command(self, name, command, *args):
+        typ, dat = await self._simple_command(command, *args)
+        return self._untagged_response(typ, dat, name)
+
+    def _untagged_response(self, typ, dat, name):
+        if typ == "NO":
+            return typ, dat
+        if name not in self.untagged_responses:
+            return typ, [None]
+        return typ, self.untagged_responses.pop(name)
+
+    async def _simple_command(self, command, *args):
+        async with self._command_lock:
+            for typ in ("OK", "NO", "BAD"):
+                self.untagged_responses.pop(typ, None)
+            self._tag_counter += 1
+            tag = f"A{self._tag_counter}".encode()
+            line = tag + b" " + command.encode()
+            for arg in args:
+                if arg is None:
+                    continue
+                line += b" " + (arg if isinstance(arg, bytes) else arg.encode("ascii"))
+            if self._writer is None:
+                raise self.abort("socket error: connection closed")
+            data = line + b"\r\n"
+            if self._deflate is not None:
+                data = self._deflate.compress(data) + self._deflate.flush(zlib.Z_SYNC_FLUSH)
+            try:
+                self._writer.write(data)
+                await self._wait(self._writer.drain())
+            except (OSError, asyncio.TimeoutError) as e:
+                raise self.abort(f"socket error: {e}") from e
+            typ, dat = await self._read_tagged_response(tag)
+        if command != "LOGOUT" and self.untagged_responses.get("BYE"):
+            raise self.abort(self.untagged_responses["BYE"][-1].decode("ascii", "replace"))
+        if typ == "BAD":
+            raise self.error(f"{command} command error: {typ} {dat}")
+        return typ, dat
+
+    async def _read_tagged_response(self, tag):
+        while True:
+            resp = await self._read_line()
+            match = TAGGED.match(resp)
+            if match and match.group("tag") == tag:
+                typ, dat = match.group("type").decode("ascii"), match.group("data")
+                self._append_response_code(typ, dat)
+                return typ, [dat]
+            dat2 = None
+            match = UNTAGGED_RESPONSE.match(resp)
+            if match is None:
+                match = UNTAGGED_STATUS.match(resp)
+                if match is not None:
+                    dat2 = match.group("data2")
+            if match is None:
+                if resp.startswith(b"+"):
+                    continue  # Continuação: não usada pelos comandos deste cliente
+                raise self.abort(f"unexpected response: {resp!r}")
+            typ = match.group("type").decode("ascii")
+            dat = match.group("data") or b""
+            if dat2:
+                dat = dat + b" " + dat2
+            # Literais: a linha termina em {n} e é seguida de n bytes e do resto da resposta
+            while LITERAL.match(dat):
+                size = int(LITERAL.match(dat).group("size"))
+                literal = await self._read_exactly(size)
+                self._append_untagged(typ, (dat, literal))
+                dat = await self._read_line()
+            self._append_untagged(typ, dat)
+            self._append_response_code(typ, dat)
+
+    def _append_response_code(self, typ, dat):
+        if typ in ("OK", "NO", "BAD"):
+            match = RESPONSE_CODE.match(dat)
+            if match:
+                self._append_untagged(match.group("type").decode("ascii"), match.group("data"))
+
+    def _append_untagged(self, typ, dat):
+        self.untagged_responses.setdefault(typ, []).append(b"" if dat is None else dat)
+
+    async def _read_line(self):
+        if self._inflate is not None:
+            line = await self._read_inflated_line()
+        else:
+            try:
+                line = await self._wait(self._reader.readline())
+            except (OSError, asyncio.TimeoutError, ValueError) as e:
+                raise self.abort(f"socket error: {e}") from e
+        if not line:
+            raise self.abort("socket error: EOF")
+        if not line.endswith(b"\r\n"):
+            raise self.abort(f"socket error: unterminated line: {line!r}")
+        return line[:-2]
+
+    async def _read_exactly(self, size):
+        if self._inflate is not None:
+            while len(self._inflated) < size:
+                await self._fill()
+            data = bytes(self._inflated[:size])
+            del self._inflated[:size]
+            return data
+        try:
+            return await self._wait(self._reader.readexactly(size))
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+            raise self.abort(f"socket error: {e}") from e
+
+    async def _read_inflated_line(self):
+        start = 0
+        while True:
+            end = self._inflated.find(b"\n", start)
+            if end >= 0:
+                end += 1
+                break
+            if len(self._inflated) > self.line_limit:
+                raise self.abort(f"socket error: line longer than {self.line_limit} bytes")
+            start = len(self._inflated)
+            await self._fill()
+        line = bytes(self._inflated[:end])
+        del self._inflated[:end]
+        return line
+
+    async def _fill(self):
+        # O StreamReader entrega primeiro o que já estava no seu buffer
+        try:
+            raw = await self._wait(self._reader.read(READ_SIZE))
+        except (OSError, asyncio.TimeoutError) as e:
+            raise self.abort(f"socket error: {e}") from e
+        if not raw:
+            raise self.abort("socket error: EOF")
+        data = self._inflate.decompress(raw)
+        self.compressed_bytes_in += len(raw)
+        self.decompressed_bytes_in += len(data)
+        self._inflated += data
+
+    async def _wait(self, awaitable):
+        return await asyncio.wait_for(awaitable, self.timeout)
+
+
+class ThreadedIMAPClient:
+    """
+    A interface do AsyncIMAPClient sobre o imaplib bloqueante (IMAP4Deflate e
+    IMAP4SSLDeflate, com COMPRESS=DEFLATE), usada pelo motor "imaplib" do downloader.
+    Cada comando roda na thread própria da sessão, de modo que o laço de eventos não
+    fica bloqueado e os comandos de uma mesma sessão nunca se sobrepõem; as respostas e
+    as exceções são as do imaplib.
+    """
+
+    error = imaplib.IMAP4.error
+    abort = imaplib.IMAP4.abort
+    readonly = imaplib.IMAP4.readonly
+
+    def __init__(self):
+        self._mail = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="imap")
+
+    @property
+    def untagged_responses(self) -> dict:
+        return self._mail.untagged_responses if self._mail is not None else {}
+
+    @property
+    def compressed_bytes_in(self) -> int:
+        return getattr(self._mail, "compressed_bytes_in", 0)
+
+    @property
+    def decompressed_bytes_in(self) -> int:
+        return getattr(self._mail, "decompressed_bytes_in", 0)
+
+    async def connect(self, host: str, port: int, use_ssl: bool = False):
+        self._mail = await self._call(IMAP4SSLDeflate if use_ssl else IMAP4Deflate, host, port)
+
+    async def login(self, user: str, password: str):
+        return await self._call(self._mail.login, user, password)
+
+    async def compress(self) -> bool:
+        return await self._call(self._mail.enable_compression)
+
+    async def list(self, directory: str = '""', pattern: str = "*"):
+        return await self._call(self._mail.list, directory, pattern)
+
+    async def select(self, mailbox: str = "INBOX", readonly: bool = False):
+        return await self._call(self._mail.select, mailbox, readonly)
+
+    async def status(self, mailbox: str, names: str):
+        return await self._call(self._mail.status, mailbox, names)
+
+    async def uid(self, command: str, *args):
+        return await self._call(self._mail.uid, command, *args)
+
+    def response(self, code: str):
+        return self._mail.response(code)
+
+    async def logout(self):
+        try:
+            return await self._call(self._mail.logout)
+        except (self.abort, OSError):
+            return "NO", [b"connection already closed"]
+        finally:
+            self.close()
+
+    def close(self):
+        mail, self._mail = self._mail, None
+        if mail is not None:
+            try:
+                mail.shutdown()
+            except OSError:
+                pass  # Conexão já encerrada (ex.: pelo LOGOUT)
+        self._executor.shutdown(wait=False)
+
+    async def _call(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
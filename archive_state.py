@@ -0,0 +1,183 @@
+import sqlite3
+import threading
+import time
+
+
+class ArchiveState:
+    """
+    Estado persistente do arquivamento, armazenado em um banco SQLite local.
+
+    Para cada conta e pasta IMAP guarda o UIDVALIDITY e o último UID gravado com
+    sucesso, permitindo que execuções seguintes baixem apenas os e-mails novos, e os
+    UIDs anteriores a ele que falharam, para que sejam repetidos individualmente.
+
+    Mantém também o índice das mensagens já arquivadas no armazenamento por conteúdo,
+    identificadas por (Message-ID, tamanho), usado para evitar baixar duplicatas.
+    """
+
+    def __init__(self, db_path: str):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS folder_state (
+                account     TEXT NOT NULL,
+                mailbox     TEXT NOT NULL,
+                uidvalidity INTEGER NOT NULL,
+                last_uid    INTEGER NOT NULL,
+                updated_at  REAL NOT NULL,
+                PRIMARY KEY (account, mailbox)
+            )
+            """
+        )
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS failed_uids (
+                account     TEXT NOT NULL,
+                mailbox     TEXT NOT NULL,
+                uidvalidity INTEGER NOT NULL,
+                uid         INTEGER NOT NULL,
+                attempts    INTEGER NOT NULL,
+                updated_at  REAL NOT NULL,
+                PRIMARY KEY (account, mailbox, uid)
+            )
+            """
+        )
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS message_index (
+                message_id TEXT NOT NULL,
+                size       INTEGER NOT NULL,
+                digest     TEXT NOT NULL,
+                subject    TEXT,
+                sender     TEXT,
+                date       TEXT,
+                account    TEXT,
+                mailbox    TEXT,
+                PRIMARY KEY (message_id, size)
+            )
+            """
+        )
+        self._conn.commit()
+
+    def get_folder_state(self, account: str, mailbox: str):
+        """
+        Retorna (uidvalidity, last_uid) da pasta, ou (None, 0) se ela nunca foi sincronizada.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT uidvalidity, last_uid FROM folder_state WHERE account = ? AND mailbox = ?",
+                (account, mailbox)
+            ).fetchone()
+        if row is None:
+            return None, 0
+        return row[0], row[1]
+
+    def save_folder_state(self, account: str, mailbox: str, uidvalidity: int, last_uid: int):
+        """
+        Registra o último UID gravado com sucesso para a pasta.
+        """
+        with self._lock:
+            self._conn.execute(
+                """
+                INSERT INTO folder_state (account, mailbox, uidvalidity, last_uid, updated_at)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (account, mailbox) DO UPDATE SET
+                    uidvalidity = excluded.uidvalidity,
+                    last_uid    = excluded.last_uid,
+                    updated_at  = excluded.updated_at
+                """,
+                (account, mailbox, uidvalidity, last_uid, time.time())
+            )
+            self._conn.commit()
+
+    def get_failed_uids(self, account: str, mailbox: str, uidvalidity: int, max_attempts: int) -> list:
+        """
+        Retorna, em ordem crescente, os UIDs da pasta que falharam em execuções anteriores
+        com o mesmo UIDVALIDITY e menos de 'max_attempts' tentativas.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                """
+                SELECT uid FROM failed_uids
+                WHERE account = ? AND mailbox = ? AND uidvalidity = ? AND attempts < ?
+                ORDER BY uid
+                """,
+                (account, mailbox, uidvalidity, max_attempts)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def record_failed_uids(self, account: str, mailbox: str, uidvalidity: int, uids):
+        """
+        Registra uma falha para cada UID de 'uids', somando uma tentativa aos já registrados.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                """
+                INSERT INTO failed_uids (account, mailbox, uidvalidity, uid, attempts, updated_at)
+                VALUES (?, ?, ?, ?, 1, ?)
+                ON CONFLICT (account, mailbox, uid) DO UPDATE SET
+                    uidvalidity = excluded.uidvalidity,
+                    attempts    = failed_uids.attempts + 1,
+                    updated_at  = excluded.updated_at
+                """,
+                [(account, mailbox, uidvalidity, uid, now) for uid in uids]
+            )
+            self._conn.commit()
+
+    def clear_failed_uids(self, account: str, mailbox: str, uids=None):
+        """
+        Remove os UIDs de 'uids' (gravados ou removidos do servidor) da lista de falhas da
+        pasta, ou a lista inteira, se 'uids' for None (ex.: após mudança de UIDVALIDITY).
+        """
+        with self._lock:
+            if uids is None:
+                self._conn.execute(
+                    "DELETE FROM failed_uids WHERE account = ? AND mailbox = ?", (account, mailbox)
+                )
+            else:
+                self._conn.executemany(
+                    "DELETE FROM failed_uids WHERE account = ? AND mailbox = ? AND uid = ?",
+                    [(account, mailbox, uid) for uid in uids]
+                )
+            self._conn.commit()
+
+    def find_digests(self, keys) -> dict:
+        """
+        Retorna {(message_id, tamanho): hash} para as mensagens de 'keys' já arquivadas.
+        """
+        found = {}
+        with self._lock:
+            for message_id, size in keys:
+                row = self._conn.execute(
+                    "SELECT digest FROM message_index WHERE message_id = ? AND size = ?",
+                    (message_id, size)
+                ).fetchone()
+                if row is not None:
+                    found[(message_id, size)] = row[0]
+        return found
+
+    def record_messages(self, rows):
+        """
+        Registra mensagens arquivadas no índice. Cada item de 'rows' é a tupla
+        (message_id, tamanho, hash, assunto, remetente, data, conta, pasta).
+        """
+        if not rows:
+            return
+        with self._lock:
+            self._conn.executemany(
+                """
+                INSERT OR IGNORE INTO message_index
+                    (message_id, size, digest, subject, sender, date, account, mailbox)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                rows
+            )
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,86 @@
+import email
+import os
+import time
+from email.mime.application import MIMEApplication
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+from maildownloader_improved import extract_message_metadata, decode_subject
+
+# Comparação do custo de CPU para extrair os metadados do índice de mensagens (assunto,
+# Message-ID, data e remetente, usados pela deduplicação):
+#   - "completo": email.message_from_bytes (árvore MIME inteira, como era feito antes);
+#   - "cabeçalhos": extract_message_metadata (somente o bloco de cabeçalhos), como no
+#     downloader.
+
+# Tamanho dos anexos das mensagens sintéticas (bytes) e quantidade de mensagens de cada tamanho
+ATTACHMENT_SIZES = [0, 50 * 1024, 1024 * 1024, 10 * 1024 * 1024]
+MESSAGES_PER_SIZE = 20
+
+
+def build_message(index: int, attachment_size: int) -> bytes:
+    """
+    Monta uma mensagem sintética com assunto codificado (RFC 2047) e, opcionalmente, um anexo.
+    """
+    msg = MIMEMultipart()
+    msg["Subject"] = "=?utf-8?q?Relat=C3=B3rio_mensal_n=C2=BA_{}?=".format(index)
+    msg["From"] = "Prefeitura <contato@example.org>"
+    msg["To"] = "arquivo@example.org"
+    msg["Message-ID"] = f"<bench-{index}-{attachment_size}@example.org>"
+    msg["Date"] = "Mon, 01 Jan 2024 10:00:00 -0300"
+    msg.attach(MIMEText("Segue o relatório em anexo.\n" * 20, "plain", "utf-8"))
+    if attachment_size:
+        msg.attach(MIMEApplication(os.urandom(attachment_size), Name="relatorio.pdf"))
+    return msg.as_bytes()
+
+
+def full_parse(raw_email: bytes) -> dict:
+    msg = email.message_from_bytes(raw_email)
+    return {
+        "subject": decode_subject(msg.get("subject", "sem_assunto")),
+        "message_id": (msg.get("message-id") or "").strip(),
+        "date": msg.get("date") or "",
+        "from": decode_subject(msg.get("from") or ""),
+    }
+
+
+def header_parse(raw_email: bytes) -> dict:
+    return extract_message_metadata(raw_email)
+
+
+def measure(parse, messages) -> float:
+    started = time.process_time()
+    for raw_email in messages:
+        parse(raw_email)
+    return time.process_time() - started
+
+
+def main():
+    print(f"{'ANEXO':>10} {'MSGS':>5} {'MB':>8} {'COMPLETO s/GB':>14} {'CABEÇALHOS s/GB':>16} {'ECONOMIA s/GB':>14}")
+    total_bytes = 0
+    total_full = 0.0
+    total_headers = 0.0
+    for attachment_size in ATTACHMENT_SIZES:
+        messages = [build_message(i, attachment_size) for i in range(MESSAGES_PER_SIZE)]
+        size = sum(len(raw_email) for raw_email in messages)
+        full_cpu = measure(full_parse, messages)
+        header_cpu = measure(header_parse, messages)
+        per_gb = (1024 ** 3) / size
+        print(
+            f"{attachment_size // 1024:>8}KB {len(messages):>5} {size / (1024 * 1024):>8.1f} "
+            f"{full_cpu * per_gb:>14.2f} {header_cpu * per_gb:>16.2f} {(full_cpu - header_cpu) * per_gb:>14.2f}"
+        )
+        total_bytes += size
+        total_full += full_cpu
+        total_headers += header_cpu
+
+    per_gb = (1024 ** 3) / total_bytes
+    print(
+        f"\nTotal: {total_bytes / (1024 * 1024):.1f} MB; CPU economizada por GB arquivado: "
+        f"{(total_full - total_headers) * per_gb:.2f} s "
+        f"({total_full * per_gb:.2f} s -> {total_headers * per_gb:.2f} s)"
+    )
+
+
+if __name__ == "__main__":
+    main()
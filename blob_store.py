@@ -0,0 +1,163 @@
+import errno
+import hashlib
+import itertools
+import logging
+import os
+import shutil
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# ioctl do Linux que clona o conteúdo de um arquivo (reflink) em Btrfs/XFS
+FICLONE = 0x40049409
+
+LINK_MODES = ("hardlink", "reflink", "copy")
+
+
+class BlobWriter:
+    """
+    Grava uma mensagem no armazenamento calculando o SHA-256 à medida que os dados chegam.
+    O conteúdo só entra no armazenamento em commit(); se já existir um blob igual,
+    a cópia recém-gravada é descartada.
+    """
+
+    def __init__(self, store: "BlobStore"):
+        self._store = store
+        self._hash = hashlib.sha256()
+        self.size = 0
+        self.tmp_path = os.path.join(store.tmp_dir, f"{os.getpid()}.{next(store._sequence)}")
+        self._file = open(self.tmp_path, "wb")
+
+    def write(self, data: bytes):
+        self._file.write(data)
+        self._hash.update(data)
+        self.size += len(data)
+
+    def commit(self):
+        """
+        Finaliza a gravação e retorna (hash, novo), onde 'novo' indica se o conteúdo
+        ainda não existia no armazenamento.
+        """
+        self._file.close()
+        digest = self._hash.hexdigest()
+        blob_path = self._store.blob_path(digest)
+        if os.path.exists(blob_path):
+            os.remove(self.tmp_path)
+            is_new = False
+        else:
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+            # Se outra thread gravou o mesmo conteúdo nesse meio tempo, o resultado é idêntico
+            os.replace(self.tmp_path, blob_path)
+            is_new = True
+        self._store._record(self.size, is_new)
+        return digest, is_new
+
+    def abort(self):
+        self._file.close()
+        try:
+            os.remove(self.tmp_path)
+        except OSError:
+            pass
+
+
+class BlobStore:
+    """
+    Armazenamento endereçado por conteúdo das mensagens brutas. Cada conteúdo distinto é
+    gravado uma única vez em '<raiz>/<aa>/<bb>/<sha256>' e as pastas Maildir recebem
+    hardlinks, reflinks ou cópias do blob, conforme 'link_mode'.
+
+    Para hardlinks, a raiz deve estar no mesmo sistema de arquivos que as pastas Maildir.
+    """
+
+    def __init__(self, root: str, link_mode: str = "hardlink"):
+        if link_mode not in LINK_MODES:
+            raise ValueError(f"Modo de ligação inválido: {link_mode}")
+        self.root = root
+        self.link_mode = link_mode
+        self.tmp_dir = os.path.join(root, "tmp")
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        self._sequence = itertools.count(1)
+        self._lock = threading.Lock()
+        self.stats = {"messages": 0, "duplicates": 0, "logical_bytes": 0, "stored_bytes": 0,
+                      "skipped_downloads": 0}
+
+    def blob_path(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def open_writer(self) -> BlobWriter:
+        return BlobWriter(self)
+
+    def put_bytes(self, raw_email: bytes):
+        """
+        Armazena a mensagem e retorna (hash, novo).
+        """
+        writer = self.open_writer()
+        try:
+            writer.write(raw_email)
+        except BaseException:
+            writer.abort()
+            raise
+        return writer.commit()
+
+    def has(self, digest: str) -> bool:
+        return os.path.exists(self.blob_path(digest))
+
+    def link(self, digest: str, dest_path: str):
+        """
+        Cria 'dest_path' com o conteúdo do blob, usando o modo de ligação configurado.
+        Se o hardlink ou o reflink não for possível, recorre a uma cópia.
+        """
+        blob_path = self.blob_path(digest)
+        if self.link_mode == "hardlink":
+            try:
+                os.link(blob_path, dest_path)
+                return
+            except OSError as e:
+                # EMLINK: limite de hardlinks por arquivo; EXDEV: sistemas de arquivos diferentes
+                if e.errno not in (errno.EMLINK, errno.EXDEV, errno.EPERM):
+                    raise
+                logging.warning(f"Hardlink indisponível para '{dest_path}' ({e}); copiando o blob.")
+        elif self.link_mode == "reflink" and fcntl is not None:
+            try:
+                with open(blob_path, "rb") as src, open(dest_path, "wb") as dst:
+                    fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+                return
+            except OSError:
+                pass
+        shutil.copyfile(blob_path, dest_path)
+
+    def record_skipped_download(self, size: int):
+        """
+        Contabiliza uma mensagem já arquivada que foi ligada sem ser baixada novamente.
+        """
+        with self._lock:
+            self.stats["skipped_downloads"] += 1
+        self._record(size, False)
+
+    def _record(self, size: int, is_new: bool):
+        with self._lock:
+            self.stats["messages"] += 1
+            self.stats["logical_bytes"] += size
+            if is_new:
+                self.stats["stored_bytes"] += size
+            else:
+                self.stats["duplicates"] += 1
+
+    def log_stats(self):
+        """
+        Registra no log o volume lógico arquivado, o volume efetivamente gravado e a economia.
+        """
+        with self._lock:
+            stats = dict(self.stats)
+        saved = stats["logical_bytes"] - stats["stored_bytes"]
+        ratio = saved / stats["logical_bytes"] * 100 if stats["logical_bytes"] else 0.0
+        logging.info(
+            f"Deduplicação: {stats['messages']} e-mails ({stats['duplicates']} duplicados, "
+            f"{stats['skipped_downloads']} sem novo download), "
+            f"{stats['logical_bytes'] / (1024 * 1024):.1f} MB arquivados, "
+            f"{stats['stored_bytes'] / (1024 * 1024):.1f} MB gravados, "
+            f"{saved / (1024 * 1024):.1f} MB economizados ({ratio:.1f}%)."
+        )
@@ -0,0 +1,287 @@
+import hashlib
+import os
+import socket
+import socketserver
+import threading
+import zlib
+
+# Servidor FTP mínimo para testar o uploader sem um servidor real: USER/PASS, TYPE,
+# PWD/CWD, MKD, PASV, REST, STOR, APPE, RETR, SIZE, MLSD, FEAT, OPTS HASH, HASH, XCRC,
+# DELE e QUIT, sem TLS. Qualquer usuário e senha são aceitos e os arquivos são gravados
+# no diretório 'root' informado.
+
+
+class FakeFtpServer(socketserver.ThreadingTCPServer):
+    """
+    Servidor FTP de teste, uma thread por conexão de controle, em 127.0.0.1 e porta livre.
+
+    Os arquivos ficam em 'root', para que os testes preparem e confiram o conteúdo remoto
+    diretamente no disco. Com rest_stor=False, STOR após REST é recusado (504), como nos
+    servidores que só aceitam APPE para retomar; com checksum=False, HASH e XCRC não são
+    anunciados em FEAT. 'fail_stor_after', se definido, interrompe o próximo STOR/APPE
+    depois de gravar esse número de bytes (426). 'reject_names' é um conjunto de caracteres
+    recusados nos nomes de arquivo (553), como em servidores Windows. Os comandos recebidos
+    ficam em 'commands'.
+
+    Uso:
+        with FakeFtpServer(directory) as server:
+            ftp = ftplib.FTP()
+            ftp.connect("127.0.0.1", server.port)
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, root: str, rest_stor: bool = True, checksum: bool = True, reject_names: str = ""):
+        super().__init__(("127.0.0.1", 0), FakeFtpHandler)
+        self.root = os.path.realpath(root)
+        self.rest_stor = rest_stor
+        self.checksum = checksum
+        self.reject_names = reject_names
+        self.fail_stor_after = None
+        self.commands = []
+        self.lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name="fake-ftp", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+class FakeFtpHandler(socketserver.StreamRequestHandler):
+    """Uma sessão de controle do FakeFtpServer."""
+
+    def setup(self):
+        super().setup()
+        self._cwd = "/"
+        self._rest = 0
+        self._passive = None
+        self._hash_algo = "SHA-256"
+
+    def finish(self):
+        if self._passive is not None:
+            self._passive.close()
+        super().finish()
+
+    def handle(self):
+        self.reply("220 servidor de teste pronto")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            line = line.decode("utf-8", errors="replace").rstrip("\r\n")
+            with self.server.lock:
+                self.server.commands.append(line)
+            command, _, args = line.partition(" ")
+            command = command.upper()
+            if command == "QUIT":
+                self.reply("221 até logo")
+                return
+            handler = getattr(self, f"do_{command}", None)
+            if handler is None:
+                self.reply("502 comando não implementado")
+                continue
+            handler(args)
+
+    def reply(self, text: str):
+        self.wfile.write(text.encode("utf-8") + b"\r\n")
+
+    def path(self, name: str) -> str:
+        """Caminho local do arquivo remoto 'name', relativo ao diretório corrente."""
+        remote = os.path.normpath(os.path.join(self._cwd, name)).lstrip("/")
+        return os.path.join(self.server.root, remote)
+
+    def open_data(self):
+        """Aceita a conexão de dados aberta pelo cliente após PASV."""
+        if self._passive is None:
+            self.reply("425 use PASV antes")
+            return None
+        passive, self._passive = self._passive, None
+        with passive:
+            passive.settimeout(10)
+            conn, _ = passive.accept()
+        return conn
+
+    def do_USER(self, args):
+        self.reply("331 informe a senha")
+
+    def do_PASS(self, args):
+        self.reply("230 autenticado")
+
+    def do_TYPE(self, args):
+        self.reply("200 tipo alterado")
+
+    def do_PWD(self, args):
+        self.reply(f'257 "{self._cwd}"')
+
+    def do_CWD(self, args):
+        if not os.path.isdir(self.path(args)):
+            self.reply("550 diretório inexistente")
+            return
+        self._cwd = os.path.normpath(os.path.join(self._cwd, args))
+        self.reply("250 diretório alterado")
+
+    def do_MKD(self, args):
+        try:
+            os.mkdir(self.path(args))
+        except OSError:
+            self.reply("550 diretório já existe")
+            return
+        self.reply(f'257 "{args}" criado')
+
+    def do_DELE(self, args):
+        try:
+            os.remove(self.path(args))
+        except OSError:
+            self.reply("550 arquivo inexistente")
+            return
+        self.reply("250 arquivo removido")
+
+    def do_FEAT(self, args):
+        features = ["MLSD", "SIZE", "REST STREAM"]
+        if self.server.checksum:
+            features += ["HASH SHA-256*;MD5", "XCRC"]
+        self.reply("211-Recursos:\r\n" + "".join(f" {feature}\r\n" for feature in features) + "211 Fim")
+
+    def do_OPTS(self, args):
+        option, _, value = args.partition(" ")
+        if option.upper() == "MLST":
+            self.reply(f"200 MLST {value}")
+            return
+        if option.upper() != "HASH" or not self.server.checksum:
+            self.reply("501 opção não suportada")
+            return
+        self._hash_algo = value.upper()
+        self.reply(f"200 {self._hash_algo}")
+
+    def do_HASH(self, args):
+        if not self.server.checksum or not os.path.isfile(self.path(args)):
+            self.reply("550 arquivo inexistente")
+            return
+        with open(self.path(args), "rb") as f:
+            data = f.read()
+        digest = hashlib.new(self._hash_algo.replace("-", "").lower(), data).hexdigest()
+        self.reply(f"213 {self._hash_algo} 0-{len(data)} {digest} {args}")
+
+    def do_XCRC(self, args):
+        if not self.server.checksum or not os.path.isfile(self.path(args)):
+            self.reply("550 arquivo inexistente")
+            return
+        with open(self.path(args), "rb") as f:
+            self.reply(f"250 {zlib.crc32(f.read()):08X}")
+
+    def do_SIZE(self, args):
+        if not os.path.isfile(self.path(args)):
+            self.reply("550 arquivo inexistente")
+            return
+        self.reply(f"213 {os.path.getsize(self.path(args))}")
+
+    def do_PASV(self, args):
+        if self._passive is not None:
+            self._passive.close()
+        self._passive = socket.create_server(("127.0.0.1", 0))
+        port = self._passive.getsockname()[1]
+        self.reply(f"227 modo passivo (127,0,0,1,{port >> 8},{port & 0xFF})")
+
+    def do_REST(self, args):
+        self._rest = int(args)
+        self.reply(f"350 retomando em {self._rest}")
+
+    def do_STOR(self, args):
+        rest, self._rest = self._rest, 0
+        if rest and not self.server.rest_stor:
+            self.reply("504 REST não suportado para STOR")
+            return
+        self.receive(args, rest, append=False)
+
+    def do_APPE(self, args):
+        self._rest = 0
+        self.receive(args, 0, append=True)
+
+    def receive(self, name: str, offset: int, append: bool):
+        if any(char in name for char in self.server.reject_names):
+            self.reply("553 nome de arquivo não permitido")
+            return
+        path = self.path(name)
+        if not os.path.isdir(os.path.dirname(path)):
+            self.reply("553 diretório inexistente")
+            return
+        with self.server.lock:
+            limit, self.server.fail_stor_after = self.server.fail_stor_after, None
+        conn = self.open_data()
+        if conn is None:
+            return
+        self.reply("150 enviando dados")
+        mode = "ab" if append or (offset and os.path.exists(path)) else "wb"
+        interrupted = False
+        with conn, open(path, mode) as f:
+            if not append and offset:
+                f.seek(offset)
+                f.truncate()
+            received = 0
+            while True:
+                data = conn.recv(65536)
+                if not data:
+                    break
+                if limit is not None and received + len(data) >= limit:
+                    f.write(data[:limit - received])
+                    interrupted = True
+                    break
+                f.write(data)
+                received += len(data)
+        self.reply("426 conexão de dados interrompida" if interrupted else "226 transferência concluída")
+
+    def do_RETR(self, args):
+        rest, self._rest = self._rest, 0
+        if not os.path.isfile(self.path(args)):
+            self.reply("550 arquivo inexistente")
+            return
+        conn = self.open_data()
+        if conn is None:
+            return
+        self.reply("150 enviando dados")
+        try:
+            with conn, open(self.path(args), "rb") as f:
+                f.seek(rest)
+                for data in iter(lambda: f.read(65536), b""):
+                    conn.sendall(data)
+        except OSError:
+            self.reply("426 transferência interrompida pelo cliente")
+            return
+        self.reply("226 transferência concluída")
+
+    def do_MLSD(self, args):
+        directory = self.path(args)
+        if not os.path.isdir(directory):
+            self.reply("550 diretório inexistente")
+            return
+        conn = self.open_data()
+        if conn is None:
+            return
+        self.reply("150 enviando listagem")
+        with conn:
+            for name in sorted(os.listdir(directory)):
+                path = os.path.join(directory, name)
+                if os.path.isdir(path):
+                    facts = "type=dir;"
+                else:
+                    facts = f"type=file;size={os.path.getsize(path)};"
+                conn.sendall(f"{facts} {name}\r\n".encode("utf-8"))
+        self.reply("226 listagem concluída")
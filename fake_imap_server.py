@@ -0,0 +1,280 @@
+import re
+import socketserver
+import threading
+import zlib
+
+# Servidor IMAP4rev1 mínimo, em memória, para testar o downloader sem um servidor real:
+# LOGIN, CAPABILITY, COMPRESS=DEFLATE (RFC 4978), LIST, SELECT/EXAMINE, STATUS,
+# UID SEARCH, UID FETCH (RFC822.SIZE, FLAGS, BODY.PEEK[], BODY.PEEK[]<início.tamanho>
+# e BODY.PEEK[HEADER.FIELDS (...)]), NOOP e LOGOUT. Qualquer usuário e senha são aceitos.
+
+# Separador hierárquico anunciado no LIST
+HIERARCHY_DELIMITER = "."
+
+FETCH_HEADER_FIELDS_RE = re.compile(r"BODY(?:\.PEEK)?\[HEADER\.FIELDS \(([^)]*)\)\]", re.I)
+FETCH_BODY_RE = re.compile(r"BODY(?:\.PEEK)?\[\](?:<(\d+)\.(\d+)>)?", re.I)
+
+
+class FakeImapServer(socketserver.ThreadingTCPServer):
+    """
+    Servidor IMAP de teste, uma thread por conexão, em 127.0.0.1 e porta livre.
+
+    'mailboxes' mapeia o nome de cada pasta para a lista de mensagens [(flags, bytes),
+    ...]; os UIDs são atribuídos em ordem, de 'uid_step' em 'uid_step', para que os
+    intervalos de UIDs não coincidam com os números de sequência. Com 'ssl_context'
+    (contexto de servidor), as conexões usam TLS; com compress=False, COMPRESS=DEFLATE
+    não é anunciado. Os comandos recebidos ficam em 'commands' e o número de sessões
+    que ativaram a compressão, em 'compressed_sessions'. Cada mensagem cujo conteúdo
+    (BODY[], ou a sua primeira parte) foi devolvido é registrada em 'fetched_bodies' como
+    (pasta, UID). As mensagens de 'fail_fetch', um conjunto de (pasta, UID), ficam de fora
+    das respostas de UID FETCH que pedem o conteúdo, como uma falha de FETCH; 'uidvalidity'
+    e 'mailboxes' podem ser alterados entre duas execuções.
+
+    Uso:
+        with FakeImapServer({"INBOX": [("\\\\Seen", raw)]}) as server:
+            ... conectar a 127.0.0.1:server.port ...
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, mailboxes: dict, compress: bool = True, ssl_context=None,
+                 uidvalidity: int = 1, uid_step: int = 3):
+        super().__init__(("127.0.0.1", 0), FakeImapHandler)
+        self.mailboxes = {
+            name: {index * uid_step: message for index, message in enumerate(messages, start=1)}
+            for name, messages in mailboxes.items()
+        }
+        self.compress = compress
+        self.ssl_context = ssl_context
+        self.uidvalidity = uidvalidity
+        self.commands = []
+        self.compressed_sessions = 0
+        self.fail_fetch = set()
+        self.fetched_bodies = []
+        self.lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    @property
+    def capabilities(self) -> str:
+        return "IMAP4rev1 LITERAL+" + (" COMPRESS=DEFLATE" if self.compress else "")
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name="fake-imap", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def get_request(self):
+        sock, address = super().get_request()
+        if self.ssl_context is not None:
+            # O handshake é feito na thread da conexão (FakeImapHandler.setup)
+            sock = self.ssl_context.wrap_socket(sock, server_side=True, do_handshake_on_connect=False)
+        return sock, address
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+class FakeImapHandler(socketserver.BaseRequestHandler):
+    """
+    Uma sessão IMAP do FakeImapServer. Depois de COMPRESS DEFLATE, as duas direções
+    passam pela camada zlib (deflate puro, com Z_SYNC_FLUSH ao final de cada resposta).
+    """
+
+    def setup(self):
+        if self.server.ssl_context is not None:
+            self.request.do_handshake()
+        self._buffer = b""
+        self._compressor = None
+        self._decompressor = None
+        self._selected = None
+
+    def handle(self):
+        self.send(f"* OK [CAPABILITY {self.server.capabilities}] servidor de teste pronto\r\n".encode())
+        while True:
+            line = self.readline()
+            if not line:
+                return
+            line = line.decode("utf-8", errors="replace").rstrip("\r\n")
+            with self.server.lock:
+                self.server.commands.append(line)
+            tag, _, rest = line.partition(" ")
+            command, _, args = rest.partition(" ")
+            command = command.upper()
+            if command == "LOGOUT":
+                self.send(f"* BYE até logo\r\n{tag} OK LOGOUT concluído\r\n".encode())
+                return
+            handler = getattr(self, f"do_{command}", None)
+            if handler is None:
+                self.send(f"{tag} BAD comando desconhecido\r\n".encode())
+                continue
+            handler(tag, args)
+
+    def send(self, data: bytes):
+        if self._compressor is not None:
+            data = self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+        self.request.sendall(data)
+
+    def readline(self) -> bytes:
+        while b"\n" not in self._buffer:
+            chunk = self.request.recv(65536)
+            if not chunk:
+                return b""
+            if self._decompressor is not None:
+                chunk = self._decompressor.decompress(chunk)
+            self._buffer += chunk
+        index = self._buffer.index(b"\n") + 1
+        line, self._buffer = self._buffer[:index], self._buffer[index:]
+        return line
+
+    def do_CAPABILITY(self, tag, args):
+        self.send(f"* CAPABILITY {self.server.capabilities}\r\n{tag} OK CAPABILITY concluído\r\n".encode())
+
+    def do_NOOP(self, tag, args):
+        self.send(f"{tag} OK NOOP concluído\r\n".encode())
+
+    def do_LOGIN(self, tag, args):
+        self.send(f"{tag} OK [CAPABILITY {self.server.capabilities}] autenticado\r\n".encode())
+
+    def do_COMPRESS(self, tag, args):
+        if not self.server.compress or args.upper() != "DEFLATE":
+            self.send(f"{tag} NO compressão não suportada\r\n".encode())
+            return
+        self.send(f"{tag} OK DEFLATE ativo\r\n".encode())
+        # O cliente só envia dados comprimidos depois desta resposta: o buffer está vazio
+        self._compressor = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+        self._decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        with self.server.lock:
+            self.server.compressed_sessions += 1
+
+    def do_LIST(self, tag, args):
+        response = b"".join(
+            f'* LIST (\\HasNoChildren) "{HIERARCHY_DELIMITER}" "{name}"\r\n'.encode()
+            for name in self.server.mailboxes
+        )
+        self.send(response + f"{tag} OK LIST concluído\r\n".encode())
+
+    def do_SELECT(self, tag, args):
+        name = args.strip().strip('"')
+        messages = self.server.mailboxes.get(name)
+        if messages is None:
+            self.send(f"{tag} NO pasta inexistente\r\n".encode())
+            return
+        self._selected = name
+        self.send((
+            f"* {len(messages)} EXISTS\r\n* 0 RECENT\r\n"
+            f"* OK [UIDVALIDITY {self.server.uidvalidity}] UIDs válidos\r\n"
+            f"* OK [UIDNEXT {self.uidnext(messages)}] próximo UID\r\n"
+            f"{tag} OK [READ-WRITE] pasta selecionada\r\n"
+        ).encode())
+
+    do_EXAMINE = do_SELECT
+
+    def do_STATUS(self, tag, args):
+        match = re.match(r'"?(.*?)"? \((.*)\)', args)
+        if match is None or match.group(1) not in self.server.mailboxes:
+            self.send(f"{tag} NO pasta inexistente\r\n".encode())
+            return
+        name = match.group(1)
+        messages = self.server.mailboxes[name]
+        values = {"MESSAGES": len(messages), "UIDNEXT": self.uidnext(messages),
+                  "UIDVALIDITY": self.server.uidvalidity, "RECENT": 0, "UNSEEN": 0}
+        items = " ".join(f"{item} {values[item]}" for item in match.group(2).upper().split() if item in values)
+        self.send(f'* STATUS "{name}" ({items})\r\n{tag} OK STATUS concluído\r\n'.encode())
+
+    def do_UID(self, tag, args):
+        command, _, args = args.partition(" ")
+        command = command.upper()
+        if self._selected is None:
+            self.send(f"{tag} BAD nenhuma pasta selecionada\r\n".encode())
+        elif command == "SEARCH":
+            self.uid_search(tag, args)
+        elif command == "FETCH":
+            self.uid_fetch(tag, args)
+        else:
+            self.send(f"{tag} BAD comando UID desconhecido\r\n".encode())
+
+    def uid_search(self, tag, args):
+        uids = sorted(self.server.mailboxes[self._selected])
+        criteria = args.split()
+        if len(criteria) >= 2 and criteria[0].upper() == "UID":
+            uids = parse_uid_set(criteria[1], uids)
+        self.send(f"* SEARCH {' '.join(map(str, uids))}\r\n{tag} OK SEARCH concluído\r\n".encode())
+
+    def uid_fetch(self, tag, args):
+        messages = self.server.mailboxes[self._selected]
+        uids = sorted(messages)
+        uid_set, _, items = args.partition(" ")
+        items_upper = items.upper()
+        header_fields = FETCH_HEADER_FIELDS_RE.search(items)
+        body = FETCH_BODY_RE.search(items)
+        for uid in parse_uid_set(uid_set, uids):
+            if body is not None and (self._selected, uid) in self.server.fail_fetch:
+                continue
+            flags, raw = messages[uid]
+            parts = [f"UID {uid}".encode()]
+            if "RFC822.SIZE" in items_upper:
+                parts.append(f"RFC822.SIZE {len(raw)}".encode())
+            if "FLAGS" in items_upper:
+                parts.append(f"FLAGS ({flags})".encode())
+            if header_fields is not None:
+                literal = select_header_fields(raw, header_fields.group(1).split())
+                parts.append(f"BODY[HEADER.FIELDS ({header_fields.group(1)})] {{{len(literal)}}}\r\n".encode() + literal)
+            if body is not None:
+                if body.group(1) is None or body.group(1) == "0":
+                    with self.server.lock:
+                        self.server.fetched_bodies.append((self._selected, uid))
+                if body.group(1) is not None:
+                    start = int(body.group(1))
+                    literal = raw[start:start + int(body.group(2))]
+                    parts.append(f"BODY[]<{start}> {{{len(literal)}}}\r\n".encode() + literal)
+                else:
+                    parts.append(f"BODY[] {{{len(raw)}}}\r\n".encode() + raw)
+            sequence = uids.index(uid) + 1
+            self.send(f"* {sequence} FETCH (".encode() + b" ".join(parts) + b")\r\n")
+        self.send(f"{tag} OK FETCH concluído\r\n".encode())
+
+    @staticmethod
+    def uidnext(messages: dict) -> int:
+        return max(messages) + 1 if messages else 1
+
+
+def parse_uid_set(uid_set: str, uids: list) -> list:
+    """
+    Retorna, em ordem crescente, os UIDs de 'uids' contidos no conjunto IMAP 'uid_set'
+    (ex.: "3,6:9,12:*"). Como na RFC 3501, "*" é o maior UID da pasta, de modo que
+    "n:*" inclui o maior UID mesmo quando ele é menor que n.
+    """
+    highest = uids[-1] if uids else 0
+    selected = set()
+    for part in uid_set.split(","):
+        first, _, last = part.partition(":")
+        low = highest if first == "*" else int(first)
+        high = low if not last else highest if last == "*" else int(last)
+        low, high = min(low, high), max(low, high)
+        selected.update(uid for uid in uids if low <= uid <= high)
+    return sorted(selected)
+
+
+def select_header_fields(raw: bytes, fields) -> bytes:
+    """
+    Retorna as linhas de cabeçalho de 'raw' cujos nomes estão em 'fields' (sem
+    distinção de maiúsculas), seguidas da linha em branco, como BODY[HEADER.FIELDS].
+    """
+    wanted = {field.lower().encode("ascii") for field in fields}
+    header_block = raw.split(b"\r\n\r\n", 1)[0]
+    lines = [line for line in header_block.split(b"\r\n") if line.split(b":", 1)[0].strip().lower() in wanted]
+    return b"".join(line + b"\r\n" for line in lines) + b"\r\n"
@@ -0,0 +1,100 @@
+import imaplib
+import zlib
+
+# O imaplib só envia comandos que conhece; COMPRESS é válido após a autenticação
+imaplib.Commands.setdefault("COMPRESS", ("AUTH", "SELECTED"))
+
+# Tamanho de cada leitura do socket com a compressão ativa
+READ_SIZE = 64 * 1024
+
+
+class DeflateMixin:
+    """
+    Extensão COMPRESS=DEFLATE (RFC 4978) para as classes do imaplib. Após
+    enable_compression(), os comandos enviados passam por um compressor zlib (deflate
+    bruto, com Z_SYNC_FLUSH ao fim de cada envio) e as respostas recebidas, por um
+    descompressor, substituindo read(), readline() e send() do imaplib; o restante da
+    interface não muda.
+
+    'compressed_bytes_in' e 'decompressed_bytes_in' contam os bytes recebidos pela rede
+    e os bytes de resposta após a descompressão, para medir a economia obtida.
+    """
+
+    _deflate = None
+    _inflate = None
+    compressed_bytes_in = 0
+    decompressed_bytes_in = 0
+
+    def enable_compression(self) -> bool:
+        """
+        Ativa a compressão se o servidor anunciar COMPRESS=DEFLATE. As capacidades são
+        consultadas novamente, pois muitos servidores só anunciam a extensão após o login.
+        Retorna True se a compressão estiver ativa.
+        """
+        if self._inflate is not None:
+            return True
+        typ, dat = self.capability()
+        if typ == "OK" and dat and dat[-1]:
+            self.capabilities = tuple(dat[-1].decode("ascii").upper().split())
+        if "COMPRESS=DEFLATE" not in self.capabilities:
+            return False
+        typ, _ = self._simple_command("COMPRESS", "DEFLATE")
+        if typ != "OK":
+            return False
+        self._deflate = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+        self._inflate = zlib.decompressobj(-15)
+        self._inflated = bytearray()
+        return True
+
+    def read(self, size):
+        if self._inflate is None:
+            return super().read(size)
+        while len(self._inflated) < size and self._fill():
+            pass
+        data = bytes(self._inflated[:size])
+        del self._inflated[:size]
+        return data
+
+    def readline(self):
+        if self._inflate is None:
+            return super().readline()
+        start = 0
+        while True:
+            end = self._inflated.find(b"\n", start)
+            if end >= 0:
+                end += 1
+                break
+            if len(self._inflated) > imaplib._MAXLINE:
+                raise self.error(f"got more than {imaplib._MAXLINE} bytes")
+            start = len(self._inflated)
+            if not self._fill():
+                # Conexão encerrada: o imaplib trata a linha incompleta (ou vazia) como EOF
+                end = len(self._inflated)
+                break
+        line = bytes(self._inflated[:end])
+        del self._inflated[:end]
+        return line
+
+    def send(self, data):
+        if self._deflate is not None:
+            data = self._deflate.compress(data) + self._deflate.flush(zlib.Z_SYNC_FLUSH)
+        super().send(data)
+
+    def _fill(self) -> bool:
+        # read1 entrega primeiro o que já está no buffer do arquivo e depois lê do socket
+        raw = self.file.read1(READ_SIZE)
+        if not raw:
+            return False
+        data = self._inflate.decompress(raw)
+        self.compressed_bytes_in += len(raw)
+        self.decompressed_bytes_in += len(data)
+        self._inflated += data
+        return True
+
+
+class IMAP4Deflate(DeflateMixin, imaplib.IMAP4):
+    """imaplib.IMAP4 com suporte a COMPRESS=DEFLATE."""
+
+
+class IMAP4SSLDeflate(DeflateMixin, imaplib.IMAP4_SSL):
+    """imaplib.IMAP4_SSL com suporte a COMPRESS=DEFLATE."""
@@ -0,0 +1,162 @@
+import atexit
+import copy
+import json
+import logging
+import queue
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+# Campos estruturados gravados no JSON quando presentes no registro (filtros ou 'extra')
+STRUCTURED_FIELDS = ("account", "folder", "uid", "bytes", "latency")
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """
+    Formata cada registro como um objeto JSON por linha, com data, nível, thread,
+    mensagem e os campos de STRUCTURED_FIELDS informados no registro.
+    """
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        for field in STRUCTURED_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None and value != "-":
+                entry[field] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class DeferredFormatQueueHandler(QueueHandler):
+    """
+    QueueHandler que, ao enfileirar, apenas junta a mensagem aos seus argumentos: o
+    traceback (exc_info) e a pilha (stack_info) seguem no registro e são formatados pela
+    thread do listener, e não pela thread de download. O QueueHandler padrão formata a
+    exceção na thread de origem e a funde à mensagem, o que também deixava vazio o campo
+    "exception" do JsonLinesFormatter.
+
+    Os registros ficam na memória do processo (a fila não é serializada), de modo que o
+    exc_info pode ser mantido como está.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        return record
+
+
+class DebugRateLimitFilter(logging.Filter):
+    """
+    Limita os registros de nível DEBUG (eventos por mensagem) a 'max_per_second' por
+    segundo, somados entre todas as threads. Os excedentes são descartados antes de
+    entrar na fila, de modo que o custo do log não cresce com o número de workers.
+    """
+
+    def __init__(self, max_per_second: int):
+        super().__init__()
+        self.max_per_second = max_per_second
+        self.dropped = 0
+        self._window = None
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG:
+            return True
+        window = int(time.monotonic())
+        with self._lock:
+            if window != self._window:
+                self._window = window
+                self._count = 0
+            if self._count >= self.max_per_second:
+                self.dropped += 1
+                return False
+            self._count += 1
+        return True
+
+
+# Thread que grava os registros enfileirados, o handler da fila no logger raiz e o filtro
+# de depuração em uso
+_listener = None
+_queue_handler = None
+_debug_filter = None
+_listener_lock = threading.Lock()
+
+
+def start_logging(handlers, level=logging.INFO, context_filter: logging.Filter = None,
+                  debug_max_per_second: int = 0) -> logging.Logger:
+    """
+    Substitui os handlers do logger raiz por um QueueHandler: as threads apenas
+    enfileiram os registros, e uma thread dedicada (QueueListener) os formata e os grava
+    nos 'handlers' (console, arquivos), fora das threads de download.
+
+    'context_filter' é executado na thread de origem, antes do enfileiramento, para
+    capturar o contexto dela (ex.: conta e pasta). Com 'debug_max_per_second', os
+    registros DEBUG passam por DebugRateLimitFilter.
+    """
+    global _listener, _queue_handler, _debug_filter
+    stop_logging()
+    logger = logging.getLogger()
+    logger.setLevel(level)
+    while logger.handlers:
+        handler = logger.handlers[0]
+        logger.removeHandler(handler)
+        # Handlers deixados no logger raiz por um stop_logging anterior
+        if handler not in handlers:
+            handler.close()
+    log_queue = queue.SimpleQueue()
+    queue_handler = DeferredFormatQueueHandler(log_queue)
+    debug_filter = None
+    if debug_max_per_second:
+        debug_filter = DebugRateLimitFilter(debug_max_per_second)
+        queue_handler.addFilter(debug_filter)
+    if context_filter is not None:
+        queue_handler.addFilter(context_filter)
+    logger.addHandler(queue_handler)
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    with _listener_lock:
+        _listener = listener
+        _queue_handler = queue_handler
+        _debug_filter = debug_filter
+    return logger
+
+
+def stop_logging():
+    """
+    Grava os registros ainda na fila e encerra a thread do listener. Chamada também ao
+    final do processo.
+
+    Os handlers do listener voltam ao logger raiz no lugar do QueueHandler (com o filtro
+    de contexto), de modo que os registros posteriores, como os do atexit, são gravados
+    diretamente em vez de ficarem em uma fila sem leitor. O fechamento deles fica a
+    cargo do logging.shutdown, ao final do processo.
+    """
+    global _listener, _queue_handler, _debug_filter
+    with _listener_lock:
+        listener, _listener = _listener, None
+        queue_handler, _queue_handler = _queue_handler, None
+        debug_filter, _debug_filter = _debug_filter, None
+    if listener is None:
+        return
+    if debug_filter is not None and debug_filter.dropped:
+        logging.info(f"{debug_filter.dropped} eventos de depuração descartados pelo limite por segundo.")
+    listener.stop()
+    logger = logging.getLogger()
+    logger.removeHandler(queue_handler)
+    context_filters = [f for f in queue_handler.filters if f is not debug_filter]
+    for handler in listener.handlers:
+        for context_filter in context_filters:
+            handler.addFilter(context_filter)
+        logger.addHandler(handler)
+
+
+atexit.register(stop_logging)
@@ -1,15 +1,32 @@
+import asyncio
+import contextvars
 import imaplib
-import email
+import itertools
+import json
 import os
 import time
 import logging
 import re
 import socket
-import shutil
+import threading
 import unicodedata  # para normalização Unicode
+from concurrent.futures import ProcessPoolExecutor
 from email.header import decode_header
+from email.parser import BytesHeaderParser
 from logging.handlers import RotatingFileHandler
 
+from aioimap import AsyncIMAPClient, ThreadedIMAPClient
+from archive_state import ArchiveState
+from blob_store import BlobStore
+from log_pipeline import JsonLinesFormatter, start_logging, stop_logging
+from metrics import MetricsExporter, metrics
+from name_index import release_directory_index, safe_move
+from profiling import run_profiled
+from server_controller import ServerController
+from upload_state import UploadState
+from uploader_ftp import UploadPipeline
+from write_behind import WriteBehindPool, fsync_files
+
 # CONFIGURAÇÃO GLOBAL DO SOCKET
 socket.setdefaulttimeout(120)
 
@@ -17,6 +34,12 @@ socket.setdefaulttimeout(120)
 IMAP_SERVER = ""  # Endereço do servidor IMAP
 IMAP_PORT = 143                  # Porta padrão IMAP (143 para STARTTLS, 993 para SSL)
 USE_SSL = False                  # Se True, usará IMAP4_SSL; caso contrário, IMAP4 normal
+# Motor IMAP: "imaplib" (cada sessão conduzida pelo imaplib bloqueante, em uma thread própria)
+# ou "asyncio" (cliente asyncio do aioimap.py, sem uma thread por sessão). Nos dois casos, as
+# contas e as pastas rodam como corrotinas em um único laço de eventos.
+IMAP_ENGINE = "imaplib"
+# Se True, ativa a compressão COMPRESS=DEFLATE (RFC 4978) quando o servidor a oferece
+IMAP_COMPRESS = True
 IMAP_PASSWORD = ""      # Senha de acesso
 
 # Lista de contas de e-mail a serem arquivadas
@@ -29,24 +52,192 @@ MAILSTORE_HOME = ""
 
 # Número de retentativas de FETCH em caso de falha de conexão
 FETCH_RETRIES = 3
-FETCH_DELAY = 5  # segundos de espera entre as tentativas
 
-# Número máximo de reconexões ao servidor, caso o socket caia
-MAX_RECONNECTS = 3
+# Número máximo de reconexões consecutivas sem nenhum e-mail recebido; a cada e-mail
+# gravado a contagem recomeça, de modo que uma pasta só é abandonada se o servidor
+# ficar indisponível
+MAX_RECONNECTS = 5
+
+# ESPERA ENTRE TENTATIVAS E DISJUNTOR POR SERVIDOR
+# A espera dobra a cada falha consecutiva (com variação aleatória) até BACKOFF_MAX_DELAY.
+# Após BREAKER_FAILURE_THRESHOLD falhas consecutivas no servidor, todas as sessões
+# aguardam BREAKER_COOLDOWN segundos (que dobra a cada nova abertura) antes de retomar.
+BACKOFF_BASE_DELAY = 1
+BACKOFF_MAX_DELAY = 60
+BREAKER_FAILURE_THRESHOLD = 5
+BREAKER_COOLDOWN = 30
+
+# SINCRONIZAÇÃO INCREMENTAL
+INCREMENTAL_SYNC = True              # Se True, baixa apenas os UIDs novos desde a última execução
+SYNC_STATE_DB = "archive_state.db"   # Banco SQLite com o UIDVALIDITY e o último UID de cada pasta
+# UIDs que o servidor não devolveu (ou que não puderam ser gravados) não bloqueiam o
+# progresso da pasta: ficam registrados e são repetidos sozinhos nas execuções seguintes,
+# até FAILED_UID_RETRIES tentativas.
+FAILED_UID_RETRIES = 5
+
+# ENTREGA MAILDIR
+# Cada e-mail é gravado em tmp/ e renomeado atomicamente para cur/, com nome único no padrão
+# Maildir e as flags IMAP no sufixo (ex.: ":2,FS"). Em sistemas de arquivos que não aceitam
+# ':' no nome (Windows), use outro separador, como "!".
+MAILDIR_INFO_SEPARATOR = ":"
+MAILDIR_TMP_MAX_AGE = 36 * 3600   # segundos; arquivos mais antigos em tmp/ são restos de falhas
+
+# DEDUPLICAÇÃO POR CONTEÚDO
+# Se definido, cada mensagem é gravada uma única vez (pelo SHA-256) neste diretório e as pastas
+# Maildir recebem hardlinks para ela. Para hardlinks, o diretório deve estar no mesmo sistema de
+# arquivos que MAILSTORE_HOME (mas fora dele, para não aparecer como pasta de e-mail).
+DEDUP_STORE_DIR = ""
+DEDUP_LINK_MODE = "hardlink"      # "hardlink", "reflink" (Btrfs/XFS) ou "copy"
+# Antes de baixar uma pasta, consulta Message-ID e RFC822.SIZE de todas as mensagens e apenas
+# liga localmente as que já estão no armazenamento (em qualquer pasta ou conta), sem baixá-las
+DEDUP_PREFETCH = True
+
+# STREAMING DE MENSAGENS GRANDES
+# Mensagens maiores que STREAM_THRESHOLD são baixadas em partes (BODY.PEEK[]<início.tamanho>)
+# gravadas direto em disco, mantendo o uso de memória constante e retomando da última parte
+# concluída após uma reconexão.
+STREAM_THRESHOLD = 20 * 1024 * 1024
+STREAM_CHUNK_SIZE = 4 * 1024 * 1024
+
+# GRAVAÇÃO EM SEGUNDO PLANO
+# Com WRITER_THREADS > 0, os e-mails recebidos em lote são gravados por um pool de threads
+# enquanto o FETCH seguinte já está em andamento, de modo que a latência do disco (ex.: NFS
+# ou SMB) não deixa o socket IMAP ocioso. Os bytes aguardando gravação são limitados a
+# WRITE_BEHIND_MAX_BYTES; acima disso, o download aguarda o disco.
+WRITER_THREADS = 4
+WRITE_BEHIND_MAX_BYTES = 128 * 1024 * 1024
+# Se True, os e-mails gravados são sincronizados com o disco (fsync) em grupo, antes de cada
+# registro de progresso da pasta no banco de estado, em vez de arquivo por arquivo
+WRITE_FSYNC = False
+
+# EXTRAÇÃO DE CABEÇALHOS EM PROCESSOS
+# Com METADATA_WORKERS > 0, a leitura dos cabeçalhos usada pelo índice de deduplicação
+# (Message-ID, assunto, remetente e data, com a decodificação de charsets) é feita por um
+# pool de processos, fora do GIL das threads de download. Apenas o bloco de cabeçalhos de
+# cada mensagem é enviado aos processos, em lote a cada registro de progresso da pasta.
+METADATA_WORKERS = 0
+
+# PIPELINE DE UPLOAD
+# Se True, cada e-mail entregue é enviado ao servidor FTP/FTPS configurado em uploader_ftp.py
+# (mantendo a estrutura de MAILSTORE_HOME sob REMOTE_PATH) enquanto o download prossegue.
+# O download é pausado quando os bytes aguardando upload excedem PIPELINE_MAX_PENDING_BYTES.
+PIPELINE_UPLOAD = False
+PIPELINE_UPLOAD_WORKERS = 2
+PIPELINE_MAX_PENDING_BYTES = 512 * 1024 * 1024
+PIPELINE_DELETE_AFTER_UPLOAD = False   # Remove o arquivo local após o upload (uso como área temporária)
+PIPELINE_STATE_DB = "upload_state.db"  # Diário dos uploads, para retomar os interrompidos ("" desativa)
+
+# FETCH EM LOTES
+# Cada UID FETCH busca vários e-mails de uma vez, limitado pelo total de bytes (RFC822.SIZE)
+# e pelo número de mensagens, reduzindo o número de viagens de ida e volta ao servidor.
+FETCH_BATCH_MAX_BYTES = 20 * 1024 * 1024
+FETCH_BATCH_MAX_MESSAGES = 500
+
+# EXECUÇÃO CONCORRENTE
+ACCOUNT_WORKERS = 1               # Número de contas arquivadas em paralelo (1 = execução serial)
+MAX_CONNECTIONS_PER_SERVER = 8    # Limite de conexões IMAP simultâneas por servidor
+# O número de conexões começa em INITIAL_CONNECTIONS_PER_SERVER e é ajustado (AIMD) pelas
+# falhas e pela latência observadas, sem passar de MAX_CONNECTIONS_PER_SERVER
+INITIAL_CONNECTIONS_PER_SERVER = 2
+LATENCY_TOLERANCE = 3.0           # FETCH N vezes mais lentos que o esperado (ida e volta + vazão) reduzem as conexões
+ACCOUNT_DELAY = 2                 # segundos de espera entre contas na execução serial
+FOLDER_WORKERS = 1                # Sessões IMAP por conta para baixar pastas em paralelo
+
+# LOG
+# Os registros são enfileirados pelas threads de download e gravados por uma thread própria.
+# Com LOG_LEVEL = "DEBUG", são registrados também os eventos por mensagem e por FETCH (UID,
+# bytes e latência), limitados a LOG_DEBUG_MAX_PER_SECOND por segundo.
+LOG_LEVEL = "INFO"
+LOG_DEBUG_MAX_PER_SECOND = 50
+LOG_JSON_FILE = ""                # Se definido, grava também os registros em JSON lines (conta, pasta, UID, bytes, latência)
+
+# PLANEJAMENTO E PROGRESSO
+# Com PLAN_BEFORE_RUN, antes de baixar, mede cada conta e pasta com STATUS (MESSAGES UIDNEXT)
+# e UID FETCH (RFC822.SIZE) dos UIDs ainda não arquivados e dos que serão repetidos, grava o
+# plano em PLAN_FILE e distribui as contas e pastas entre os workers das maiores para as
+# menores. Durante a execução, o progresso (e-mails, MB, MB/s e tempo restante estimado) é
+# registrado a cada PROGRESS_INTERVAL segundos. O planejamento custa uma sessão a mais por
+# conta e repete o STATUS, o EXAMINE e o FETCH RFC822.SIZE que o download faz em seguida,
+# por isso fica desativado por padrão.
+PLAN_BEFORE_RUN = False
+PLAN_FILE = "archive_plan.json"
+PLAN_ONLY = False                 # Se True, apenas gera o plano, sem baixar os e-mails
+PROGRESS_INTERVAL = 10
+
+# MÉTRICAS E PERFIL
+# Contadores e histogramas de latência por conta e pasta: conexão, login, LIST, SELECT,
+# STATUS, consulta dos UIDs, FETCH, extração de cabeçalhos e gravação em disco (e o
+# upload FTP, no pipeline). São gravados ao final da execução e, com METRICS_INTERVAL,
+# também periodicamente durante ela.
+METRICS_PROM_FILE = ""            # Arquivo .prom para o textfile collector do node_exporter ("" desativa)
+METRICS_JSON_FILE = "archive_metrics.json"  # Relatório JSON com contagens, médias e percentis ("" desativa)
+METRICS_INTERVAL = 60             # Segundos entre gravações durante a execução (0 = apenas ao final)
+# Perfil da execução inteira: "cprofile" (estatísticas pstats, só a thread principal) ou
+# "sampling" (pilhas de todas as threads amostradas, formato collapsed para flame graphs)
+PROFILE_MODE = ""
+PROFILE_FILE = "archive_profile.out"
 
 
 # INICIALIZAÇÃO DO LOG
 
+# Contexto de log da tarefa asyncio (ou da thread) atual: conta e pasta em processamento.
+# As tarefas asyncio e asyncio.to_thread herdam uma cópia dele.
+_log_account = contextvars.ContextVar("log_account", default="-")
+_log_folder = contextvars.ContextVar("log_folder", default=None)
+
+class AccountContextFilter(logging.Filter):
+    """
+    Acrescenta a cada registro de log os campos 'account' e 'folder', com a conta e a
+    pasta processadas pela thread (ou tarefa asyncio) que gerou o registro, para separar
+    as mensagens de contas em paralelo.
+    """
+
+    def filter(self, record):
+        record.account = _log_account.get()
+        record.folder = _log_folder.get()
+        return True
+
+def set_log_account(email_account):
+    """
+    Define (ou limpa, com None) a conta associada aos logs da thread atual.
+    """
+    _log_account.set(email_account if email_account else "-")
+
+def set_log_folder(mailbox_name):
+    """
+    Define (ou limpa, com None) a pasta associada aos logs da thread atual.
+    """
+    _log_folder.set(mailbox_name)
+
+def metric_labels(**labels) -> dict:
+    """
+    Retorna os rótulos das métricas registradas pela thread atual: a conta e a pasta do
+    contexto de log, acrescidos de 'labels' (ex.: a operação IMAP).
+    """
+    return {
+        "account": _log_account.get(),
+        "folder": _log_folder.get() or "-",
+        **labels,
+    }
+
+metrics.describe("maildownloader_imap_seconds",
+                 "Latência das operações IMAP (connect, login, compress, list, select, status, search, fetch, fetch_chunk).")
+metrics.describe("maildownloader_imap_errors_total", "Operações IMAP que falharam.")
+metrics.describe("maildownloader_fetch_bytes_total", "Bytes de mensagens recebidos por FETCH.")
+metrics.describe("maildownloader_parse_seconds", "Tempo de extração dos cabeçalhos de cada e-mail para o índice.")
+metrics.describe("maildownloader_write_seconds", "Tempo de cada gravação de e-mail (ou parte de e-mail) em disco.")
+metrics.describe("maildownloader_write_errors_total", "Gravações de e-mail em disco que falharam.")
+metrics.describe("maildownloader_messages_total", "E-mails gravados na Maildir (linked=\"1\": ligados a partir do armazenamento deduplicado).")
+metrics.describe("maildownloader_message_bytes_total", "Bytes dos e-mails gravados na Maildir.")
+metrics.describe("maildownloader_message_errors_total", "E-mails que não puderam ser buscados no servidor.")
+
 def init_logger():
     """
-    Configura o logger global com StreamHandler e RotatingFileHandler,
-    removendo handlers existentes para evitar duplicações.
+    Configura o logger global: as threads enfileiram os registros (QueueHandler) e uma
+    thread própria os grava no console, no arquivo rotativo e, com LOG_JSON_FILE, em
+    JSON lines. Substitui os handlers existentes para evitar duplicações.
     """
-    logger = logging.getLogger()
-    logger.setLevel(logging.INFO)
-    while logger.handlers:
-        logger.removeHandler(logger.handlers[0])
-    log_format = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
+    log_format = logging.Formatter("%(asctime)s - %(levelname)s - [%(account)s] %(message)s")
     console_handler = logging.StreamHandler()
     console_handler.setFormatter(log_format)
     file_handler = RotatingFileHandler(
@@ -56,9 +247,22 @@ def init_logger():
         encoding="utf-8"
     )
     file_handler.setFormatter(log_format)
-    logger.addHandler(console_handler)
-    logger.addHandler(file_handler)
-    return logger
+    handlers = [console_handler, file_handler]
+    if LOG_JSON_FILE:
+        json_handler = RotatingFileHandler(
+            LOG_JSON_FILE,
+            maxBytes=20 * 1024 * 1024,
+            backupCount=5,
+            encoding="utf-8"
+        )
+        json_handler.setFormatter(JsonLinesFormatter())
+        handlers.append(json_handler)
+    return start_logging(
+        handlers,
+        level=logging.getLevelName(LOG_LEVEL),
+        context_filter=AccountContextFilter(),
+        debug_max_per_second=LOG_DEBUG_MAX_PER_SECOND
+    )
 
 
 # FUNÇÕES AUXILIARES
@@ -97,193 +301,1366 @@ def decode_subject(subject: str) -> str:
             decoded_subject += fragment
     return decoded_subject
 
-def sanitize_filename(name: str, default: str = "sem_assunto", max_length: int = 50) -> str:
+# Fim do bloco de cabeçalhos: primeira linha em branco, com quebras CRLF ou apenas LF
+HEADER_END_RE = re.compile(rb"\r?\n\r?\n")
+
+def split_header_block(raw_email: bytes) -> bytes:
+    """
+    Retorna apenas o bloco de cabeçalhos da mensagem (até a primeira linha em branco).
+    """
+    match = HEADER_END_RE.search(raw_email)
+    return raw_email[:match.start()] if match else raw_email
+
+def extract_message_metadata(raw_email: bytes) -> dict:
     """
-    Remove caracteres indesejados do nome de arquivo e limita o tamanho.
+    Extrai Subject (decodificado), Message-ID, Date e From lendo somente os cabeçalhos,
+    sem montar a árvore MIME do corpo e dos anexos.
     """
-    if not name:
-        name = default
-    name = re.sub(r"[^a-zA-Z0-9\s]", "", name)
-    name = "_".join(name.split())
-    return name[:max_length]
+    headers = BytesHeaderParser().parsebytes(split_header_block(raw_email))
+    return {
+        "subject": decode_subject(headers.get("subject", "sem_assunto")),
+        "message_id": (headers.get("message-id") or "").strip(),
+        "date": headers.get("date") or "",
+        "from": decode_subject(headers.get("from") or ""),
+    }
 
-def connect_imap_server(email_account: str, password: str, use_ssl: bool, host: str, port: int):
+def timed_extract_message_metadata(raw_email: bytes):
+    """
+    Executa extract_message_metadata e retorna (metadados, segundos gastos), para que o
+    tempo de extração seja medido também quando ela roda no pool de processos.
+    """
+    started = time.perf_counter()
+    metadata = extract_message_metadata(raw_email)
+    return metadata, time.perf_counter() - started
+
+def extract_message_id(header_block: bytes) -> str:
+    """
+    Extrai o Message-ID de um bloco de cabeçalhos (ex.: BODY[HEADER.FIELDS (MESSAGE-ID)]).
+    """
+    return (BytesHeaderParser().parsebytes(header_block).get("message-id") or "").strip()
+
+# Controladores que limitam as conexões simultâneas a cada servidor (host, porta)
+_server_controllers = {}
+_server_controllers_lock = threading.Lock()
+
+def get_server_controller(host: str, port: int) -> ServerController:
+    """
+    Retorna o controlador compartilhado que limita e ajusta as conexões simultâneas ao
+    servidor e regula as esperas entre tentativas.
+    """
+    with _server_controllers_lock:
+        controller = _server_controllers.get((host, port))
+        if controller is None:
+            controller = ServerController(
+                name=f"{host}:{port}",
+                max_sessions=MAX_CONNECTIONS_PER_SERVER,
+                initial_sessions=INITIAL_CONNECTIONS_PER_SERVER,
+                backoff_base=BACKOFF_BASE_DELAY,
+                backoff_max=BACKOFF_MAX_DELAY,
+                breaker_threshold=BREAKER_FAILURE_THRESHOLD,
+                breaker_cooldown=BREAKER_COOLDOWN,
+                latency_tolerance=LATENCY_TOLERANCE
+            )
+            _server_controllers[(host, port)] = controller
+        return controller
+
+async def connect_imap_server(email_account: str, password: str, use_ssl: bool, host: str, port: int,
+                              wait_slot: bool = True):
     """
     Conecta ao servidor IMAP e faz login na conta especificada.
     Realiza uma normalização do e-mail, removendo caracteres indesejados (como soft hyphen).
+
+    Aguarda uma vaga no limite adaptativo de conexões do servidor (ServerController);
+    a vaga é devolvida por close_imap_connection. Com wait_slot=False, retorna None
+    em vez de aguardar quando o limite já foi atingido.
+
+    Com IMAP_COMPRESS, ativa COMPRESS=DEFLATE após o login, se o servidor oferecer; os
+    bytes economizados são contabilizados para a conta em close_imap_connection.
+
+    O cliente retornado segue IMAP_ENGINE: ThreadedIMAPClient (imaplib) ou
+    AsyncIMAPClient (asyncio), com a mesma interface.
+    """
+    normalized_email = normalize_login(email_account)
+    controller = get_server_controller(host, port)
+    if not await controller.acquire_async(blocking=wait_slot):
+        return None
+    labels = metric_labels(account=email_account)
+    mail_conn = AsyncIMAPClient() if IMAP_ENGINE == "asyncio" else ThreadedIMAPClient()
+    try:
+        logging.info(f"Tentando login com: {normalized_email}")
+        try:
+            with metrics.timer("maildownloader_imap", op="connect", **labels):
+                await mail_conn.connect(host, port, use_ssl)
+        except imaplib.IMAP4.abort:
+            raise
+        except imaplib.IMAP4.error as e:
+            # Saudação recusada (ex.: "* BYE" por excesso de conexões): o servidor encerrou a sessão
+            raise imaplib.IMAP4.abort(f"conexão recusada pelo servidor: {e}") from e
+        with metrics.timer("maildownloader_imap", op="login", **labels):
+            await mail_conn.login(normalized_email, password)
+        if IMAP_COMPRESS:
+            try:
+                with metrics.timer("maildownloader_imap", op="compress", **labels):
+                    compressed = await mail_conn.compress()
+                if compressed:
+                    mail_conn.compression_account = email_account
+            except imaplib.IMAP4.abort:
+                raise
+            except imaplib.IMAP4.error as e:
+                logging.warning(f"Não foi possível ativar a compressão IMAP: {e}")
+    except BaseException as e:
+        mail_conn.close()
+        # Recusas e quedas de conexão contam como falha do servidor; credenciais inválidas, não
+        if isinstance(e, (imaplib.IMAP4.abort, socket.error)):
+            controller.record_failure()
+        controller.release()
+        raise
+    mail_conn.server_controller = controller
+    return mail_conn
+
+def normalize_login(email_account: str) -> str:
+    """
+    Retorna o endereço de e-mail usado no login, sem caracteres indesejados.
     """
     # Normaliza o endereço de e-mail para remover caracteres indesejados
     normalized_email = unicodedata.normalize('NFKC', email_account)
     # Remove explicitamente o soft hyphen
-    normalized_email = normalized_email.replace('\xad', '')
-    logging.info(f"Tentando login com: {normalized_email}")
-    if use_ssl:
-        mail_conn = imaplib.IMAP4_SSL(host, port)
-    else:
-        mail_conn = imaplib.IMAP4(host, port)
-    mail_conn.login(normalized_email, password)
-    return mail_conn
+    return normalized_email.replace('\xad', '')
+
+async def connect_with_backoff(email_account: str, password: str, use_ssl: bool, host: str, port: int):
+    """
+    Conecta como connect_imap_server, repetindo até MAX_RECONNECTS vezes, com as esperas
+    do controlador do servidor, quando a conexão cai ou é recusada. Erros de login não
+    são repetidos.
+    """
+    controller = get_server_controller(host, port)
+    attempt = 0
+    while True:
+        try:
+            return await connect_imap_server(email_account, password, use_ssl, host, port)
+        except (imaplib.IMAP4.abort, socket.error) as e:
+            attempt += 1
+            if attempt >= MAX_RECONNECTS:
+                raise
+            logging.warning(f"Falha ao conectar (tentativa {attempt}/{MAX_RECONNECTS}): {e}")
+            await controller.backoff_async(attempt)
+
+# Bytes recebidos com compressão por conta: [bytes pela rede, bytes descomprimidos]
+_compression_stats = {}
+_compression_stats_lock = threading.Lock()
+
+def record_compression_stats(email_account: str, compressed_bytes: int, decompressed_bytes: int):
+    """
+    Acumula os bytes recebidos por uma sessão comprimida da conta.
+    """
+    with _compression_stats_lock:
+        stats = _compression_stats.setdefault(email_account, [0, 0])
+        stats[0] += compressed_bytes
+        stats[1] += decompressed_bytes
+
+def pop_compression_stats(email_account: str):
+    """
+    Retorna e descarta (bytes pela rede, bytes descomprimidos) acumulados para a conta,
+    ou None se nenhuma sessão da conta usou compressão.
+    """
+    with _compression_stats_lock:
+        stats = _compression_stats.pop(email_account, None)
+    return tuple(stats) if stats is not None else None
+
+async def close_imap_connection(mail):
+    """
+    Encerra a sessão IMAP (ignorando erros de uma conexão já caída) e libera a
+    vaga da conexão no limite por servidor.
+    """
+    try:
+        await mail.logout()
+    except Exception:
+        pass
+    release_imap_connection(mail)
+
+def release_imap_connection(mail):
+    """
+    Contabiliza os bytes recebidos com compressão pela sessão encerrada e libera a vaga
+    da conexão no limite por servidor.
+    """
+    account = getattr(mail, "compression_account", None)
+    if account is not None:
+        mail.compression_account = None
+        record_compression_stats(account, mail.compressed_bytes_in, mail.decompressed_bytes_in)
+    controller = getattr(mail, "server_controller", None)
+    if controller is not None:
+        mail.server_controller = None
+        controller.release()
 
-def safe_move(src: str, dst: str):
+class ImapSessionPool:
     """
-    Move o arquivo de src para dst. Se já existir um arquivo com o mesmo nome em dst,
-    adiciona um sufixo numérico para evitar sobrescrita.
+    Pool de sessões IMAP autenticadas de uma mesma conta, usado para baixar pastas em
+    paralelo. Cada sessão é um dicionário {"mail": conexão}, no mesmo formato do
+    'mail_ref' de download_mailbox, e portanto mantém o próprio SELECT e a própria
+    reconexão. Novas sessões são abertas sob demanda até 'size', apenas quando há
+    vaga livre no servidor; caso contrário, aguarda-se uma sessão ociosa. Quando o
+    controlador do servidor reduz o limite, as sessões excedentes são encerradas ao
+    serem devolvidas.
+
+    'tasks' é o número de pastas a baixar: depois que todas receberam uma sessão, as
+    sessões devolvidas são encerradas em vez de ficarem ociosas, para que a sua vaga
+    sirva às reconexões das pastas ainda em andamento (com o limite reduzido a uma
+    sessão, uma sessão ociosa impediria qualquer reconexão).
+
+    Como todas as pastas de uma conta rodam no mesmo laço de eventos, o estado do pool
+    dispensa travas.
     """
-    if os.path.exists(dst):
-        base, ext = os.path.splitext(os.path.basename(dst))
-        counter = 1
-        new_dst = os.path.join(os.path.dirname(dst), f"{base}_{counter}{ext}")
-        while os.path.exists(new_dst):
-            counter += 1
-            new_dst = os.path.join(os.path.dirname(dst), f"{base}_{counter}{ext}")
-        dst = new_dst
-    shutil.move(src, dst)
+
+    def __init__(self, primary_ref: dict, size: int, connect, tasks: int = None):
+        self._connect = connect
+        self._size = max(1, size)
+        self._idle = asyncio.Queue()
+        self._idle.put_nowait(primary_ref)
+        self._sessions = [primary_ref]
+        self._tasks = tasks
+
+    async def acquire(self) -> dict:
+        session = await self._acquire()
+        if self._tasks is not None:
+            self._tasks -= 1
+        return session
+
+    async def _acquire(self) -> dict:
+        while True:
+            try:
+                return self._idle.get_nowait()
+            except asyncio.QueueEmpty:
+                pass
+            if len(self._sessions) < self._size:
+                no_sessions = not self._sessions
+                session = {"mail": None}
+                self._sessions.append(session)
+                try:
+                    # Sem nenhuma sessão aberta, é seguro aguardar uma vaga no servidor
+                    session["mail"] = await self._connect(wait_slot=no_sessions)
+                except Exception as e:
+                    logging.warning(f"Não foi possível abrir uma nova sessão IMAP: {e}")
+                    if no_sessions:
+                        await self.discard(session)
+                        raise
+                if session["mail"] is not None:
+                    return session
+                await self.discard(session)
+            try:
+                return await asyncio.wait_for(self._idle.get(), timeout=1)
+            except asyncio.TimeoutError:
+                continue
+
+    async def release(self, session: dict):
+        controller = getattr(session["mail"], "server_controller", None)
+        if (self._tasks is not None and self._tasks <= 0) or (
+                len(self._sessions) > 1 and controller is not None and controller.over_limit()):
+            await self.discard(session)
+        else:
+            self._idle.put_nowait(session)
+
+    async def discard(self, session: dict):
+        """
+        Descarta uma sessão que ficou inutilizável, liberando espaço para uma nova.
+        """
+        if session in self._sessions:
+            self._sessions.remove(session)
+        if session["mail"] is not None:
+            await close_imap_connection(session["mail"])
+
+    async def close_all(self):
+        sessions, self._sessions = self._sessions, []
+        for session in sessions:
+            if session["mail"] is not None:
+                await close_imap_connection(session["mail"])
+
+async def get_mailbox_status(mail, mailbox_name: str, names=("MESSAGES",)) -> dict:
+    """
+    Consulta os itens 'names' da pasta via STATUS e retorna {item: valor}, sem os itens
+    que o servidor não informou (vazio se o STATUS falhar).
+    """
+    try:
+        with metrics.timer("maildownloader_imap", **metric_labels(op="status")):
+            status, data = await mail.status(mailbox_name, f"({' '.join(names)})")
+    except imaplib.IMAP4.error:
+        return {}
+    return parse_mailbox_status(status, data, names)
+
+def parse_mailbox_status(status, data, names) -> dict:
+    """
+    Extrai {item: valor} dos itens 'names' de uma resposta STATUS.
+    """
+    values = {}
+    if status == "OK" and data and data[0]:
+        for name in names:
+            match = re.search(rb"\b" + name.encode("ascii") + rb" (\d+)", data[0])
+            if match:
+                values[name] = int(match.group(1))
+    return values
+
+async def get_uidvalidity(mail, mailbox_name: str):
+    """
+    Retorna o UIDVALIDITY da pasta recém-selecionada, ou None se o servidor não o informar.
+    Usa a resposta não marcada do SELECT e, na falta dela, consulta o STATUS da pasta.
+    """
+    _, data = mail.response("UIDVALIDITY")
+    if data and data[0]:
+        return int(data[0])
+    try:
+        status, data = await mail.status(mailbox_name, "(UIDVALIDITY)")
+    except imaplib.IMAP4.error:
+        return None
+    return parse_mailbox_status(status, data, ("UIDVALIDITY",)).get("UIDVALIDITY")
 
 def restructure_mailbox_dir(local_mailbox_path: str):
     """
     Para pastas locais cujo nome não seja "cur":
       - Cria a subpasta "cur".
       - Move os arquivos que estão na raiz para a subpasta "cur".
+
+    Com a entrega direta em Maildir, só encontra arquivos na raiz em pastas baixadas
+    por versões anteriores (ou interrompidas no meio por elas).
     """
     if os.path.basename(local_mailbox_path) == "cur":
         return
     cur_subfolder = os.path.join(local_mailbox_path, "cur")
     create_folder(cur_subfolder)
-    for item in os.listdir(local_mailbox_path):
-        item_path = os.path.join(local_mailbox_path, item)
-        if os.path.isfile(item_path):
-            destination = os.path.join(cur_subfolder, item)
-            safe_move(item_path, destination)
+    try:
+        with os.scandir(local_mailbox_path) as entries:
+            files = [entry for entry in entries if entry.is_file()]
+        for entry in files:
+            destination = os.path.join(cur_subfolder, entry.name)
+            safe_move(entry.path, destination)
+    finally:
+        release_directory_index(cur_subfolder)
+
+# Flags IMAP e as letras correspondentes no nome do arquivo Maildir
+MAILDIR_FLAGS = {
+    "\\draft": "D",
+    "\\flagged": "F",
+    "$forwarded": "P",
+    "\\answered": "R",
+    "\\seen": "S",
+    "\\deleted": "T",
+}
+
+_maildir_sequence = itertools.count(1)
+_maildir_hostname = socket.gethostname().replace("/", "\\057").replace(":", "\\072")
+
+def get_maildir_path(user_base_dir: str, local_mailbox_name: str) -> str:
+    """
+    Retorna a raiz Maildir da pasta local. A pasta "cur" (INBOX) usa o próprio
+    diretório do usuário como raiz, de modo que seus e-mails continuam em '<usuário>/cur'.
+    """
+    if local_mailbox_name == "cur":
+        return user_base_dir
+    return os.path.join(user_base_dir, local_mailbox_name)
+
+def create_maildir(maildir_path: str):
+    """
+    Cria as subpastas tmp/, new/ e cur/ da Maildir e remove de tmp/ arquivos antigos
+    deixados por entregas interrompidas.
+    """
+    for subfolder in ("tmp", "new", "cur"):
+        create_folder(os.path.join(maildir_path, subfolder))
+    tmp_dir = os.path.join(maildir_path, "tmp")
+    limit = time.time() - MAILDIR_TMP_MAX_AGE
+    with os.scandir(tmp_dir) as entries:
+        for entry in entries:
+            try:
+                if entry.is_file() and entry.stat().st_mtime < limit:
+                    os.remove(entry.path)
+            except OSError as e:
+                logging.warning(f"Não foi possível remover o arquivo temporário '{entry.path}': {e}")
+
+def imap_flags_to_maildir(flags: str) -> str:
+    """
+    Converte as flags IMAP (ex.: "\\Seen \\Flagged") nas letras Maildir, em ordem ASCII (ex.: "FS").
+    """
+    letters = {MAILDIR_FLAGS[flag] for flag in (flags or "").lower().split() if flag in MAILDIR_FLAGS}
+    return "".join(sorted(letters))
+
+def make_maildir_unique_name() -> str:
+    """
+    Gera um nome único no padrão Maildir: <segundos>.M<microssegundos>P<pid>Q<seq>.<host>
+    """
+    now = time.time()
+    return f"{int(now)}.M{int((now % 1) * 1_000_000)}P{os.getpid()}Q{next(_maildir_sequence)}.{_maildir_hostname}"
+
+def get_maildir_final_path(maildir_path: str, unique_name: str, size: int, flags: str) -> str:
+    """
+    Caminho em cur/ com o tamanho (",S=") e as flags Maildir (":2,") no nome do arquivo.
+    """
+    return os.path.join(
+        maildir_path, "cur",
+        f"{unique_name},S={size}{MAILDIR_INFO_SEPARATOR}2,{imap_flags_to_maildir(flags)}"
+    )
+
+class MaildirDelivery:
+    """
+    Entrega de um e-mail na Maildir, gravado em uma ou mais partes. O conteúdo vai para
+    tmp/ (ou para o armazenamento por conteúdo, que liga o blob em tmp/) e commit() o
+    renomeia atomicamente para cur/.
+    """
+
+    def __init__(self, maildir_path: str, blob_store: BlobStore = None):
+        self.maildir_path = maildir_path
+        self.blob_store = blob_store
+        self.unique_name = make_maildir_unique_name()
+        self.tmp_path = os.path.join(maildir_path, "tmp", self.unique_name)
+        self.size = 0
+        if blob_store is None:
+            self._file = open(self.tmp_path, "wb")
+            self._writer = None
+        else:
+            self._file = None
+            self._writer = blob_store.open_writer()
+
+    def write(self, data: bytes):
+        if self._writer is None:
+            self._file.write(data)
+        else:
+            self._writer.write(data)
+        self.size += len(data)
+
+    def commit(self, flags: str):
+        """
+        Conclui a entrega e retorna (caminho final, hash do conteúdo ou None sem armazenamento).
+        """
+        digest = None
+        try:
+            if self._writer is None:
+                self._file.close()
+            else:
+                digest, _ = self._writer.commit()
+                self.blob_store.link(digest, self.tmp_path)
+            final_path = get_maildir_final_path(self.maildir_path, self.unique_name, self.size, flags)
+            os.rename(self.tmp_path, final_path)
+        except BaseException:
+            self.abort()
+            raise
+        return final_path, digest
+
+    def abort(self):
+        if self._writer is None:
+            self._file.close()
+        else:
+            self._writer.abort()
+        try:
+            os.remove(self.tmp_path)
+        except OSError:
+            pass
+
+def deliver_to_maildir(maildir_path: str, raw_email: bytes, flags: str, blob_store: BlobStore = None):
+    """
+    Entrega o e-mail na Maildir de forma atômica: grava em tmp/ e renomeia para cur/,
+    com as flags IMAP no nome do arquivo. Com 'blob_store', o conteúdo é gravado no
+    armazenamento por conteúdo e tmp/ recebe apenas uma ligação para o blob.
+
+    Retorna (caminho final, hash do conteúdo ou None sem armazenamento).
+    """
+    delivery = MaildirDelivery(maildir_path, blob_store)
+    try:
+        delivery.write(raw_email)
+    except BaseException:
+        delivery.abort()
+        raise
+    return delivery.commit(flags)
+
+def link_blob_to_maildir(maildir_path: str, blob_store: BlobStore, digest: str, flags: str) -> str:
+    """
+    Entrega na Maildir uma mensagem que já está no armazenamento por conteúdo,
+    ligando o blob em tmp/ e renomeando-o para cur/. Retorna o caminho final.
+
+    Como na entrega de um e-mail baixado, o ",S=" do nome é o tamanho do conteúdo
+    gravado, e não o RFC822.SIZE informado pelo servidor.
+    """
+    unique_name = make_maildir_unique_name()
+    tmp_path = os.path.join(maildir_path, "tmp", unique_name)
+    try:
+        blob_store.link(digest, tmp_path)
+        final_path = get_maildir_final_path(maildir_path, unique_name, os.path.getsize(tmp_path), flags)
+        os.rename(tmp_path, final_path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    return final_path
+
+def build_uid_set(uids) -> str:
+    """
+    Monta um conjunto de UIDs compacto para o IMAP (ex.: [1, 2, 3, 7] -> "1:3,7").
+    """
+    ranges = []
+    start = prev = None
+    for uid in sorted(uids):
+        if start is None:
+            start = prev = uid
+        elif uid == prev + 1:
+            prev = uid
+        else:
+            ranges.append(f"{start}:{prev}" if start != prev else str(start))
+            start = prev = uid
+    if start is not None:
+        ranges.append(f"{start}:{prev}" if start != prev else str(start))
+    return ",".join(ranges)
+
+# Nome do item que antecede um literal em uma resposta FETCH (ex.: "BODY[] {1234}")
+FETCH_LITERAL_RE = re.compile(rb"(BODY(?:\.PEEK)?\[[^\]]*\](?:<\d+>)?|RFC822(?:\.HEADER|\.TEXT)?) \{\d+\}$")
+# Parte vazia enviada sem literal (início além do fim da mensagem): 'BODY[]<n> ""' ou NIL
+FETCH_EMPTY_PARTIAL_RE = re.compile(rb'(BODY(?:\.PEEK)?\[[^\]]*\]<\d+>) (?:""|NIL)')
+
+def parse_fetch_response(data) -> list:
+    """
+    Separa a resposta de um (UID) FETCH, no formato devolvido pelo imaplib, em um
+    dicionário por mensagem: {"uid", "size", "flags", "items"}, onde 'items' mapeia
+    o nome de cada literal recebido (ex.: "BODY[]") para os seus bytes.
+    """
+    messages = []
+    current = None
+
+    def finish(entry):
+        if entry is None:
+            return
+        text = entry["text"]
+        uid = re.search(rb"\bUID (\d+)", text)
+        size = re.search(rb"\bRFC822\.SIZE (\d+)", text)
+        flags = re.search(rb"\bFLAGS \(([^)]*)\)", text)
+        if uid is None:
+            return
+        for empty in FETCH_EMPTY_PARTIAL_RE.finditer(text):
+            entry["items"].setdefault(empty.group(1).decode("ascii").replace(".PEEK", ""), b"")
+        messages.append({
+            "uid": int(uid.group(1)),
+            "size": int(size.group(1)) if size else None,
+            "flags": flags.group(1).decode("ascii", errors="replace") if flags else None,
+            "items": entry["items"],
+        })
+
+    for part in data or []:
+        if part is None:
+            continue
+        if isinstance(part, tuple):
+            prefix, literal = part
+        else:
+            prefix, literal = part, None
+        if re.match(rb"\d+ \(", prefix):
+            finish(current)
+            current = {"text": b"", "items": {}}
+        if current is None:
+            continue
+        if literal is None:
+            current["text"] += prefix + b" "
+            continue
+        match = FETCH_LITERAL_RE.search(prefix)
+        name = match.group(1).decode("ascii").replace(".PEEK", "") if match else "BODY[]"
+        current["text"] += prefix[:match.start()] if match else prefix
+        current["text"] += b" "
+        current["items"][name] = literal
+    finish(current)
+    return messages
+
+async def prefetch_messages(mail, last_uid: int = 0, with_message_ids: bool = False,
+                            parser_pool: ProcessPoolExecutor = None, uids=None) -> list:
+    """
+    Obtém, em um único comando, UID e RFC822.SIZE (e, se solicitado, FLAGS e Message-ID)
+    das mensagens da pasta selecionada com UID maior que 'last_uid', em ordem crescente
+    de UID. Cada item é um dicionário {"uid", "size", "flags", "message_id"}.
+
+    Com 'uids', consulta apenas esses UIDs (ex.: falhas de execuções anteriores), em vez
+    dos posteriores a 'last_uid'.
+
+    Os Message-IDs são extraídos fora do laço de eventos e, com 'parser_pool', pelo pool
+    de processos.
+    """
+    # Este comando substitui o UID SEARCH: a latência é registrada como op="search"
+    with metrics.timer("maildownloader_imap", **metric_labels(op="search")):
+        status, data = await mail.uid("FETCH", *prefetch_command(last_uid, with_message_ids, uids))
+    if status != "OK":
+        return None
+    return await asyncio.to_thread(parse_prefetch_response, data, last_uid, parser_pool, uids)
+
+def prefetch_command(last_uid: int, with_message_ids: bool, uids) -> tuple:
+    """
+    Retorna (conjunto de UIDs, itens) do UID FETCH de prefetch_messages.
+    """
+    items = "(UID RFC822.SIZE)"
+    if with_message_ids:
+        items = "(UID RFC822.SIZE FLAGS BODY.PEEK[HEADER.FIELDS (MESSAGE-ID)])"
+    return build_uid_set(uids) if uids is not None else f"{last_uid + 1}:*", items
+
+def parse_prefetch_response(data, last_uid: int, parser_pool: ProcessPoolExecutor, uids) -> list:
+    """
+    Interpreta a resposta do UID FETCH de prefetch_messages.
+    """
+    messages = {}
+    header_blocks = {}
+    for entry in parse_fetch_response(data):
+        # "n:*" sempre retorna ao menos a última mensagem, mesmo que seu UID seja menor que n
+        if uids is None and entry["uid"] <= last_uid:
+            continue
+        for name, literal in entry["items"].items():
+            if name.startswith("BODY[HEADER.FIELDS"):
+                header_blocks[entry["uid"]] = literal
+        messages[entry["uid"]] = {
+            "uid": entry["uid"],
+            "size": entry["size"] or 0,
+            "flags": entry["flags"],
+            "message_id": "",
+        }
+    if header_blocks:
+        if parser_pool is None:
+            message_ids = map(extract_message_id, header_blocks.values())
+        else:
+            message_ids = parser_pool.map(extract_message_id, header_blocks.values(), chunksize=256)
+        for uid, message_id in zip(header_blocks, message_ids):
+            messages[uid]["message_id"] = message_id
+    return [messages[uid] for uid in sorted(messages)]
+
+def plan_fetch_batches(messages, max_bytes: int, max_messages: int, alone_above: int = None) -> list:
+    """
+    Agrupa [(uid, tamanho), ...] em lotes respeitando o orçamento de bytes e o limite de
+    mensagens por lote. Uma mensagem maior que o orçamento (ou que 'alone_above') forma
+    um lote sozinha.
+    """
+    if alone_above is None:
+        alone_above = max_bytes
+    batches = []
+    batch = []
+    batch_bytes = 0
+    for uid, size in messages:
+        if batch and (batch_bytes + size > max_bytes or len(batch) >= max_messages
+                      or size > alone_above or batch_bytes > alone_above):
+            batches.append(batch)
+            batch = []
+            batch_bytes = 0
+        batch.append((uid, size))
+        batch_bytes += size
+    if batch:
+        batches.append(batch)
+    return batches
+
+async def fetch_large_message_with_retry(mail_ref, uid: int, size: int, delivery: MaildirDelivery,
+                                         mailbox_name, fetch_retries, controller: ServerController,
+                                         reconnect):
+    """
+    Baixa uma mensagem grande ('size' = RFC822.SIZE) em partes de STREAM_CHUNK_SIZE bytes
+    com UID FETCH (BODY.PEEK[]<início.tamanho>), gravando cada parte em 'delivery' fora do
+    laço de eventos. Após uma queda de conexão, reconecta (corrotina 'reconnect') e retoma
+    a partir da última parte gravada; as tentativas contam apenas falhas consecutivas e
+    as esperas seguem 'controller'.
+
+    O fim da mensagem é indicado apenas por uma parte menor que STREAM_CHUNK_SIZE (ou
+    vazia): 'size' é só uma estimativa, pois alguns servidores informam um RFC822.SIZE
+    diferente do conteúdo real.
+
+    Retorna (flags, primeira parte) em caso de sucesso, ou None.
+    """
+    flags = None
+    first_chunk = None
+    attempt = 0
+    while attempt < fetch_retries:
+        offset = delivery.size
+        started = time.monotonic()
+        try:
+            status, data = await mail_ref["mail"].uid(
+                "FETCH", str(uid), f"(UID FLAGS BODY.PEEK[]<{offset}.{STREAM_CHUNK_SIZE}>)"
+            )
+        except (imaplib.IMAP4.abort, socket.error) as e:
+            attempt += 1
+            controller.record_failure()
+            metrics.inc("maildownloader_imap_errors_total", **metric_labels(op="fetch_chunk"))
+            logging.warning(
+                f"Tentativa {attempt} de {fetch_retries} falhou para o e-mail UID {uid} "
+                f"(a partir do byte {offset}), pasta '{mailbox_name}': {e}"
+            )
+            if not await reconnect():
+                return None
+            await controller.backoff_async(attempt)
+            continue
+        except Exception as e:
+            attempt += 1
+            logging.warning(f"Erro inesperado na tentativa {attempt} de {fetch_retries} para o e-mail UID {uid}: {e}")
+            await controller.backoff_async(attempt)
+            continue
+
+        chunk = None
+        for entry in parse_fetch_response(data):
+            if entry["uid"] == uid:
+                flags = entry["flags"] if entry["flags"] is not None else flags
+                chunk = entry["items"].get(f"BODY[]<{offset}>", chunk)
+        if status != "OK" or chunk is None:
+            attempt += 1
+            controller.record_failure()
+            logging.warning(f"FETCH parcial do e-mail UID {uid} na pasta '{mailbox_name}' retornou {status}.")
+            await controller.backoff_async(attempt)
+            continue
 
-def fetch_email_with_retry(mail_ref, email_id, mailbox_name,
-                           fetch_retries, fetch_delay, reconnect_callback):
+        elapsed = time.monotonic() - started
+        controller.record_success(elapsed, len(chunk))
+        labels = metric_labels(op="fetch_chunk")
+        metrics.observe("maildownloader_imap_seconds", elapsed, **labels)
+        metrics.inc("maildownloader_fetch_bytes_total", len(chunk), **labels)
+        logging.debug("Parte do e-mail UID %s recebida: %d bytes em %.3fs.", uid, len(chunk), elapsed,
+                      extra={"uid": uid, "bytes": len(chunk), "latency": round(elapsed, 3)})
+        attempt = 0
+        with metrics.timer("maildownloader_write", **metric_labels()):
+            await asyncio.to_thread(delivery.write, chunk)
+        if first_chunk is None:
+            first_chunk = chunk
+        if len(chunk) < STREAM_CHUNK_SIZE:
+            if delivery.size != size:
+                logging.debug("E-mail UID %s: %d bytes recebidos, RFC822.SIZE informado %d.", uid, delivery.size, size,
+                              extra={"uid": uid, "bytes": delivery.size})
+            return flags, first_chunk
+    return None
+
+async def fetch_batch_with_retry(mail_ref, batch, mailbox_name,
+                                 fetch_retries, controller: ServerController, reconnect) -> list:
     """
-    Executa FETCH para um email_id, com retentativas e reconexões em caso de falha.
+    Executa UID FETCH de um lote [(uid, tamanho), ...] e retorna [(uid, flags, bytes), ...]
+    das mensagens recebidas. Em caso de queda da conexão, aproveita as mensagens que
+    chegaram completas, reconecta (corrotina 'reconnect') e repete o FETCH apenas para os
+    UIDs restantes.
     """
-    for attempt in range(fetch_retries):
+    fetched = []
+    remaining = dict(batch)
+    attempt = 0
+    while remaining and attempt < fetch_retries:
+        uid_set = build_uid_set(remaining)
+        started = time.monotonic()
         try:
-            status, data = mail_ref["mail"].fetch(email_id, "(RFC822)")
-            return status, data
+            status, data = await mail_ref["mail"].uid("FETCH", uid_set, "(UID RFC822.SIZE FLAGS BODY.PEEK[])")
         except (imaplib.IMAP4.abort, socket.error) as e:
+            attempt += 1
+            controller.record_failure()
+            metrics.inc("maildownloader_imap_errors_total", **metric_labels(op="fetch"))
             logging.warning(
-                f"Tentativa {attempt+1} de {fetch_retries} falhou para e-mail ID {email_id.decode('utf-8')}, "
+                f"Tentativa {attempt} de {fetch_retries} falhou para o lote {uid_set}, "
                 f"pasta '{mailbox_name}': {e}"
             )
-            reconnect_ok = reconnect_callback()
-            if not reconnect_ok:
+            # Respostas FETCH recebidas antes da queda continuam no cliente antigo
+            partial = mail_ref["mail"].untagged_responses.pop("FETCH", [])
+            for entry in parse_fetch_response(partial):
+                raw_email = entry["items"].get("BODY[]")
+                if entry["uid"] in remaining and raw_email is not None \
+                        and len(raw_email) == remaining[entry["uid"]]:
+                    del remaining[entry["uid"]]
+                    fetched.append((entry["uid"], entry["flags"], raw_email))
+            if not remaining:
+                break
+            if not await reconnect():
                 break
-            time.sleep(fetch_delay)
+            await controller.backoff_async(attempt)
+            continue
         except Exception as e:
+            attempt += 1
             logging.warning(
-                f"Erro inesperado na tentativa {attempt+1} de {fetch_retries} para e-mail ID {email_id.decode('utf-8')}: {e}"
+                f"Erro inesperado na tentativa {attempt} de {fetch_retries} para o lote {uid_set}: {e}"
             )
-            time.sleep(fetch_delay)
-    return None, None
+            await controller.backoff_async(attempt)
+            continue
+
+        if status != "OK":
+            attempt += 1
+            controller.record_failure()
+            logging.warning(f"FETCH do lote {uid_set} na pasta '{mailbox_name}' retornou {status}.")
+            await controller.backoff_async(attempt)
+            continue
+
+        elapsed = time.monotonic() - started
+        batch_bytes = sum(remaining.values())
+        controller.record_success(elapsed, batch_bytes)
+        labels = metric_labels(op="fetch")
+        metrics.observe("maildownloader_imap_seconds", elapsed, **labels)
+        metrics.inc("maildownloader_fetch_bytes_total", batch_bytes, **labels)
+        logging.debug("FETCH do lote %s: %d bytes em %.3fs.", uid_set, batch_bytes, elapsed,
+                      extra={"bytes": batch_bytes, "latency": round(elapsed, 3)})
+
+        for entry in parse_fetch_response(data):
+            raw_email = entry["items"].get("BODY[]")
+            if entry["uid"] in remaining and raw_email is not None:
+                del remaining[entry["uid"]]
+                fetched.append((entry["uid"], entry["flags"], raw_email))
+        # UIDs que o servidor não devolveu (ex.: removidos nesse meio tempo) não são repetidos
+        break
+    return fetched
 
-def download_mailbox(mail_ref, user_base_dir: str, imap_mailbox_name: str, local_mailbox_name: str,
-                     email_account: str, password: str,
-                     use_ssl: bool, host: str, port: int,
-                     max_reconnects: int):
+class MailboxDownload:
     """
-    Seleciona a pasta IMAP 'imap_mailbox_name' e baixa todos os e-mails para o diretório
-    local 'local_mailbox_name'. Em seguida, reestrutura a pasta criando a subpasta 'cur'.
+    Download de uma pasta já selecionada, sem os comandos IMAP: escolha das mensagens a
+    baixar, entrega na Maildir, índice de deduplicação, UIDs gravados e com falha e
+    registro do progresso da pasta no banco de estado. Os parâmetros são os de
+    download_mailbox.
+
+    Os métodos gravam em disco e no banco de estado; download_mailbox os executa fora do
+    laço de eventos (asyncio.to_thread).
     """
-    reconnect_count = [0]
 
-    def reconnect_callback():
-        if reconnect_count[0] >= max_reconnects:
-            logging.error("Número máximo de reconexões atingido. Abandonando.")
-            return False
-        reconnect_count[0] += 1
-        logging.info(f"Tentando reconectar... (tentativa {reconnect_count[0]}/{max_reconnects})")
+    def __init__(self, user_base_dir: str, imap_mailbox_name: str, local_mailbox_name: str,
+                 email_account: str, state: ArchiveState = None, blob_store: BlobStore = None,
+                 uploader: UploadPipeline = None, progress: "ArchiveProgress" = None,
+                 writer: WriteBehindPool = None, parser_pool: ProcessPoolExecutor = None):
+        self.imap_mailbox_name = imap_mailbox_name
+        self.email_account = email_account
+        self.state = state
+        self.blob_store = blob_store
+        self.uploader = uploader
+        self.progress = progress
+        self.writer = writer
+        self.parser_pool = parser_pool
+        self.use_index = DEDUP_PREFETCH and blob_store is not None and state is not None
+        self.result = {"messages": 0, "bytes": 0, "errors": 0}
+        # Reconexões consecutivas sem nenhum e-mail gravado e pasta abandonada por elas
+        self.reconnect_count = 0
+        self.abandoned = False
+        # Rótulos das métricas da pasta, usados também pelas threads de gravação
+        self.labels = metric_labels()
+
+        # Arquivos soltos na raiz da pasta vêm do layout anterior e são movidos para cur/
+        local_mailbox_path = os.path.join(user_base_dir, local_mailbox_name)
+        if os.path.isdir(local_mailbox_path):
+            restructure_mailbox_dir(local_mailbox_path)
+        self.maildir_path = get_maildir_path(user_base_dir, local_mailbox_name)
+        create_maildir(self.maildir_path)
+
+        self.uidvalidity = None
+        self.incremental = False
+        self.last_uid = 0
+        self.committed_uid = 0
+        # O progresso avança sobre os UIDs novos gravados ou registrados como falha; os UIDs
+        # repetidos, anteriores a 'last_uid', não participam dele.
+        self._uid_order = []
+        self._next_index = 0
+        self._retry_uids = set()
+        self._done = set()
+        self._failed = set()
+        # UIDs recebidos do servidor (gravados ou não)
+        self._received = set()
+        # UIDs a registrar como falha e UIDs repetidos já gravados, desde o último registro
+        self._new_failures = []
+        self._retried_done = []
+        # Arquivos entregues desde o último registro de progresso, sincronizados em grupo
+        self._unsynced_paths = []
+        self._index_rows = []
+        # Cabeçalhos das mensagens gravadas desde o último registro de progresso, extraídos
+        # em lote no registro: (uid, tamanho, hash, bloco de cabeçalhos)
+        self._pending_headers = []
+        # Gravações em segundo plano pendentes: (uid, Future, tamanho, cabeçalho)
+        self._pending_writes = []
+        self._to_download = []
+        self._message_ids = {}
+        # O índice usa o RFC822.SIZE, o mesmo tamanho das consultas feitas antes do download,
+        # que alguns servidores informam diferente do tamanho do conteúdo recebido
+        self._message_sizes = {}
+
+    def start(self, uidvalidity) -> int:
+        """
+        Define o UIDVALIDITY da pasta e retorna o último UID já arquivado (0 sem a
+        sincronização incremental ou se o UIDVALIDITY mudou).
+        """
+        self.uidvalidity = uidvalidity
+        self.incremental = self.state is not None and INCREMENTAL_SYNC and uidvalidity is not None
+        if self.incremental:
+            saved_uidvalidity, saved_last_uid = self.state.get_folder_state(self.email_account, self.imap_mailbox_name)
+            if saved_uidvalidity is not None and saved_uidvalidity != uidvalidity:
+                logging.warning(
+                    f"UIDVALIDITY da pasta '{self.imap_mailbox_name}' mudou ({saved_uidvalidity} -> {uidvalidity}). "
+                    f"Realizando ressincronização completa."
+                )
+                self.state.clear_failed_uids(self.email_account, self.imap_mailbox_name)
+            elif saved_uidvalidity is not None:
+                self.last_uid = saved_last_uid
+        self.committed_uid = self.last_uid
+        return self.last_uid
+
+    def failed_uids(self) -> list:
+        """
+        Retorna os UIDs que falharam em execuções anteriores e ainda devem ser repetidos.
+        """
+        if not (self.incremental and self.last_uid):
+            return []
+        return self.state.get_failed_uids(self.email_account, self.imap_mailbox_name,
+                                          self.uidvalidity, FAILED_UID_RETRIES)
+
+    def select_messages(self, messages: list, failed_before: list = None, retry_messages: list = None):
+        """
+        Define as mensagens da pasta (prefetch_messages) e as repetições de 'failed_before'
+        ('retry_messages', None se a consulta falhou). Com o índice de deduplicação, as
+        mensagens já arquivadas são ligadas a partir do armazenamento, sem download.
+        """
+        # UIDs que falharam em execuções anteriores são repetidos antes dos novos
+        if failed_before:
+            if retry_messages is None:
+                logging.warning(f"Não foi possível consultar os UIDs pendentes da pasta '{self.imap_mailbox_name}'.")
+            else:
+                self._retry_uids = {message["uid"] for message in retry_messages}
+                # UIDs que o servidor não devolveu foram removidos da pasta
+                self.state.clear_failed_uids(self.email_account, self.imap_mailbox_name,
+                                             [uid for uid in failed_before if uid not in self._retry_uids])
+                if self._retry_uids:
+                    logging.info(
+                        f"Repetindo {len(self._retry_uids)} e-mails que falharam em execuções anteriores "
+                        f"na pasta '{self.imap_mailbox_name}'."
+                    )
+                messages = retry_messages + messages
+        self._uid_order = [message["uid"] for message in messages if message["uid"] > self.last_uid]
+
+        to_download = messages
+        if self.use_index:
+            known = self.state.find_digests(
+                (message["message_id"], message["size"]) for message in messages if message["message_id"]
+            )
+            to_download = []
+            for message in messages:
+                digest = known.get((message["message_id"], message["size"]))
+                if digest is None or not self.blob_store.has(digest):
+                    to_download.append(message)
+                    continue
+                try:
+                    final_path = link_blob_to_maildir(self.maildir_path, self.blob_store, digest, message["flags"])
+                except Exception as e:
+                    logging.warning(f"Não foi possível ligar o e-mail UID {message['uid']} já arquivado: {e}")
+                    to_download.append(message)
+                    continue
+                self.blob_store.record_skipped_download(message["size"])
+                metrics.inc("maildownloader_messages_total", linked="1", **self.labels)
+                self._unsynced_paths.append(final_path)
+                if self.uploader is not None:
+                    self.uploader.submit(final_path)
+                if self.progress is not None:
+                    self.progress.add(1, message["size"])
+                self._mark_done(message["uid"])
+                self.result["messages"] += 1
+            if self._done:
+                logging.info(f"{len(self._done)} e-mails de '{self.imap_mailbox_name}' já arquivados foram ligados sem download.")
+                self._commit_progress()
+
+        logging.info(f"Baixando {len(to_download)} e-mails de '{self.imap_mailbox_name}' (conta: {self.email_account})...")
+        self._to_download = to_download
+        self._message_ids = {message["uid"]: message["message_id"] for message in to_download}
+        self._message_sizes = {message["uid"]: message["size"] for message in to_download}
+
+    def batches(self) -> list:
+        """
+        Retorna os lotes FETCH das mensagens a baixar; uma mensagem acima de
+        STREAM_THRESHOLD forma um lote sozinha e é recebida em partes.
+        """
+        return plan_fetch_batches(
+            [(message["uid"], message["size"]) for message in self._to_download],
+            FETCH_BATCH_MAX_BYTES, FETCH_BATCH_MAX_MESSAGES, alone_above=STREAM_THRESHOLD
+        )
+
+    def open_delivery(self, uid: int):
+        """
+        Abre a entrega de uma mensagem recebida em partes, ou retorna None se falhar.
+        """
         try:
-            mail_ref["mail"].logout()
-        except Exception:
-            pass
+            return MaildirDelivery(self.maildir_path, self.blob_store)
+        except Exception as e:
+            logging.error(f"Erro ao criar o arquivo temporário do e-mail UID {uid}: {e}", exc_info=True)
+            return None
+
+    def commit_delivery(self, uid: int, delivery: MaildirDelivery, fetched):
+        """
+        Conclui a entrega de uma mensagem recebida em partes, com o retorno de
+        fetch_large_message_with_retry ('fetched', None se o download falhou).
+        """
         try:
-            new_mail = connect_imap_server(email_account, password, use_ssl, host, port)
-            status, _ = new_mail.select(imap_mailbox_name)
-            if status != "OK":
-                logging.error(f"Não foi possível selecionar a pasta '{imap_mailbox_name}' após reconexão.")
-                return False
-            mail_ref["mail"] = new_mail
-            return True
+            if fetched is None:
+                delivery.abort()
+            else:
+                final_path, digest = delivery.commit(fetched[0])
+                self._record_delivery(uid, final_path, delivery.size, digest, fetched[1])
         except Exception as e:
-            logging.error(f"Falha ao reconectar: {e}", exc_info=True)
-            return False
+            self.abort_delivery(uid, delivery, e)
 
-    status, _ = mail_ref["mail"].select(imap_mailbox_name)
-    if status != "OK":
-        logging.error(f"Não foi possível selecionar a pasta '{imap_mailbox_name}'.")
-        return
+    def abort_delivery(self, uid: int, delivery: MaildirDelivery, error: Exception):
+        """
+        Descarta a entrega de uma mensagem recebida em partes após o erro 'error'.
+        """
+        logging.error(f"Erro ao gravar o e-mail UID {uid} em '{self.maildir_path}': {error}", exc_info=error)
+        delivery.abort()
 
-    local_mailbox_path = os.path.join(user_base_dir, local_mailbox_name)
-    create_folder(local_mailbox_path)
+    def deliver(self, uid: int, flags: str, raw_email: bytes):
+        """
+        Entrega um e-mail recebido em lote, diretamente ou pelo pool de gravação.
+        """
+        self._received.add(uid)
+        # Para o índice basta o cabeçalho; o corpo não fica retido até o fim da gravação
+        head = split_header_block(raw_email) if self.use_index else b""
+        if self.writer is None:
+            self._finish_write(uid, lambda: self._write_message(raw_email, flags), len(raw_email), head)
+        else:
+            future = self.writer.submit(len(raw_email), self._write_message, raw_email, flags)
+            self._pending_writes.append((uid, future, len(raw_email), head))
 
-    status, messages = mail_ref["mail"].search(None, "ALL")
-    if status != "OK":
-        logging.error(f"Erro ao buscar e-mails na pasta '{imap_mailbox_name}'.")
-        return
+    def deliver_all(self, fetched: list):
+        """
+        Entrega os e-mails [(uid, flags, bytes), ...] recebidos em um lote.
+        """
+        for uid, flags, raw_email in fetched:
+            self.deliver(uid, flags, raw_email)
 
-    email_ids = messages[0].split()
-    logging.info(f"Baixando {len(email_ids)} e-mails de '{imap_mailbox_name}' (conta: {email_account})...")
-
-    for email_id in email_ids:
-        status, data = fetch_email_with_retry(
-            mail_ref=mail_ref,
-            email_id=email_id,
-            mailbox_name=imap_mailbox_name,
-            fetch_retries=FETCH_RETRIES,
-            fetch_delay=FETCH_DELAY,
-            reconnect_callback=reconnect_callback
-        )
-        if status != "OK" or data is None:
-            logging.warning(
-                f"Não foi possível buscar o e-mail ID {email_id.decode('utf-8')} na pasta '{imap_mailbox_name}'."
-            )
-            continue
+    def end_batch(self, batch: list):
+        """
+        Registra como falha os UIDs do lote que não foram recebidos e o progresso da pasta.
+        """
+        for uid, _ in batch:
+            if uid not in self._done and uid not in self._received:
+                logging.warning(f"Não foi possível buscar o e-mail UID {uid} na pasta '{self.imap_mailbox_name}'.")
+                metrics.inc("maildownloader_message_errors_total", **self.labels)
+                self.result["errors"] += 1
+                # Com a conexão perdida, o restante da pasta fica para a próxima execução
+                if not self.abandoned:
+                    self._mark_failed(uid)
+
+        # O progresso registrado cobre apenas as gravações já concluídas
+        self._collect_writes(wait=False)
+        self._commit_progress()
+
+    def wait_writes(self):
+        """
+        Aguarda as gravações em andamento, antes de a pasta ser liberada.
+        """
+        self._collect_writes(wait=True)
+
+    def finish(self):
+        """
+        Registra o progresso final da pasta.
+        """
+        self._commit_progress()
+        if self.incremental:
+            self.state.save_folder_state(self.email_account, self.imap_mailbox_name,
+                                         self.uidvalidity, self.committed_uid)
 
-        raw_email = data[0][1]
-        msg = email.message_from_bytes(raw_email)
+    def _mark_done(self, uid):
+        self._done.add(uid)
+        if uid in self._retry_uids:
+            self._retried_done.append(uid)
 
-        subject = msg.get("subject", "sem_assunto")
-        subject = decode_subject(subject)
-        sanitized_subject = sanitize_filename(subject)
+    def _mark_failed(self, uid):
+        if self.incremental and uid not in self._failed:
+            self._failed.add(uid)
+            self._new_failures.append(uid)
 
-        base_filename = f"{sanitized_subject}_{email_id.decode('utf-8')}.eml"
-        local_filepath = os.path.join(local_mailbox_path, base_filename)
+    def _advance_progress(self):
+        uid_order = self._uid_order
+        while self._next_index < len(uid_order) and (
+                uid_order[self._next_index] in self._done or uid_order[self._next_index] in self._failed):
+            self.committed_uid = uid_order[self._next_index]
+            self._next_index += 1
+        if self.incremental:
+            if self._new_failures:
+                self.state.record_failed_uids(self.email_account, self.imap_mailbox_name,
+                                              self.uidvalidity, self._new_failures)
+                self._new_failures.clear()
+            if self._retried_done:
+                self.state.clear_failed_uids(self.email_account, self.imap_mailbox_name, self._retried_done)
+                self._retried_done.clear()
+            self.state.save_folder_state(self.email_account, self.imap_mailbox_name,
+                                         self.uidvalidity, self.committed_uid)
 
-        counter = 1
-        while os.path.exists(local_filepath):
-            name_part, ext_part = os.path.splitext(base_filename)
-            local_filepath = os.path.join(local_mailbox_path, f"{name_part}_{counter}{ext_part}")
-            counter += 1
+    def _add_index_row(self, uid, size, digest, parsed):
+        metadata, seconds = parsed
+        metrics.observe("maildownloader_parse_seconds", seconds, **self.labels)
+        self._index_rows.append((
+            self._message_ids[uid], size, digest, metadata["subject"], metadata["from"],
+            metadata["date"], self.email_account, self.imap_mailbox_name
+        ))
+
+    def _index_pending_headers(self):
+        if not self._pending_headers:
+            return
+        heads = [head for _, _, _, head in self._pending_headers]
+        if self.parser_pool is None:
+            results = map(timed_extract_message_metadata, heads)
+        else:
+            # Um único map por registro de progresso, com um bloco de cabeçalhos por processo,
+            # em vez de um envio ao pool por mensagem
+            chunksize = -(-len(heads) // max(1, METADATA_WORKERS))
+            results = self.parser_pool.map(timed_extract_message_metadata, heads, chunksize=chunksize)
+        results = iter(results)
+        for uid, size, digest, _ in self._pending_headers:
+            try:
+                parsed = next(results)
+            except StopIteration:
+                break
+            except Exception as e:
+                logging.warning(f"Não foi possível extrair os cabeçalhos do e-mail UID {uid}: {e}")
+                continue
+            self._add_index_row(uid, size, digest, parsed)
+        self._pending_headers.clear()
 
+    def _commit_progress(self):
+        if WRITE_FSYNC and self._unsynced_paths:
+            fsync_files(self._unsynced_paths)
+        self._unsynced_paths.clear()
+        self._index_pending_headers()
+        if self._index_rows:
+            self.state.record_messages(self._index_rows)
+            self._index_rows.clear()
+        self._advance_progress()
+
+    def _record_delivery(self, uid, final_path, size, digest, head):
+        self.reconnect_count = 0
+        logging.debug("E-mail UID %s gravado: %d bytes.", uid, size, extra={"uid": uid, "bytes": size})
+        self._unsynced_paths.append(final_path)
+        if digest is not None:
+            self._unsynced_paths.append(self.blob_store.blob_path(digest))
+        if self.uploader is not None:
+            self.uploader.submit(final_path)
+        if self.progress is not None:
+            self.progress.add(1, size)
+        metrics.inc("maildownloader_messages_total", linked="0", **self.labels)
+        metrics.inc("maildownloader_message_bytes_total", size, **self.labels)
+        self._mark_done(uid)
+        self.result["messages"] += 1
+        self.result["bytes"] += size
+        if self.use_index and self._message_ids.get(uid):
+            self._pending_headers.append((uid, self._message_sizes[uid], digest, head))
+
+    def _finish_write(self, uid, write, size, head):
         try:
-            with open(local_filepath, "wb") as f:
-                f.write(raw_email)
+            final_path, digest = write()
         except PermissionError as pe:
-            logging.error(f"PermissionError ao gravar '{local_filepath}': {pe}", exc_info=True)
+            logging.error(f"PermissionError ao gravar o e-mail UID {uid} em '{self.maildir_path}': {pe}", exc_info=True)
+            self.result["errors"] += 1
+            self._mark_failed(uid)
+            return
         except Exception as e:
-            logging.error(f"Erro ao gravar '{local_filepath}': {e}", exc_info=True)
+            logging.error(f"Erro ao gravar o e-mail UID {uid} em '{self.maildir_path}': {e}", exc_info=True)
+            self.result["errors"] += 1
+            self._mark_failed(uid)
+            return
+        self._record_delivery(uid, final_path, size, digest, head)
+
+    def _write_message(self, raw_email, flags):
+        with metrics.timer("maildownloader_write", **self.labels):
+            return deliver_to_maildir(self.maildir_path, raw_email, flags, self.blob_store)
+
+    def _collect_writes(self, wait: bool):
+        # Processa as gravações em segundo plano concluídas (ou todas, com wait=True)
+        remaining = []
+        for uid, future, size, head in self._pending_writes:
+            if wait or future.done():
+                self._finish_write(uid, future.result, size, head)
+            else:
+                remaining.append((uid, future, size, head))
+        self._pending_writes[:] = remaining
+
+async def download_mailbox(mail_ref, user_base_dir: str, imap_mailbox_name: str, local_mailbox_name: str,
+                           email_account: str, password: str,
+                           use_ssl: bool, host: str, port: int,
+                           max_reconnects: int, state: ArchiveState = None,
+                           blob_store: BlobStore = None, uploader: UploadPipeline = None,
+                           progress: "ArchiveProgress" = None, writer: WriteBehindPool = None,
+                           parser_pool: ProcessPoolExecutor = None):
+    """
+    Seleciona a pasta IMAP 'imap_mailbox_name' e entrega os e-mails diretamente na Maildir
+    da pasta local 'local_mailbox_name' (tmp/ -> cur/), com as flags IMAP no nome do arquivo.
+
+    Se 'state' for informado e INCREMENTAL_SYNC estiver ativo, baixa apenas os UIDs
+    posteriores ao último gravado na execução anterior; se o UIDVALIDITY da pasta
+    tiver mudado, a pasta é ressincronizada por completo.
+
+    Se 'blob_store' for informado, as mensagens são deduplicadas pelo conteúdo. Com
+    DEDUP_PREFETCH e 'state', mensagens cujo (Message-ID, tamanho) já está no índice
+    são ligadas a partir do armazenamento, sem serem baixadas.
 
-    restructure_mailbox_dir(local_mailbox_path)
+    Se 'uploader' for informado, cada arquivo entregue é enfileirado para upload.
+    Se 'progress' for informado, cada e-mail gravado é contabilizado no progresso da execução.
 
-def archive_account(email_account: str):
+    Se 'writer' for informado, os e-mails recebidos em lote são gravados em segundo plano
+    e o progresso da pasta só avança sobre gravações concluídas (e, com WRITE_FSYNC,
+    sincronizadas com o disco). Mensagens grandes recebidas em partes são gravadas
+    diretamente.
+
+    Os cabeçalhos usados pelo índice de deduplicação são lidos em lote a cada registro de
+    progresso; se 'parser_pool' for informado, o lote é dividido entre os processos do pool.
+
+    O trabalho fora do IMAP (seleção das mensagens, entrega e progresso) é feito por
+    MailboxDownload, em threads auxiliares (asyncio.to_thread), uma vez por lote.
+
+    Após uma queda de conexão, reconecta com esperas crescentes (ServerController do
+    servidor); a pasta só é abandonada após 'max_reconnects' reconexões consecutivas
+    sem nenhum e-mail gravado entre elas.
+
+    Com a sincronização incremental, um UID que o servidor não devolve (ou que não pôde
+    ser gravado) não impede o avanço do último UID da pasta: ele é registrado no estado
+    e repetido sozinho nas execuções seguintes (FAILED_UID_RETRIES).
+
+    Retorna um dicionário com o número de e-mails gravados ('messages'), o total de
+    bytes ('bytes') e o número de falhas ('errors') da pasta.
     """
-    Conecta ao servidor IMAP, lista as pastas e, para cada uma, realiza o download dos e-mails,
-    aplicando a lógica de renomeação e estruturação de diretórios.
-    
+    controller = get_server_controller(host, port)
+
+    with metrics.timer("maildownloader_imap", **metric_labels(op="select")):
+        status, select_data = await mail_ref["mail"].select(imap_mailbox_name)
+    if status != "OK":
+        logging.error(f"Não foi possível selecionar a pasta '{imap_mailbox_name}'.")
+        return {"messages": 0, "bytes": 0, "errors": 1}
+
+    job = await asyncio.to_thread(MailboxDownload, user_base_dir, imap_mailbox_name, local_mailbox_name,
+                                  email_account, state, blob_store, uploader, progress, writer, parser_pool)
+
+    async def reconnect():
+        await close_imap_connection(mail_ref["mail"])
+        while job.reconnect_count < max_reconnects:
+            job.reconnect_count += 1
+            logging.info(f"Tentando reconectar... (tentativa {job.reconnect_count}/{max_reconnects})")
+            try:
+                new_mail = await connect_imap_server(email_account, password, use_ssl, host, port)
+            except Exception as e:
+                logging.warning(f"Falha ao reconectar: {e}")
+                await controller.backoff_async(job.reconnect_count)
+                continue
+            status, _ = await new_mail.select(imap_mailbox_name)
+            if status != "OK":
+                logging.error(f"Não foi possível selecionar a pasta '{imap_mailbox_name}' após reconexão.")
+                await close_imap_connection(new_mail)
+                job.abandoned = True
+                return False
+            mail_ref["mail"] = new_mail
+            return True
+        logging.error("Número máximo de reconexões consecutivas atingido. Abandonando.")
+        job.abandoned = True
+        return False
+
+    uidvalidity = await get_uidvalidity(mail_ref["mail"], imap_mailbox_name)
+    last_uid = await asyncio.to_thread(job.start, uidvalidity)
+    messages = []
+    if int(select_data[0] or 0) > 0:
+        messages = await prefetch_messages(mail_ref["mail"], last_uid, with_message_ids=job.use_index,
+                                                 parser_pool=parser_pool)
+        if messages is None:
+            logging.error(f"Erro ao buscar e-mails na pasta '{imap_mailbox_name}'.")
+            job.result["errors"] += 1
+            return job.result
+    failed_before = await asyncio.to_thread(job.failed_uids)
+    retry_messages = None
+    if failed_before:
+        retry_messages = await prefetch_messages(mail_ref["mail"], with_message_ids=job.use_index,
+                                                       parser_pool=parser_pool, uids=failed_before)
+    await asyncio.to_thread(job.select_messages, messages, failed_before, retry_messages)
+
+    try:
+        for batch in job.batches():
+            if len(batch) == 1 and batch[0][1] > STREAM_THRESHOLD:
+                uid, size = batch[0]
+                delivery = await asyncio.to_thread(job.open_delivery, uid)
+                if delivery is not None:
+                    try:
+                        fetched = await fetch_large_message_with_retry(
+                            mail_ref=mail_ref,
+                            uid=uid,
+                            size=size,
+                            delivery=delivery,
+                            mailbox_name=imap_mailbox_name,
+                            fetch_retries=FETCH_RETRIES,
+                            controller=controller,
+                            reconnect=reconnect
+                        )
+                    except Exception as e:
+                        await asyncio.to_thread(job.abort_delivery, uid, delivery, e)
+                    else:
+                        await asyncio.to_thread(job.commit_delivery, uid, delivery, fetched)
+            else:
+                fetched = await fetch_batch_with_retry(
+                    mail_ref=mail_ref,
+                    batch=batch,
+                    mailbox_name=imap_mailbox_name,
+                    fetch_retries=FETCH_RETRIES,
+                    controller=controller,
+                    reconnect=reconnect
+                )
+                await asyncio.to_thread(job.deliver_all, fetched)
+            await asyncio.to_thread(job.end_batch, batch)
+            if job.abandoned:
+                break
+    finally:
+        # As gravações em andamento terminam antes de a pasta ser liberada
+        await asyncio.to_thread(job.wait_writes)
+    await asyncio.to_thread(job.finish)
+    return job.result
+
+async def list_account_folders(mail):
+    """
+    Lista as pastas da conta e retorna [(pasta IMAP, pasta local), ...], ou None se o
+    LIST falhar, aplicando a lógica de renomeação das pastas locais (map_account_folders).
+    """
+    with metrics.timer("maildownloader_imap", **metric_labels(op="list")):
+        status, mailbox_list = await mail.list()
+    if status != "OK":
+        return None
+    return map_account_folders(mailbox_list)
+
+def map_account_folders(mailbox_list) -> list:
+    """
+    Converte a resposta do LIST em [(pasta IMAP, pasta local), ...].
+
     Mantém o padrão previamente estabelecido:
       - Se a pasta for "INBOX", armazena como "cur".
       - Se iniciar com "INBOX.", remove o prefixo; se o nome resultante estiver em dot_folders,
         adiciona o ponto à esquerda.
       - Para as demais pastas, se o nome não começar com '.', adiciona o ponto; caso contrário, mantém o original.
     """
+    dot_folders = {"Drafts", "Junk", "Sent", "spam", "Trash", "Archive"}
+    folders = []
+
+    for mailbox_info in mailbox_list:
+        line = mailbox_info.decode("utf-8", errors="replace").strip()
+        parts = line.rsplit(" ", 1)
+        if len(parts) < 2:
+            continue
+
+        raw_mailbox_name = parts[-1].strip('"')
+        if raw_mailbox_name == "" or raw_mailbox_name == ".":
+            continue
+
+        if raw_mailbox_name == "INBOX":
+            local_mailbox_name = "cur"
+        elif raw_mailbox_name.startswith("INBOX."):
+            local_mailbox_name = raw_mailbox_name.replace("INBOX.", "", 1)
+            if local_mailbox_name in dot_folders:
+                local_mailbox_name = "." + local_mailbox_name
+        else:
+            if not raw_mailbox_name.startswith("."):
+                local_mailbox_name = "." + raw_mailbox_name
+            else:
+                local_mailbox_name = raw_mailbox_name
+
+        folders.append((raw_mailbox_name, local_mailbox_name))
+    return folders
+
+async def archive_account(email_account: str, state: ArchiveState = None,
+                          blob_store: BlobStore = None, uploader: UploadPipeline = None,
+                          folder_plan: dict = None, progress: "ArchiveProgress" = None,
+                          writer: WriteBehindPool = None, parser_pool: ProcessPoolExecutor = None) -> dict:
+    """
+    Conecta ao servidor IMAP, lista as pastas (list_account_folders) e, para cada uma,
+    realiza o download dos e-mails, aplicando a lógica de renomeação e estruturação de
+    diretórios. As pastas são baixadas por até FOLDER_WORKERS tarefas (download_mailbox),
+    cada uma com uma sessão do ImapSessionPool.
+
+    'folder_plan' ({pasta IMAP: bytes a baixar}, do plano da execução) define a ordem
+    das pastas com FOLDER_WORKERS > 1; sem ele, a ordem segue o número de mensagens.
+
+    Retorna o resumo da conta: status ("OK", "PARCIAL" ou "FALHA"), e-mails, bytes,
+    falhas, duração em segundos e a razão de compressão IMAP ('compression', None se
+    a compressão não foi usada).
+    """
+    set_log_account(email_account)
+    summary = {"account": email_account, "status": "FALHA", "messages": 0, "bytes": 0,
+               "errors": 0, "duration": 0.0, "compression": None}
+    started = time.monotonic()
+    mail_ref = None
     try:
         logging.info(f"Processando conta: {email_account}")
 
-        mail = connect_imap_server(
+        mail = await connect_with_backoff(
             email_account=email_account,
             password=IMAP_PASSWORD,
             use_ssl=USE_SSL,
@@ -293,64 +1670,428 @@ def archive_account(email_account: str):
         mail_ref = {"mail": mail}
 
         user_local_dir = os.path.join(MAILSTORE_HOME, get_local_username(email_account))
-        create_folder(user_local_dir)
+        await asyncio.to_thread(create_folder, user_local_dir)
 
-        status, mailbox_list = mail_ref["mail"].list()
-        if status != "OK":
+        folders = await list_account_folders(mail_ref["mail"])
+        if folders is None:
             logging.error(f"Não foi possível listar as pastas da conta {email_account}")
-            mail_ref["mail"].logout()
-            return
+            return summary
 
-        dot_folders = {"Drafts", "Junk", "Sent", "spam", "Trash", "Archive"}
+        if FOLDER_WORKERS > 1:
+            # As maiores pastas começam primeiro, para que o tempo total da conta
+            # se aproxime do tempo da maior pasta
+            if folder_plan is not None:
+                sizes = {name: folder_plan.get(name, 0) for name, _ in folders}
+            else:
+                sizes = {}
+                for name, _ in folders:
+                    status = await get_mailbox_status(mail_ref["mail"], name)
+                    sizes[name] = status.get("MESSAGES", 0)
+            folders.sort(key=lambda folder: sizes[folder[0]], reverse=True)
 
-        for mailbox_info in mailbox_list:
-            line = mailbox_info.decode("utf-8", errors="replace").strip()
-            parts = line.rsplit(" ", 1)
-            if len(parts) < 2:
-                continue
+        pool = ImapSessionPool(
+            primary_ref=mail_ref,
+            size=FOLDER_WORKERS,
+            connect=lambda wait_slot: connect_imap_server(
+                email_account, IMAP_PASSWORD, USE_SSL, IMAP_SERVER, IMAP_PORT, wait_slot=wait_slot
+            ),
+            tasks=len(folders)
+        )
 
-            raw_mailbox_name = parts[-1].strip('"')
-            if raw_mailbox_name == "" or raw_mailbox_name == ".":
-                continue
+        async def download_folder(folder):
+            raw_mailbox_name, local_mailbox_name = folder
+            set_log_folder(raw_mailbox_name)
+            session = await pool.acquire()
+            try:
+                folder_result = await download_mailbox(
+                    mail_ref=session,
+                    user_base_dir=user_local_dir,
+                    imap_mailbox_name=raw_mailbox_name,
+                    local_mailbox_name=local_mailbox_name,
+                    email_account=email_account,
+                    password=IMAP_PASSWORD,
+                    use_ssl=USE_SSL,
+                    host=IMAP_SERVER,
+                    port=IMAP_PORT,
+                    max_reconnects=MAX_RECONNECTS,
+                    state=state,
+                    blob_store=blob_store,
+                    uploader=uploader,
+                    progress=progress,
+                    writer=writer,
+                    parser_pool=parser_pool
+                )
+            except Exception as e:
+                logging.error(f"Erro ao baixar a pasta '{raw_mailbox_name}': {e}", exc_info=True)
+                await pool.discard(session)
+                return {"messages": 0, "bytes": 0, "errors": 1}
+            await pool.release(session)
+            return folder_result
 
-            if raw_mailbox_name == "INBOX":
-                local_mailbox_name = "cur"
-            elif raw_mailbox_name.startswith("INBOX."):
-                local_mailbox_name = raw_mailbox_name.replace("INBOX.", "", 1)
-                if local_mailbox_name in dot_folders:
-                    local_mailbox_name = "." + local_mailbox_name
-            else:
-                if not raw_mailbox_name.startswith("."):
-                    local_mailbox_name = "." + raw_mailbox_name
-                else:
-                    local_mailbox_name = raw_mailbox_name
-
-            download_mailbox(
-                mail_ref=mail_ref,
-                user_base_dir=user_local_dir,
-                imap_mailbox_name=raw_mailbox_name,
-                local_mailbox_name=local_mailbox_name,
-                email_account=email_account,
-                password=IMAP_PASSWORD,
-                use_ssl=USE_SSL,
-                host=IMAP_SERVER,
-                port=IMAP_PORT,
-                max_reconnects=MAX_RECONNECTS
-            )
+        try:
+            folder_results = await gather_limited(download_folder, folders, FOLDER_WORKERS)
+        finally:
+            await pool.close_all()
 
-        mail_ref["mail"].logout()
+        for folder_result in folder_results:
+            for key in ("messages", "bytes", "errors"):
+                summary[key] += folder_result[key]
+
+        summary["status"] = "OK" if summary["errors"] == 0 else "PARCIAL"
         logging.info(f"Arquivamento concluído para {email_account}")
-        time.sleep(2)
 
     except Exception as e:
         logging.error(f"Erro ao processar a conta {email_account}: {e}", exc_info=True)
+    finally:
+        if mail_ref is not None:
+            await close_imap_connection(mail_ref["mail"])
+        finish_account_summary(summary, started)
+    return summary
 
-def main():
-    init_logger()
+def finish_account_summary(summary: dict, started: float):
+    """
+    Completa o resumo da conta com a duração e a razão de compressão IMAP e limpa o
+    contexto de log.
+    """
+    summary["duration"] = time.monotonic() - started
+    compression = pop_compression_stats(summary["account"])
+    if compression is not None and compression[0]:
+        summary["compression"] = compression[1] / compression[0]
+        logging.info(
+            f"Compressão IMAP: {compression[0] / (1024 * 1024):.1f} MB recebidos para "
+            f"{compression[1] / (1024 * 1024):.1f} MB de respostas (razão {summary['compression']:.1f}:1)."
+        )
+    set_log_folder(None)
+    set_log_account(None)
+
+async def gather_limited(function, items, limit: int) -> list:
+    """
+    Executa a corrotina function(item) para cada item, com no máximo 'limit' em
+    andamento, iniciadas na ordem de 'items'. Retorna os resultados na mesma ordem.
+    Cada execução é uma tarefa própria, com o seu contexto de log.
+    """
+    semaphore = asyncio.Semaphore(max(1, limit))
+
+    async def run(item):
+        async with semaphore:
+            return await function(item)
+
+    return await asyncio.gather(*(run(item) for item in items))
+
+def close_event_loop(loop):
+    """
+    Encerra o laço de eventos como asyncio.run: cancela as tarefas pendentes, finaliza os
+    geradores assíncronos e o executor padrão (asyncio.to_thread) e fecha o laço.
+    """
+    try:
+        pending = asyncio.all_tasks(loop)
+        for task in pending:
+            task.cancel()
+        if pending:
+            loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+        loop.run_until_complete(loop.shutdown_asyncgens())
+        loop.run_until_complete(loop.shutdown_default_executor())
+    finally:
+        loop.close()
+
+async def plan_mailbox(mail, email_account: str, mailbox_name: str, state: ArchiveState = None) -> dict:
+    """
+    Mede uma pasta sem baixá-la: STATUS (MESSAGES UIDNEXT UIDVALIDITY) e, se houver UIDs
+    ainda não arquivados, UID FETCH (RFC822.SIZE) desses UIDs com a pasta aberta por
+    EXAMINE. Com INCREMENTAL_SYNC, considera apenas os UIDs posteriores ao último gravado
+    (ou a pasta inteira, se o UIDVALIDITY mudou) e os que falharam em execuções anteriores
+    e ainda serão repetidos, como download_mailbox.
+    """
+    info = await get_mailbox_status(mail, mailbox_name, ("MESSAGES", "UIDNEXT", "UIDVALIDITY"))
+    folder = {"mailbox": mailbox_name, "messages": info.get("MESSAGES", 0), "uidnext": info.get("UIDNEXT"),
+              "pending_messages": 0, "pending_bytes": 0}
+    last_uid = 0
+    failed_uids = []
+    if state is not None and INCREMENTAL_SYNC:
+        saved_uidvalidity, saved_last_uid = await asyncio.to_thread(state.get_folder_state, email_account, mailbox_name)
+        if saved_uidvalidity is not None and saved_uidvalidity == info.get("UIDVALIDITY"):
+            last_uid = saved_last_uid
+        if last_uid:
+            # UIDs que falharam antes são repetidos por download_mailbox: entram no plano
+            failed_uids = await asyncio.to_thread(state.get_failed_uids, email_account, mailbox_name,
+                                                  saved_uidvalidity, FAILED_UID_RETRIES)
+    # Pasta vazia ou sem UIDs novos nem pendentes desde a última execução: não há o que medir
+    if info.get("MESSAGES") == 0 or (folder["uidnext"] is not None and folder["uidnext"] <= last_uid + 1
+                                     and not failed_uids):
+        return folder
+    status, data = await mail.select(mailbox_name, readonly=True)
+    if status != "OK":
+        folder["error"] = "EXAMINE falhou"
+        return folder
+    if "MESSAGES" not in info:
+        folder["messages"] = int(data[0] or 0)
+    messages = await prefetch_messages(mail, last_uid) if folder["messages"] else []
+    if messages is None:
+        folder["error"] = "FETCH RFC822.SIZE falhou"
+        return folder
+    if failed_uids and folder["messages"]:
+        # UIDs já removidos da pasta não são devolvidos pelo servidor; os posteriores a
+        # last_uid já foram medidos
+        retry_messages = await prefetch_messages(mail, uids=failed_uids) or []
+        messages += [message for message in retry_messages if message["uid"] <= last_uid]
+    folder["pending_messages"] = len(messages)
+    folder["pending_bytes"] = sum(message["size"] for message in messages)
+    return folder
+
+async def plan_account(email_account: str, state: ArchiveState = None) -> dict:
+    """
+    Mede todas as pastas da conta (plan_mailbox) em uma sessão própria. Retorna o total
+    de mensagens no servidor ('messages'), o que esta execução deve baixar
+    ('pending_messages', 'pending_bytes') e o detalhe de cada pasta ('folders').
+    """
+    set_log_account(email_account)
+    plan = {"account": email_account, "messages": 0, "pending_messages": 0, "pending_bytes": 0,
+            "folders": []}
+    mail = None
+    try:
+        mail = await connect_with_backoff(email_account, IMAP_PASSWORD, USE_SSL, IMAP_SERVER, IMAP_PORT)
+        folders = await list_account_folders(mail)
+        if folders is None:
+            raise imaplib.IMAP4.error("não foi possível listar as pastas")
+        for raw_mailbox_name, local_mailbox_name in folders:
+            folder = await plan_mailbox(mail, email_account, raw_mailbox_name, state)
+            folder["local"] = local_mailbox_name
+            plan["folders"].append(folder)
+            for key in ("messages", "pending_messages", "pending_bytes"):
+                plan[key] += folder[key]
+    except Exception as e:
+        logging.error(f"Não foi possível planejar a conta {email_account}: {e}")
+        plan["error"] = str(e)
+    finally:
+        if mail is not None:
+            await close_imap_connection(mail)
+        set_log_account(None)
+    return plan
+
+def build_run_plan(accounts, state: ArchiveState, loop: asyncio.AbstractEventLoop) -> dict:
+    """
+    Planeja as contas em paralelo (até ACCOUNT_WORKERS sessões, no laço de eventos 'loop'),
+    grava o plano em PLAN_FILE (JSON) e o retorna, com as contas ordenadas da que tem mais
+    bytes a baixar para a que tem menos.
+    """
+    started = time.monotonic()
+    logging.info(f"Planejando o arquivamento de {len(accounts)} contas...")
+    account_plans = loop.run_until_complete(gather_limited(
+        lambda account: plan_account(account, state), accounts, ACCOUNT_WORKERS
+    ))
+    account_plans.sort(key=lambda item: item["pending_bytes"], reverse=True)
+    plan = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "server": f"{IMAP_SERVER}:{IMAP_PORT}",
+        "incremental": state is not None and INCREMENTAL_SYNC,
+        "messages": sum(item["messages"] for item in account_plans),
+        "pending_messages": sum(item["pending_messages"] for item in account_plans),
+        "pending_bytes": sum(item["pending_bytes"] for item in account_plans),
+        "accounts": account_plans,
+    }
+    if PLAN_FILE:
+        with open(PLAN_FILE, "w", encoding="utf-8") as f:
+            json.dump(plan, f, ensure_ascii=False, indent=2)
+    logging.info(
+        f"Plano: {plan['messages']} e-mails no servidor, {plan['pending_messages']} a baixar "
+        f"({plan['pending_bytes'] / (1024 * 1024):.1f} MB), medido em {time.monotonic() - started:.1f}s"
+        + (f" e gravado em '{PLAN_FILE}'." if PLAN_FILE else ".")
+    )
+    return plan
+
+class ArchiveProgress:
+    """
+    Progresso agregado da execução em relação ao plano, registrado no log no máximo uma
+    vez a cada 'interval' segundos: e-mails e MB gravados, vazão média e tempo restante
+    estimado a partir dela.
+    """
+
+    def __init__(self, total_messages: int, total_bytes: int, interval: float = PROGRESS_INTERVAL):
+        self.total_messages = total_messages
+        self.total_bytes = total_bytes
+        self.interval = interval
+        self.done_messages = 0
+        self.done_bytes = 0
+        self.started = time.monotonic()
+        self._last_log = self.started
+        self._lock = threading.Lock()
+
+    def add(self, messages: int, nbytes: int):
+        with self._lock:
+            self.done_messages += messages
+            self.done_bytes += nbytes
+            now = time.monotonic()
+            if now - self._last_log < self.interval:
+                return
+            self._last_log = now
+        self.log()
+
+    def log(self):
+        with self._lock:
+            done_messages, done_bytes = self.done_messages, self.done_bytes
+        elapsed = time.monotonic() - self.started
+        rate = done_bytes / elapsed if elapsed else 0.0
+        percent = min(100.0, done_bytes / self.total_bytes * 100) if self.total_bytes else 100.0
+        if rate:
+            hours, remainder = divmod(int(max(0, self.total_bytes - done_bytes) / rate), 3600)
+            eta = f"{hours}:{remainder // 60:02d}:{remainder % 60:02d}"
+        else:
+            eta = "?"
+        logging.info(
+            f"Progresso: {done_messages}/{self.total_messages} e-mails, "
+            f"{done_bytes / (1024 * 1024):.1f} de {self.total_bytes / (1024 * 1024):.1f} MB ({percent:.1f}%), "
+            f"{rate / (1024 * 1024):.2f} MB/s, restante estimado {eta}."
+        )
+
+def log_run_summary(summaries: list):
+    """
+    Registra no log uma tabela com o resultado de cada conta e o total da execução.
+    """
+    header = f"{'CONTA':<40} {'STATUS':<8} {'E-MAILS':>9} {'MB':>10} {'FALHAS':>7} {'DURAÇÃO':>9} {'COMPR.':>7}"
+    logging.info("Resumo da execução:")
+    logging.info(header)
+    logging.info("-" * len(header))
+    for item in summaries:
+        compression = f"{item['compression']:.1f}:1" if item["compression"] else "-"
+        logging.info(
+            f"{item['account']:<40} {item['status']:<8} {item['messages']:>9} "
+            f"{item['bytes'] / (1024 * 1024):>10.1f} {item['errors']:>7} {item['duration']:>8.1f}s {compression:>7}"
+        )
+    logging.info("-" * len(header))
+    ok = sum(1 for item in summaries if item["status"] == "OK")
+    logging.info(
+        f"{len(summaries)} contas: {ok} OK, {len(summaries) - ok} com falhas; "
+        f"{sum(item['messages'] for item in summaries)} e-mails, "
+        f"{sum(item['bytes'] for item in summaries) / (1024 * 1024):.1f} MB."
+    )
+
+async def archive_accounts(accounts, state: ArchiveState, blob_store: BlobStore, uploader: UploadPipeline,
+                           folder_plans: dict, progress: "ArchiveProgress", writer: WriteBehindPool,
+                           parser_pool: ProcessPoolExecutor) -> list:
+    """
+    Arquiva as contas: até ACCOUNT_WORKERS contas em paralelo, cada uma como uma tarefa no
+    laço de eventos, e não em uma thread própria. Retorna os resumos das contas.
+    """
+    def archive(account):
+        return archive_account(account, state, blob_store, uploader,
+                               folder_plans.get(account), progress, writer, parser_pool)
+
+    if ACCOUNT_WORKERS <= 1:
+        summaries = []
+        for account in accounts:
+            summaries.append(await archive(account))
+            await asyncio.sleep(ACCOUNT_DELAY)
+        return summaries
+    logging.info(
+        f"Arquivando {len(accounts)} contas com {ACCOUNT_WORKERS} tarefas "
+        f"(até {MAX_CONNECTIONS_PER_SERVER} conexões por servidor, ajustadas conforme a resposta do servidor)."
+    )
+    return await gather_limited(archive, accounts, ACCOUNT_WORKERS)
+
+def run_archive():
+    """
+    Executa o arquivamento: planejamento, download das contas e upload, com o resumo
+    final da execução. O planejamento e o download das contas rodam no mesmo laço de
+    eventos, com qualquer um dos motores IMAP.
+    """
+    loop = asyncio.new_event_loop()
+    try:
+        archive_run(loop)
+    finally:
+        close_event_loop(loop)
+
+def archive_run(loop: asyncio.AbstractEventLoop):
+    """
+    Corpo de run_archive; 'loop' é o laço de eventos da execução.
+    """
     logging.info("Iniciando o arquivamento de e-mails (IMAP) com reconexão, retentativas e diretórios aprimorados...")
-    for account in EMAIL_ACCOUNTS:
-        archive_account(account)
+    # O banco de estado guarda também o índice de mensagens usado pela deduplicação
+    state = ArchiveState(SYNC_STATE_DB) if INCREMENTAL_SYNC or DEDUP_STORE_DIR else None
+    plan = None
+    if PLAN_BEFORE_RUN or PLAN_ONLY:
+        plan = build_run_plan(EMAIL_ACCOUNTS, state, loop)
+        if PLAN_ONLY:
+            if state is not None:
+                state.close()
+            logging.info("PLAN_ONLY ativo: plano gerado, nenhum e-mail foi baixado.")
+            return
+    accounts = EMAIL_ACCOUNTS
+    folder_plans = {}
+    progress = None
+    if plan is not None:
+        folder_plans = {
+            item["account"]: {folder["mailbox"]: folder["pending_bytes"] for folder in item["folders"]}
+            for item in plan["accounts"]
+        }
+        progress = ArchiveProgress(plan["pending_messages"], plan["pending_bytes"], PROGRESS_INTERVAL)
+        if ACCOUNT_WORKERS > 1:
+            # As contas com mais bytes a baixar começam primeiro, para que nenhum worker
+            # receba uma conta grande quando os demais já estão terminando
+            accounts = [item["account"] for item in plan["accounts"]]
+    blob_store = BlobStore(DEDUP_STORE_DIR, DEDUP_LINK_MODE) if DEDUP_STORE_DIR else None
+    writer = WriteBehindPool(WRITER_THREADS, WRITE_BEHIND_MAX_BYTES) if WRITER_THREADS > 0 else None
+    parser_pool = ProcessPoolExecutor(max_workers=METADATA_WORKERS) if METADATA_WORKERS > 0 else None
+    uploader = None
+    upload_state = None
+    if PIPELINE_UPLOAD:
+        upload_state = UploadState(PIPELINE_STATE_DB) if PIPELINE_STATE_DB else None
+        uploader = UploadPipeline(
+            local_root=MAILSTORE_HOME,
+            workers=PIPELINE_UPLOAD_WORKERS,
+            max_pending_bytes=PIPELINE_MAX_PENDING_BYTES,
+            delete_after_upload=PIPELINE_DELETE_AFTER_UPLOAD,
+            state=upload_state
+        )
+    try:
+        summaries = loop.run_until_complete(archive_accounts(accounts, state, blob_store, uploader,
+                                                             folder_plans, progress, writer, parser_pool))
+    finally:
+        if parser_pool is not None:
+            parser_pool.shutdown(wait=True)
+        if writer is not None:
+            write_stats = writer.close()
+            logging.info(
+                f"Gravação em segundo plano: {write_stats['writes']} arquivos "
+                f"({write_stats['bytes'] / (1024 * 1024):.1f} MB); o download aguardou o disco "
+                f"{write_stats['stalls']} vezes ({write_stats['stall_seconds']:.1f}s)."
+            )
+        if uploader is not None:
+            logging.info("Aguardando a conclusão dos uploads pendentes...")
+            upload_stats = uploader.close()
+            logging.info(
+                f"Upload: {upload_stats['files']} arquivos "
+                f"({upload_stats['bytes'] / (1024 * 1024):.1f} MB) enviados, {upload_stats['failed']} falhas."
+            )
+            for local_path in upload_stats["failed_paths"]:
+                logging.error(f"Upload não concluído (o arquivo local foi mantido): {local_path}")
+        if upload_state is not None:
+            upload_state.close()
+        if state is not None:
+            state.close()
+    if progress is not None:
+        progress.log()
+    log_run_summary(summaries)
+    if blob_store is not None:
+        blob_store.log_stats()
     logging.info("Arquivamento de e-mails concluído.")
 
+def main():
+    init_logger()
+    exporter = None
+    if METRICS_PROM_FILE or METRICS_JSON_FILE:
+        exporter = MetricsExporter(metrics, METRICS_PROM_FILE, METRICS_JSON_FILE, METRICS_INTERVAL)
+        exporter.start()
+    try:
+        run_profiled(run_archive, PROFILE_MODE, PROFILE_FILE)
+    finally:
+        if exporter is not None:
+            exporter.stop()
+            logging.info(
+                "Métricas gravadas em "
+                + " e ".join(f"'{path}'" for path in (METRICS_PROM_FILE, METRICS_JSON_FILE) if path) + "."
+            )
+        # Grava os registros ainda na fila antes de retornar (e não apenas no atexit)
+        stop_logging()
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,201 @@
+import bisect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Limites superiores (segundos) dos intervalos dos histogramas de latência
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class MetricsRegistry:
+    """
+    Contadores e histogramas de latência identificados por nome e rótulos (ex.: conta,
+    pasta, operação IMAP), atualizados por várias threads. O conteúdo é exportado no
+    formato texto do Prometheus (para o textfile collector do node_exporter) e em JSON.
+
+    Os histogramas seguem a convenção do Prometheus: 'nome_bucket' (acumulado por limite
+    'le'), 'nome_sum' e 'nome_count'.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.started = time.time()
+        self._counters = {}
+        self._histograms = {}
+        self._help = {}
+        self._lock = threading.Lock()
+
+    def describe(self, name: str, text: str):
+        """Define o texto de ajuda (# HELP) da métrica 'name'."""
+        self._help[name] = text
+
+    def inc(self, name: str, value=1, **labels):
+        """Soma 'value' ao contador 'name' com os rótulos informados."""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels):
+        """Registra uma duração no histograma 'name' com os rótulos informados."""
+        key = (name, tuple(sorted(labels.items())))
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                # Contagem por intervalo (o último é o "+Inf"), soma e total de observações
+                histogram = self._histograms[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            histogram[0][index] += 1
+            histogram[1] += seconds
+            histogram[2] += 1
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        """
+        Mede o bloco 'with' no histograma 'name_seconds'. Se o bloco levantar uma exceção,
+        a duração não é registrada e o contador 'name_errors_total' é incrementado.
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.inc(f"{name}_errors_total", **labels)
+            raise
+        self.observe(f"{name}_seconds", time.perf_counter() - started, **labels)
+
+    def to_prometheus(self) -> str:
+        """Retorna as métricas no formato texto de exposição do Prometheus."""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, (list(h[0]), h[1], h[2])) for key, h in self._histograms.items())
+        lines = []
+        described = set()
+
+        def header(name, kind):
+            if name in described:
+                return
+            described.add(name)
+            if name in self._help:
+                lines.append(f"# HELP {name} {self._help[name]}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in counters:
+            header(name, "counter")
+            lines.append(f"{name}{format_labels(labels)} {value}")
+        for (name, labels), (counts, total, count) in histograms:
+            header(name, "histogram")
+            cumulative = 0
+            for limit, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket_count
+                lines.append(f"{name}_bucket{format_labels(labels + (('le', str(limit)),))} {cumulative}")
+            lines.append(f"{name}_sum{format_labels(labels)} {total:.6f}")
+            lines.append(f"{name}_count{format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def to_dict(self) -> dict:
+        """
+        Retorna as métricas como dicionário (relatório JSON): cada histograma traz também
+        a média e os percentis 50/90/99 estimados pelos intervalos.
+        """
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, (list(h[0]), h[1], h[2])) for key, h in self._histograms.items())
+        report = {
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+            "generated": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "counters": [],
+            "histograms": [],
+        }
+        for (name, labels), value in counters:
+            report["counters"].append({"name": name, "labels": dict(labels), "value": value})
+        for (name, labels), (counts, total, count) in histograms:
+            report["histograms"].append({
+                "name": name,
+                "labels": dict(labels),
+                "count": count,
+                "sum": round(total, 6),
+                "avg": round(total / count, 6) if count else 0.0,
+                "p50": self._quantile(counts, count, 0.50),
+                "p90": self._quantile(counts, count, 0.90),
+                "p99": self._quantile(counts, count, 0.99),
+            })
+        return report
+
+    def write(self, prometheus_path: str = "", json_path: str = ""):
+        """
+        Grava as métricas nos arquivos informados. Cada arquivo é escrito em um temporário
+        e renomeado, para que o coletor nunca leia um arquivo incompleto.
+        """
+        if prometheus_path:
+            write_atomic(prometheus_path, self.to_prometheus())
+        if json_path:
+            write_atomic(json_path, json.dumps(self.to_dict(), ensure_ascii=False, indent=2))
+
+    def _quantile(self, counts, count, q):
+        # Limite superior do intervalo que contém o quantil (None se cair no "+Inf")
+        if not count:
+            return None
+        target = q * count
+        cumulative = 0
+        for limit, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            if cumulative >= target:
+                return limit
+        return None
+
+
+class MetricsExporter:
+    """
+    Grava periodicamente, a cada 'interval' segundos, as métricas de 'registry' em uma
+    thread própria; stop() encerra a thread e faz a gravação final.
+    """
+
+    def __init__(self, registry: MetricsRegistry, prometheus_path: str, json_path: str, interval: float):
+        self.registry = registry
+        self.prometheus_path = prometheus_path
+        self.json_path = json_path
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self.interval > 0:
+            self._thread = threading.Thread(target=self._run, name="metricas", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.registry.write(self.prometheus_path, self.json_path)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.registry.write(self.prometheus_path, self.json_path)
+            except OSError:
+                pass  # Uma falha de gravação intermediária não interrompe a execução
+
+
+def format_labels(labels) -> str:
+    """Formata ((nome, valor), ...) como {nome="valor",...}, com os escapes do Prometheus."""
+    if not labels:
+        return ""
+    parts = []
+    for name, value in labels:
+        value = str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+        parts.append(f'{name}="{value}"')
+    return "{" + ",".join(parts) + "}"
+
+
+def write_atomic(path: str, content: str):
+    """Grava 'content' em 'path' por meio de um arquivo temporário renomeado."""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+# Registro compartilhado pelos módulos instrumentados (download IMAP e upload FTP)
+metrics = MetricsRegistry()
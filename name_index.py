@@ -0,0 +1,104 @@
+import os
+import shutil
+import threading
+
+
+class DirectoryNameIndex:
+    """
+    Índice em memória dos nomes de arquivos de um diretório, carregado uma única vez com
+    os.scandir e atualizado a cada nome reservado, para alocar nomes livres sem consultar
+    o sistema de arquivos a cada tentativa.
+
+    O índice assume que, enquanto estiver em uso, apenas este processo cria arquivos no
+    diretório.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        # Próximo contador a testar para cada (base, extensão) já repetido
+        self._next_counter = {}
+        self._names = set()
+        if os.path.isdir(path):
+            with os.scandir(path) as entries:
+                self._names = {entry.name for entry in entries}
+
+    def __contains__(self, filename: str) -> bool:
+        with self._lock:
+            return filename in self._names
+
+    def allocate(self, filename: str) -> str:
+        """
+        Reserva e retorna 'filename' se estiver livre; caso contrário, reserva o primeiro
+        nome livre com sufixo numérico ("base_1.ext", "base_2.ext", ...).
+        """
+        with self._lock:
+            if filename not in self._names:
+                self._names.add(filename)
+                return filename
+            base, ext = os.path.splitext(filename)
+            counter = self._next_counter.get((base, ext), 1)
+            candidate = f"{base}_{counter}{ext}"
+            while candidate in self._names:
+                counter += 1
+                candidate = f"{base}_{counter}{ext}"
+            self._names.add(candidate)
+            self._next_counter[(base, ext)] = counter + 1
+            return candidate
+
+    def add(self, filename: str):
+        """
+        Registra um nome criado no diretório por outro caminho.
+        """
+        with self._lock:
+            self._names.add(filename)
+
+    def discard(self, filename: str):
+        """
+        Remove um nome do índice (ex.: reserva cuja gravação falhou).
+        """
+        with self._lock:
+            self._names.discard(filename)
+
+
+# Índices compartilhados por diretório, para que o downloader e a ferramenta de
+# renomeação usem o mesmo índice de um diretório dentro do processo
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_directory_index(path: str) -> DirectoryNameIndex:
+    """
+    Retorna o índice compartilhado do diretório, carregando-o na primeira chamada.
+    """
+    key = os.path.abspath(path)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = DirectoryNameIndex(key)
+            _indexes[key] = index
+        return index
+
+
+def release_directory_index(path: str):
+    """
+    Libera da memória o índice do diretório, ao final do processamento da pasta.
+    """
+    with _indexes_lock:
+        _indexes.pop(os.path.abspath(path), None)
+
+
+def safe_move(src: str, dst: str):
+    """
+    Move o arquivo de src para dst. Se já existir um arquivo com o mesmo nome em dst,
+    adiciona um sufixo numérico para evitar sobrescrita. O nome livre é alocado pelo
+    índice do diretório de destino, sem uma chamada a os.path.exists por tentativa.
+    """
+    dst_dir = os.path.dirname(dst)
+    index = get_directory_index(dst_dir)
+    filename = index.allocate(os.path.basename(dst))
+    try:
+        shutil.move(src, os.path.join(dst_dir, filename))
+    except BaseException:
+        index.discard(filename)
+        raise
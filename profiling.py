@@ -0,0 +1,89 @@
+import cProfile
+import collections
+import logging
+import os
+import sys
+import threading
+import time
+
+# Intervalo entre amostras do perfilador por amostragem (segundos)
+SAMPLE_INTERVAL = 0.005
+
+
+class SamplingProfiler:
+    """
+    Perfilador por amostragem: uma thread própria lê, a cada 'interval' segundos, as
+    pilhas de todas as threads do processo (sys._current_frames) e conta quantas vezes
+    cada pilha foi vista. Ao contrário do cProfile, cobre as threads de download, de
+    gravação e de upload com custo baixo e independente do número de chamadas.
+
+    O resultado é gravado no formato "collapsed" (uma pilha por linha, funções separadas
+    por ';', seguida da contagem), lido por flamegraph.pl, speedscope e similares.
+    """
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL):
+        self.interval = interval
+        self.samples = 0
+        self._stacks = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="perfilador", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def write(self, path: str):
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self._stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                functions = []
+                while frame is not None:
+                    code = frame.f_code
+                    functions.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                functions.append(names.get(thread_id, str(thread_id)))
+                self._stacks[";".join(reversed(functions))] += 1
+            self.samples += 1
+
+
+def run_profiled(func, mode: str, output: str):
+    """
+    Executa func() sob o perfilador escolhido e grava o resultado em 'output':
+    "cprofile" grava as estatísticas do cProfile (pstats; apenas a thread principal) e
+    "sampling" grava as pilhas amostradas de todas as threads (SamplingProfiler).
+    Com outro valor, apenas executa func().
+    """
+    if mode == "cprofile":
+        profiler = cProfile.Profile()
+        try:
+            return profiler.runcall(func)
+        finally:
+            profiler.dump_stats(output)
+            logging.info(f"Perfil (cProfile) gravado em {output}; leia com: python -m pstats {output}")
+    if mode == "sampling":
+        profiler = SamplingProfiler()
+        started = time.monotonic()
+        profiler.start()
+        try:
+            return func()
+        finally:
+            profiler.stop()
+            profiler.write(output)
+            logging.info(
+                f"Perfil por amostragem gravado em {output} ({profiler.samples} amostras em "
+                f"{time.monotonic() - started:.1f}s); formato collapsed para flamegraph.pl/speedscope."
+            )
+    return func()
@@ -1,5 +1,6 @@
 import os
-import shutil
+
+from name_index import release_directory_index, safe_move
 
 # Lista de diretórios base
 base_paths = [
@@ -9,21 +10,6 @@ base_paths = [
 # Conjunto de nomes (após remover "INBOX.") que deverão receber o prefixo "."
 dot_folders = {"Drafts", "Junk", "Sent", "spam", "Trash", "Archive"}
 
-def safe_move(src, dst):
-    """
-    Move o arquivo de src para dst. Se já existir um arquivo com o mesmo nome em dst,
-    adiciona um sufixo numérico para evitar sobrescrever.
-    """
-    if os.path.exists(dst):
-        base, ext = os.path.splitext(os.path.basename(dst))
-        counter = 1
-        new_dst = os.path.join(os.path.dirname(dst), f"{base}_{counter}{ext}")
-        while os.path.exists(new_dst):
-            counter += 1
-            new_dst = os.path.join(os.path.dirname(dst), f"{base}_{counter}{ext}")
-        dst = new_dst
-    shutil.move(src, dst)
-
 # Itera sobre cada diretório base da lista
 for base_path in base_paths:
     # Itera sobre todos os itens no diretório base
@@ -64,11 +50,12 @@ for base_path in base_paths:
                 # Percorre os itens presentes na raiz do diretório recém-renomeado
                 # Observação: se houver subpastas (como uma eventual pasta "cur" já existente),
                 # elas não serão afetadas.
-                for item in os.listdir(new_path):
-                    item_path = os.path.join(new_path, item)
+                with os.scandir(new_path) as entries:
                     # Move apenas os arquivos; diretórios (como a própria pasta "cur") são ignorados.
-                    if os.path.isfile(item_path):
-                        destination = os.path.join(cur_subfolder, item)
-                        safe_move(item_path, destination)
+                    files = [entry for entry in entries if entry.is_file()]
+                for entry in files:
+                    destination = os.path.join(cur_subfolder, entry.name)
+                    safe_move(entry.path, destination)
+                release_directory_index(cur_subfolder)
 
 print("Conversão de diretórios concluída!")
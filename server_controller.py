@@ -0,0 +1,218 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+
+# Operações com pelo menos este volume (bytes) estimam a vazão do servidor; as menores,
+# dominadas pela ida e volta, estimam o tempo de resposta
+THROUGHPUT_MIN_BYTES = 256 * 1024
+# Fração com que as referências de latência acompanham, a cada operação, medições piores
+# que elas: uma melhor marca obtida em um momento excepcional não vale para sempre
+LATENCY_BASELINE_DECAY = 0.05
+# Tempo esperado mínimo (segundos), para que oscilações de milissegundos em redes rápidas
+# não sejam tomadas por lentidão
+LATENCY_FLOOR = 0.05
+
+
+class ServerController:
+    """
+    Controle adaptativo das sessões IMAP de um servidor, compartilhado por todas as
+    contas e pastas que o acessam. Substitui o semáforo de tamanho fixo:
+
+    - O número de sessões simultâneas segue o padrão AIMD: cresce aos poucos (cerca de
+      uma sessão a cada 'limite' operações bem-sucedidas) até 'max_sessions' e cai pela
+      metade a cada falha ou quando o tempo das operações se afasta do esperado pelas
+      melhores medições recentes de tempo de resposta e de vazão.
+    - As esperas entre tentativas crescem exponencialmente, com variação aleatória, para
+      que as sessões não voltem todas ao mesmo tempo.
+    - Após 'breaker_threshold' falhas consecutivas, o circuito abre: novas sessões e
+      novas tentativas aguardam 'breaker_cooldown' segundos (que dobra a cada reabertura)
+      e o servidor volta a ser usado com uma única sessão.
+
+    acquire()/release() mantêm a interface de um semáforo; acquire_async() e
+    backoff_async() aguardam sem bloquear o laço de eventos do downloader.
+    """
+
+    def __init__(self, name: str, max_sessions: int, initial_sessions: int = 1,
+                 backoff_base: float = 1.0, backoff_max: float = 60.0,
+                 breaker_threshold: int = 5, breaker_cooldown: float = 30.0,
+                 latency_tolerance: float = 3.0):
+        self.name = name
+        self.max_sessions = max(1, max_sessions)
+        self.limit = float(max(1, min(initial_sessions, self.max_sessions)))
+        self.active = 0
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+        self.latency_tolerance = latency_tolerance
+        self._cooldown = breaker_cooldown
+        self._open_until = 0.0
+        self._consecutive_failures = 0
+        self._latency_avg = None
+        self._rtt_best = None
+        self._throughput_best = None
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+        # Corrotinas aguardando vaga: (laço de eventos, asyncio.Event) avisados como a condição
+        self._async_waiters = []
+
+    def acquire(self, blocking: bool = True) -> bool:
+        """
+        Reserva uma sessão dentro do limite atual, aguardando vaga (e o fechamento do
+        circuito). Com blocking=False, retorna False em vez de aguardar.
+        """
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                if now >= self._open_until and self.active < int(self.limit):
+                    self.active += 1
+                    return True
+                if not blocking:
+                    return False
+                self._condition.wait(timeout=max(0.1, min(1.0, self._open_until - now)))
+
+    async def acquire_async(self, blocking: bool = True) -> bool:
+        """
+        Como acquire(), para corrotinas: a espera é um asyncio.Event avisado por release()
+        e pelo aumento do limite, sem prender a thread do laço de eventos. Com o circuito
+        aberto, a espera termina também no seu fechamento.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._condition:
+                now = time.monotonic()
+                if now >= self._open_until and self.active < int(self.limit):
+                    self.active += 1
+                    return True
+                if not blocking:
+                    return False
+                waiter = (loop, asyncio.Event())
+                self._async_waiters.append(waiter)
+                timeout = self._open_until - now if now < self._open_until else None
+            try:
+                await asyncio.wait_for(waiter[1].wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                with self._condition:
+                    self._async_waiters.remove(waiter)
+
+    def release(self):
+        with self._condition:
+            self.active -= 1
+            self._notify_waiters()
+
+    def over_limit(self) -> bool:
+        """Indica se há mais sessões abertas do que o limite atual permite."""
+        with self._condition:
+            return self.active > int(self.limit)
+
+    def record_success(self, elapsed: float = None, nbytes: int = 0):
+        """
+        Registra uma operação bem-sucedida. 'elapsed' é o tempo da operação (ex.: um FETCH)
+        e 'nbytes' o volume recebido; a razão entre 'elapsed' e o tempo esperado para esse
+        volume (ida e volta + bytes / vazão) detecta lentidão.
+        """
+        with self._condition:
+            if self._consecutive_failures >= self.breaker_threshold:
+                logging.info(f"Servidor {self.name}: circuito fechado, operações normalizadas.")
+            self._consecutive_failures = 0
+            self._cooldown = self.breaker_cooldown
+            if elapsed is not None:
+                slowdown = self._observe_latency(elapsed, nbytes)
+                if slowdown is not None:
+                    self._latency_avg = slowdown if self._latency_avg is None else 0.8 * self._latency_avg + 0.2 * slowdown
+                    if self._latency_avg > self.latency_tolerance:
+                        self._decrease("latência elevada")
+                        return
+            previous = int(self.limit)
+            self.limit = min(self.max_sessions, self.limit + 1 / self.limit)
+            if int(self.limit) > previous:
+                logging.info(f"Servidor {self.name}: limite ampliado para {int(self.limit)} sessões simultâneas.")
+                self._notify_waiters()
+
+    def record_failure(self):
+        """
+        Registra uma falha (queda de conexão, recusa ou erro do servidor), reduzindo o
+        limite de sessões e abrindo o circuito após falhas consecutivas.
+        """
+        with self._condition:
+            self._consecutive_failures += 1
+            self._decrease("falha")
+            if self._consecutive_failures >= self.breaker_threshold:
+                self._open_until = time.monotonic() + self._cooldown
+                self.limit = 1.0
+                logging.warning(
+                    f"Servidor {self.name}: {self._consecutive_failures} falhas consecutivas; "
+                    f"circuito aberto por {self._cooldown:.0f}s."
+                )
+                self._cooldown = min(self._cooldown * 2, self.backoff_max * 10)
+
+    def backoff(self, attempt: int):
+        """
+        Aguarda antes da tentativa seguinte (backoff_delay).
+        """
+        delay = self.backoff_delay(attempt)
+        if delay > 0:
+            time.sleep(delay)
+
+    async def backoff_async(self, attempt: int):
+        """Como backoff(), para corrotinas."""
+        delay = self.backoff_delay(attempt)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def backoff_delay(self, attempt: int) -> float:
+        """
+        Espera antes da tentativa seguinte: base * 2^(tentativa - 1), limitado a
+        backoff_max, com variação aleatória entre metade e o total, e no mínimo até o
+        fechamento do circuito.
+        """
+        delay = min(self.backoff_max, self.backoff_base * 2 ** max(0, attempt - 1))
+        delay = random.uniform(delay / 2, delay)
+        with self._condition:
+            return max(delay, self._open_until - time.monotonic())
+
+    def _notify_waiters(self):
+        # Chamado com a trava: acorda as threads (acquire) e as corrotinas (acquire_async)
+        # que aguardam vaga; cada corrotina é avisada no seu próprio laço de eventos
+        self._condition.notify_all()
+        for loop, event in self._async_waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                pass  # Laço já encerrado
+
+    def _observe_latency(self, elapsed: float, nbytes: int):
+        # Razão entre o tempo medido e o esperado pelas referências anteriores (None enquanto
+        # não há referência para esse volume); em seguida, atualiza a referência
+        # correspondente, que cai de imediato para uma medição melhor e sobe aos poucos
+        expected = None
+        if nbytes < THROUGHPUT_MIN_BYTES:
+            if self._rtt_best is not None:
+                expected = self._rtt_best + (nbytes / self._throughput_best if self._throughput_best else 0.0)
+            self._rtt_best = elapsed if self._rtt_best is None else min(
+                elapsed, self._rtt_best + LATENCY_BASELINE_DECAY * (elapsed - self._rtt_best))
+        else:
+            if self._throughput_best is not None:
+                expected = (self._rtt_best or 0.0) + nbytes / self._throughput_best
+            throughput = nbytes / max(elapsed, 1e-6)
+            self._throughput_best = throughput if self._throughput_best is None else max(
+                throughput, self._throughput_best + LATENCY_BASELINE_DECAY * (throughput - self._throughput_best))
+        if expected is None:
+            return None
+        return elapsed / max(expected, LATENCY_FLOOR)
+
+    def _decrease(self, reason: str):
+        # Uma redução por janela, para que uma rajada de falhas simultâneas não zere o limite
+        now = time.monotonic()
+        if now - self._last_decrease < 5:
+            return
+        self._last_decrease = now
+        self._latency_avg = None
+        previous = int(self.limit)
+        self.limit = max(1.0, self.limit / 2)
+        if int(self.limit) < previous:
+            logging.info(f"Servidor {self.name}: limite reduzido para {int(self.limit)} sessões ({reason}).")
@@ -0,0 +1,244 @@
+import itertools
+import json
+import logging
+import os
+import shutil
+import ssl
+import subprocess
+import tempfile
+import unittest
+from unittest import mock
+
+import maildownloader_improved
+from archive_state import ArchiveState
+from fake_imap_server import FakeImapServer
+
+# Verificação de ponta a ponta do downloader contra o servidor IMAP de teste
+# (fake_imap_server.py): para cada motor (imaplib e asyncio), com e sem TLS e com e sem
+# COMPRESS=DEFLATE, os arquivos gravados devem ser idênticos, byte a byte, às mensagens
+# do servidor. Também para os dois motores: retomada incremental a partir do último UID,
+# repetição de um UID cujo FETCH falhou e ressincronização completa quando o UIDVALIDITY
+# muda. Execute com: python -m unittest test_imap_engines
+
+ACCOUNT = "arquivo@example.org"
+# Limite de streaming reduzido, para que as mensagens grandes sejam baixadas em partes
+STREAM_THRESHOLD = 64 * 1024
+STREAM_CHUNK_SIZE = 16 * 1024
+
+
+def build_message(index: int, size: int) -> bytes:
+    """
+    Monta uma mensagem com cabeçalhos, assunto codificado (RFC 2047) e corpo de 8 bits
+    de aproximadamente 'size' bytes.
+    """
+    line = f"Linha {index}: relatório de arrecadação, exercício nº {index} ".encode("latin-1") + b"\r\n"
+    body = line * max(1, size // len(line))
+    return (
+        f"From: Remetente {index} <remetente{index}@example.org>\r\n"
+        f"To: {ACCOUNT}\r\n"
+        f"Subject: =?utf-8?q?Relat=C3=B3rio_{index}?=\r\n"
+        f"Message-ID: <teste-{index}@example.org>\r\n"
+        "Date: Mon, 01 Jan 2024 10:00:00 -0300\r\n"
+        "Content-Type: text/plain; charset=iso-8859-1\r\n"
+        "Content-Transfer-Encoding: 8bit\r\n"
+        "\r\n"
+    ).encode("ascii") + body
+
+
+def build_mailboxes() -> dict:
+    """
+    Pastas do servidor de teste: mensagens pequenas (várias por lote de FETCH) e
+    maiores que STREAM_THRESHOLD (baixadas em partes), com flags variadas.
+    """
+    sizes = [200, 3000, 150_000, 800, 40_000, 70_000, 100, 5000]
+    inbox = [("\\Seen" if index % 2 else "\\Seen \\Flagged", build_message(index, size))
+             for index, size in enumerate(sizes, start=1)]
+    sent = [("\\Seen", build_message(100 + index, 1000 * index)) for index in range(1, 7)]
+    return {"INBOX": inbox, "INBOX.Sent": sent}
+
+
+def make_server_context(directory: str):
+    """
+    Gera um certificado autoassinado com o openssl e retorna o contexto TLS do servidor,
+    ou None se o openssl não estiver disponível.
+    """
+    openssl = shutil.which("openssl")
+    if openssl is None:
+        return None
+    cert_path = os.path.join(directory, "cert.pem")
+    key_path = os.path.join(directory, "key.pem")
+    subprocess.run(
+        [openssl, "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+         "-subj", "/CN=127.0.0.1", "-keyout", key_path, "-out", cert_path],
+        check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    context.load_cert_chain(cert_path, key_path)
+    return context
+
+
+def read_maildir_tree(root: str) -> dict:
+    """
+    Retorna {diretório relativo: [conteúdo de cada arquivo, ordenado]} da árvore 'root',
+    ignorando os diretórios vazios (como tmp/ e new/).
+    """
+    tree = {}
+    for directory, _, files in os.walk(root):
+        for name in files:
+            with open(os.path.join(directory, name), "rb") as f:
+                tree.setdefault(os.path.relpath(directory, root), []).append(f.read())
+    return {directory: sorted(contents) for directory, contents in tree.items()}
+
+
+class ImapEnginesTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.mkdtemp(prefix="test_imap_engines_")
+        cls.ssl_context = make_server_context(cls.tmp)
+        cls.mailboxes = build_mailboxes()
+        user = maildownloader_improved.get_local_username(ACCOUNT)
+        cls.expected = {
+            os.path.join(user, "cur"): sorted(raw for _, raw in cls.mailboxes["INBOX"]),
+            os.path.join(user, ".Sent", "cur"): sorted(raw for _, raw in cls.mailboxes["INBOX.Sent"]),
+        }
+        logging.disable(logging.CRITICAL)
+
+    @classmethod
+    def tearDownClass(cls):
+        logging.disable(logging.NOTSET)
+        shutil.rmtree(cls.tmp, ignore_errors=True)
+
+    def test_archived_files_match_server(self):
+        for engine, use_ssl, compress in itertools.product(("imaplib", "asyncio"), (False, True), (True, False)):
+            with self.subTest(engine=engine, ssl=use_ssl, compress=compress):
+                if use_ssl and self.ssl_context is None:
+                    self.skipTest("openssl indisponível para gerar o certificado de teste")
+                self.run_case(engine, use_ssl, compress)
+
+    def settings(self, case_dir: str, server: FakeImapServer, engine: str, use_ssl: bool = False,
+                 compress: bool = False) -> dict:
+        """Configuração do downloader para arquivar o servidor de teste em 'case_dir'."""
+        return {
+            "IMAP_SERVER": "127.0.0.1",
+            "IMAP_PORT": server.port,
+            "USE_SSL": use_ssl,
+            "IMAP_ENGINE": engine,
+            "IMAP_COMPRESS": compress,
+            "IMAP_PASSWORD": "senha",
+            "EMAIL_ACCOUNTS": [ACCOUNT],
+            "MAILSTORE_HOME": os.path.join(case_dir, "store"),
+            "SYNC_STATE_DB": os.path.join(case_dir, "state.db"),
+            "PLAN_FILE": os.path.join(case_dir, "plan.json"),
+            "DEDUP_STORE_DIR": "",
+            "PIPELINE_UPLOAD": False,
+            "METADATA_WORKERS": 0,
+            "ACCOUNT_DELAY": 0,
+            "FOLDER_WORKERS": 2,
+            "FETCH_BATCH_MAX_MESSAGES": 3,
+            "STREAM_THRESHOLD": STREAM_THRESHOLD,
+            "STREAM_CHUNK_SIZE": STREAM_CHUNK_SIZE,
+        }
+
+    def run_case(self, engine: str, use_ssl: bool, compress: bool):
+        case_dir = os.path.join(self.tmp, f"{engine}-{'tls' if use_ssl else 'plain'}-{'deflate' if compress else 'raw'}")
+        os.makedirs(case_dir)
+        server = FakeImapServer(self.mailboxes, ssl_context=self.ssl_context if use_ssl else None)
+        settings = self.settings(case_dir, server, engine, use_ssl, compress)
+        with server, mock.patch.multiple(maildownloader_improved, **settings):
+            maildownloader_improved.run_archive()
+        self.assertEqual(read_maildir_tree(settings["MAILSTORE_HOME"]), self.expected)
+        # As mensagens maiores que STREAM_THRESHOLD foram baixadas em partes
+        self.assertTrue(any("BODY.PEEK[]<" in command for command in server.commands))
+        if compress:
+            self.assertGreater(server.compressed_sessions, 0)
+        else:
+            self.assertEqual(server.compressed_sessions, 0)
+            self.assertFalse(any(" COMPRESS " in command for command in server.commands))
+
+    def test_incremental_runs_retry_failures_and_resync(self):
+        for engine in ("imaplib", "asyncio"):
+            with self.subTest(engine=engine):
+                self.run_incremental_case(engine)
+
+    def run_incremental_case(self, engine: str):
+        case_dir = os.path.join(self.tmp, f"incremental-{engine}")
+        os.makedirs(case_dir)
+        # Pastas próprias: o teste acrescenta mensagens à INBOX do servidor
+        server = FakeImapServer(build_mailboxes())
+        settings = self.settings(case_dir, server, engine)
+        retries = maildownloader_improved.FAILED_UID_RETRIES
+        inbox_dir = os.path.join(maildownloader_improved.get_local_username(ACCOUNT), "cur")
+        inbox = server.mailboxes["INBOX"]
+        with server, mock.patch.multiple(maildownloader_improved, **settings):
+            # 1ª execução: o FETCH do UID 6 da INBOX falha; os demais e-mails são arquivados
+            server.fail_fetch = {("INBOX", 6)}
+            maildownloader_improved.run_archive()
+            archived = read_maildir_tree(settings["MAILSTORE_HOME"])
+            self.assertEqual(archived[inbox_dir], sorted(raw for uid, (_, raw) in inbox.items() if uid != 6))
+            state = ArchiveState(settings["SYNC_STATE_DB"])
+            try:
+                uidvalidity, last_uid = state.get_folder_state(ACCOUNT, "INBOX")
+                self.assertEqual(state.get_failed_uids(ACCOUNT, "INBOX", uidvalidity, retries), [6])
+            finally:
+                state.close()
+            self.assertEqual(last_uid, max(inbox))
+
+            # 2ª execução: uma mensagem nova; só ela e o UID 6 são baixados
+            server.fail_fetch = set()
+            new_uid = max(inbox) + 3
+            inbox[new_uid] = ("\\Seen", build_message(50, 2000))
+            first_command, server.fetched_bodies = len(server.commands), []
+            maildownloader_improved.run_archive()
+            self.assertIn(f"UID FETCH {last_uid + 1}:* (UID RFC822.SIZE)", " ".join(server.commands[first_command:]))
+            self.assertEqual(sorted(server.fetched_bodies), [("INBOX", 6), ("INBOX", new_uid)])
+            self.assertEqual(read_maildir_tree(settings["MAILSTORE_HOME"])[inbox_dir],
+                             sorted(raw for _, raw in inbox.values()))
+            state = ArchiveState(settings["SYNC_STATE_DB"])
+            try:
+                self.assertEqual(state.get_failed_uids(ACCOUNT, "INBOX", uidvalidity, retries), [])
+                self.assertEqual(state.get_folder_state(ACCOUNT, "INBOX"), (uidvalidity, new_uid))
+            finally:
+                state.close()
+
+            # 3ª execução: o UIDVALIDITY mudou; a pasta inteira é baixada novamente
+            server.uidvalidity += 1
+            server.fetched_bodies = []
+            maildownloader_improved.run_archive()
+            self.assertEqual(sorted(server.fetched_bodies),
+                             sorted((name, uid) for name, messages in server.mailboxes.items() for uid in messages))
+            archived = read_maildir_tree(settings["MAILSTORE_HOME"])[inbox_dir]
+            self.assertEqual(sorted(set(archived)), sorted(raw for _, raw in inbox.values()))
+            state = ArchiveState(settings["SYNC_STATE_DB"])
+            try:
+                self.assertEqual(state.get_folder_state(ACCOUNT, "INBOX"), (server.uidvalidity, new_uid))
+            finally:
+                state.close()
+
+    def test_plan_counts_pending_retries(self):
+        for engine in ("imaplib", "asyncio"):
+            with self.subTest(engine=engine):
+                case_dir = os.path.join(self.tmp, f"plan-{engine}")
+                os.makedirs(case_dir)
+                server = FakeImapServer(self.mailboxes)
+                settings = self.settings(case_dir, server, engine)
+                with server, mock.patch.multiple(maildownloader_improved, **settings):
+                    maildownloader_improved.run_archive()
+                    # Um UID já arquivado volta a ficar pendente, como após uma falha de FETCH
+                    state = ArchiveState(settings["SYNC_STATE_DB"])
+                    try:
+                        uidvalidity, _ = state.get_folder_state(ACCOUNT, "INBOX")
+                        state.record_failed_uids(ACCOUNT, "INBOX", uidvalidity, [6])
+                    finally:
+                        state.close()
+                    with mock.patch.object(maildownloader_improved, "PLAN_ONLY", True):
+                        maildownloader_improved.run_archive()
+                with open(settings["PLAN_FILE"], encoding="utf-8") as f:
+                    plan = json.load(f)
+                # O UID 6 é a segunda mensagem da INBOX (UIDs de 3 em 3)
+                self.assertEqual(plan["pending_messages"], 1)
+                self.assertEqual(plan["pending_bytes"], len(self.mailboxes["INBOX"][1][1]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+import io
+import json
+import logging
+import threading
+import unittest
+
+from log_pipeline import JsonLinesFormatter, start_logging, stop_logging
+
+# Testes do log em fila (log_pipeline.py): formatação das exceções na thread do listener,
+# campo "exception" do JSON lines e registros posteriores ao stop_logging.
+# Execute com: python -m unittest test_log_pipeline
+
+
+class ThreadRecordingFormatter(logging.Formatter):
+    """Formatter que anota em qual thread as exceções foram formatadas."""
+
+    def __init__(self):
+        super().__init__("%(levelname)s %(message)s")
+        self.threads = []
+
+    def formatException(self, exc_info):
+        self.threads.append(threading.current_thread())
+        return super().formatException(exc_info)
+
+
+class ContextFilter(logging.Filter):
+    def filter(self, record):
+        record.account = "conta@example.org"
+        return True
+
+
+class LogPipelineTest(unittest.TestCase):
+
+    def setUp(self):
+        root = logging.getLogger()
+        saved = (root.level, list(root.handlers))
+        for handler in saved[1]:
+            root.removeHandler(handler)
+
+        def restore():
+            stop_logging()
+            for handler in list(root.handlers):
+                root.removeHandler(handler)
+                handler.close()
+            root.setLevel(saved[0])
+            for handler in saved[1]:
+                root.addHandler(handler)
+
+        self.addCleanup(restore)
+        self.json_stream = io.StringIO()
+        self.json_handler = logging.StreamHandler(self.json_stream)
+        self.json_handler.setFormatter(JsonLinesFormatter())
+        self.text_stream = io.StringIO()
+        self.text_handler = logging.StreamHandler(self.text_stream)
+        self.text_formatter = ThreadRecordingFormatter()
+        self.text_handler.setFormatter(self.text_formatter)
+        start_logging([self.json_handler, self.text_handler], context_filter=ContextFilter())
+
+    def test_exception_is_formatted_by_the_listener(self):
+        try:
+            1 / 0
+        except ZeroDivisionError:
+            logging.exception("Falha ao gravar %s", "UID 7")
+        stop_logging()
+        entry = json.loads(self.json_stream.getvalue().splitlines()[0])
+        self.assertEqual(entry["message"], "Falha ao gravar UID 7")
+        self.assertEqual(entry["account"], "conta@example.org")
+        self.assertIn("ZeroDivisionError", entry["exception"])
+        self.assertIn("ZeroDivisionError", self.text_stream.getvalue())
+        self.assertTrue(self.text_formatter.threads)
+        self.assertNotIn(threading.current_thread(), self.text_formatter.threads)
+
+    def test_records_after_stop_are_written(self):
+        stop_logging()
+        logging.info("depois do encerramento")
+        entry = json.loads(self.json_stream.getvalue().splitlines()[-1])
+        self.assertEqual(entry["message"], "depois do encerramento")
+        self.assertEqual(entry["account"], "conta@example.org")
+        self.assertIn("depois do encerramento", self.text_stream.getvalue())
+
+
+if __name__ == "__main__":
+    unittest.main()
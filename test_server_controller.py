@@ -0,0 +1,190 @@
+import asyncio
+import logging
+import threading
+import time
+import unittest
+from unittest import mock
+
+import server_controller
+from server_controller import LATENCY_FLOOR, ServerController
+
+# Testes do controle adaptativo de sessões (server_controller.py): redução do limite pela
+# latência, disjuntor, espera entre tentativas, recuperação do limite e espera das
+# corrotinas por uma vaga. O relógio (time.monotonic) é simulado, para que as janelas e os
+# tempos de espera sejam exatos, exceto nos testes com o laço de eventos.
+# Execute com: python -m unittest test_server_controller
+
+MB = 1024 * 1024
+# Relógio real, para os testes em que o laço de eventos precisa medir o tempo
+REAL_MONOTONIC = time.monotonic
+
+
+class FakeClock:
+    """Substituto de time.monotonic avançado manualmente pelos testes."""
+
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float):
+        self.now += seconds
+
+
+class ServerControllerTest(unittest.TestCase):
+
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.addCleanup(logging.disable, logging.NOTSET)
+        self.clock = FakeClock()
+        patcher = mock.patch.object(server_controller.time, "monotonic", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.controller = ServerController(
+            name="teste", max_sessions=8, initial_sessions=8, backoff_base=1.0, backoff_max=60.0,
+            breaker_threshold=3, breaker_cooldown=10.0, latency_tolerance=3.0
+        )
+
+    def test_slow_small_operations_halve_the_limit(self):
+        for _ in range(5):
+            self.controller.record_success(0.01, 1000)
+        self.assertEqual(int(self.controller.limit), 8)
+        # 1 s contra o esperado de LATENCY_FLOOR: a média móvel passa da tolerância
+        self.controller.record_success(1.0, 1000)
+        self.assertEqual(int(self.controller.limit), 4)
+
+    def test_large_transfers_are_judged_by_throughput(self):
+        self.controller.record_success(0.01, 1000)
+        # 10 MB em 0,1 s: primeira medição de vazão, sem referência para comparar
+        self.controller.record_success(0.1, 10 * MB)
+        for _ in range(5):
+            self.controller.record_success(0.1, 10 * MB)
+            self.controller.record_success(0.01, 1000)
+        self.assertEqual(int(self.controller.limit), 8)
+        # A mesma transferência dez vezes mais lenta, repetida, reduz o limite
+        self.controller.record_success(1.0, 10 * MB)
+        self.controller.record_success(1.0, 10 * MB)
+        self.assertEqual(int(self.controller.limit), 4)
+
+    def test_slowness_below_the_floor_is_ignored(self):
+        for _ in range(5):
+            self.controller.record_success(0.001, 1000)
+        # 20 ms são 20 vezes a referência, mas ficam abaixo de LATENCY_FLOOR
+        for _ in range(10):
+            self.controller.record_success(LATENCY_FLOOR * 0.4, 1000)
+        self.assertEqual(int(self.controller.limit), 8)
+
+    def test_baseline_decays_toward_worse_samples(self):
+        self.controller.record_success(0.01, 1000)
+        for _ in range(200):
+            self.controller.record_success(0.2, 1000)
+            self.clock.advance(10)
+        # Uma melhor marca antiga não vale para sempre: o servidor mais lento virou a referência
+        self.assertGreater(self.controller._rtt_best, 0.19)
+        self.assertEqual(int(self.controller.limit), 8)
+
+    def test_one_decrease_per_window(self):
+        self.controller.record_failure()
+        self.controller.record_failure()
+        self.assertEqual(int(self.controller.limit), 4)
+        self.clock.advance(5)
+        self.controller.record_success()
+        self.controller.record_failure()
+        self.assertEqual(int(self.controller.limit), 2)
+
+    def test_circuit_opens_and_closes(self):
+        for _ in range(3):
+            self.controller.record_failure()
+        self.assertEqual(self.controller.limit, 1.0)
+        self.assertFalse(self.controller.acquire(blocking=False))
+        self.assertGreaterEqual(self.controller.backoff_delay(1), 10.0)
+        self.clock.advance(10)
+        self.assertTrue(self.controller.acquire(blocking=False))
+        self.assertFalse(self.controller.acquire(blocking=False))
+        self.controller.record_success()
+        self.assertEqual(self.controller._consecutive_failures, 0)
+        self.assertLess(self.controller.backoff_delay(1), 1.0 + 1e-9)
+
+    def test_cooldown_doubles_on_reopen_and_resets_on_success(self):
+        for _ in range(3):
+            self.controller.record_failure()
+        self.clock.advance(10)
+        self.controller.record_failure()
+        self.assertAlmostEqual(self.controller._open_until - self.clock.now, 20.0)
+        self.clock.advance(20)
+        self.controller.record_success()
+        for _ in range(3):
+            self.controller.record_failure()
+        self.assertAlmostEqual(self.controller._open_until - self.clock.now, 10.0)
+
+    def test_backoff_is_exponential_jittered_and_capped(self):
+        for attempt, nominal in ((1, 1.0), (2, 2.0), (3, 4.0), (10, 60.0)):
+            for _ in range(20):
+                delay = self.controller.backoff_delay(attempt)
+                self.assertGreaterEqual(delay, nominal / 2)
+                self.assertLessEqual(delay, nominal)
+
+    def test_limit_recovers_after_failures(self):
+        for _ in range(3):
+            self.controller.record_failure()
+        self.clock.advance(10)
+        self.assertEqual(int(self.controller.limit), 1)
+        successes = 0
+        while int(self.controller.limit) < 8:
+            self.controller.record_success()
+            successes += 1
+        # Cerca de uma sessão a cada 'limite' operações: 1 + 2 + ... + 7
+        self.assertLessEqual(successes, 1 + 2 + 3 + 4 + 5 + 6 + 7 + 7)
+        for _ in range(100):
+            self.controller.record_success()
+        self.assertEqual(self.controller.limit, 8)
+
+    def test_acquire_respects_the_limit_and_over_limit(self):
+        self.controller.record_failure()
+        self.assertEqual(int(self.controller.limit), 4)
+        for _ in range(4):
+            self.assertTrue(self.controller.acquire(blocking=False))
+        self.assertFalse(self.controller.acquire(blocking=False))
+        self.clock.advance(5)
+        self.controller.record_failure()
+        self.assertTrue(self.controller.over_limit())
+        for _ in range(2):
+            self.controller.release()
+        self.assertFalse(self.controller.over_limit())
+
+    def test_release_wakes_a_waiting_coroutine(self):
+        for _ in range(8):
+            self.assertTrue(self.controller.acquire(blocking=False))
+
+        async def scenario():
+            self.assertFalse(await self.controller.acquire_async(blocking=False))
+            waiting = asyncio.create_task(self.controller.acquire_async())
+            await asyncio.sleep(0.05)
+            self.assertFalse(waiting.done())
+            self.assertEqual(len(self.controller._async_waiters), 1)
+            # A vaga é devolvida por outra thread, como no fim de uma sessão
+            threading.Thread(target=self.controller.release).start()
+            self.assertTrue(await asyncio.wait_for(waiting, 1))
+
+        with mock.patch.object(server_controller.time, "monotonic", REAL_MONOTONIC):
+            asyncio.run(scenario())
+        self.assertEqual(self.controller.active, 8)
+        self.assertEqual(self.controller._async_waiters, [])
+
+    def test_coroutine_waits_for_the_circuit_to_close(self):
+        with mock.patch.object(server_controller.time, "monotonic", REAL_MONOTONIC):
+            controller = ServerController(name="teste", max_sessions=2, breaker_threshold=1,
+                                          breaker_cooldown=0.2)
+            controller.record_failure()
+
+            async def scenario():
+                started = REAL_MONOTONIC()
+                self.assertTrue(await asyncio.wait_for(controller.acquire_async(), 2))
+                return REAL_MONOTONIC() - started
+
+            self.assertGreaterEqual(asyncio.run(scenario()), 0.15)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,231 @@
+import ftplib
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import uploader_ftp
+from fake_ftp_server import FakeFtpServer
+from upload_state import UploadState
+
+# Testes do upload FTP (uploader_ftp.py) contra o servidor de teste (fake_ftp_server.py):
+# retomada com REST e com APPE, reenvio completo quando o trecho remoto não confere,
+# invalidação do diário quando o arquivo local muda, gravação espaçada do diário,
+# verificação final (desativada por padrão; com HASH, um único OPTS HASH por conexão) e
+# pipeline de upload (diário, reenvio das falhas e nomes Maildir).
+# Execute com: python -m unittest test_uploader_ftp
+
+FILE_SIZE = 1024 * 1024
+
+
+def make_content(size: int, seed: int = 0) -> bytes:
+    """Conteúdo de teste em que cada bloco de 256 bytes difere dos vizinhos."""
+    block = bytes((seed + i) % 256 for i in range(251))
+    return (block * (size // len(block) + 1))[:size]
+
+
+class UploaderFtpTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix="test_uploader_ftp_")
+        self.addCleanup(shutil.rmtree, self.tmp, ignore_errors=True)
+        self.local_dir = os.path.join(self.tmp, "local")
+        self.remote_dir = os.path.join(self.tmp, "remote")
+        os.makedirs(self.local_dir)
+        os.makedirs(self.remote_dir)
+        self.server = self.start_server()
+        self.state = UploadState(os.path.join(self.tmp, "state.db"))
+        self.addCleanup(self.state.close)
+        settings = {
+            "FTP_HOST": "127.0.0.1",
+            "REMOTE_PATH": "/",
+            "VERIFY_RESUME": True,
+            "UPLOAD_RETRIES": 2,
+            "connect_ftp": self.connect,
+        }
+        patcher = mock.patch.multiple(uploader_ftp, **settings)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # O suporte a HASH/XCRC é guardado por FTP_HOST, igual para todos os servidores de teste
+        patcher = mock.patch.dict(uploader_ftp._checksum_support, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # Sem espera entre as tentativas de upload_with_retry
+        patcher = mock.patch.object(uploader_ftp.time, "sleep")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.ftp = self.connect()
+        self.addCleanup(uploader_ftp.close_ftp, {"ftp": self.ftp})
+
+    def start_server(self, **options):
+        server = FakeFtpServer(self.remote_dir, **options).start()
+        self.addCleanup(server.stop)
+        return server
+
+    def connect(self):
+        """Substituto de connect_ftp: sessão FTP sem TLS no servidor de teste."""
+        ftp = ftplib.FTP()
+        ftp.connect("127.0.0.1", self.server.port)
+        ftp.login("usuario", "senha")
+        return ftp
+
+    def write_local(self, name: str, content: bytes) -> str:
+        path = os.path.join(self.local_dir, name)
+        with open(path, "wb") as f:
+            f.write(content)
+        return path
+
+    def write_remote(self, name: str, content: bytes):
+        with open(os.path.join(self.remote_dir, name), "wb") as f:
+            f.write(content)
+
+    def read_remote(self, name: str) -> bytes:
+        with open(os.path.join(self.remote_dir, name), "rb") as f:
+            return f.read()
+
+    def record_version(self, local_path: str, remote_name: str, offset: int, mtime_ns: int = None):
+        stat = os.stat(local_path)
+        mtime_ns = stat.st_mtime_ns if mtime_ns is None else mtime_ns
+        self.state.save_transfer(remote_name, local_path, stat.st_size, mtime_ns, offset)
+
+    def test_resume_with_rest_from_remote_size(self):
+        content = make_content(FILE_SIZE)
+        local = self.write_local("caixa.zip", content)
+        self.write_remote("caixa.zip", content[:400_000])
+        # O diário é só um indicativo da versão: a retomada parte do tamanho remoto
+        self.record_version(local, "caixa.zip", 100_000)
+        self.assertTrue(uploader_ftp.upload_file(self.ftp, local, verbose=False, state=self.state))
+        self.assertEqual(self.read_remote("caixa.zip"), content)
+        self.assertIn("REST 400000", self.server.commands)
+        self.assertEqual(self.state.get_transfer("caixa.zip")[2:], (FILE_SIZE, True))
+
+    def test_resume_with_appe_when_rest_is_rejected(self):
+        self.server = self.start_server(rest_stor=False)
+        self.ftp = self.connect()
+        self.addCleanup(uploader_ftp.close_ftp, {"ftp": self.ftp})
+        content = make_content(FILE_SIZE)
+        local = self.write_local("caixa.zip", content)
+        self.write_remote("caixa.zip", content[:300_000])
+        self.record_version(local, "caixa.zip", 300_000)
+        self.assertTrue(uploader_ftp.upload_file(self.ftp, local, verbose=False, state=self.state))
+        self.assertEqual(self.read_remote("caixa.zip"), content)
+        self.assertIn("APPE caixa.zip", self.server.commands)
+
+    def test_tail_mismatch_resends_the_whole_file(self):
+        content = make_content(FILE_SIZE)
+        local = self.write_local("caixa.zip", content)
+        self.write_remote("caixa.zip", make_content(400_000, seed=7))
+        self.record_version(local, "caixa.zip", 400_000)
+        self.assertTrue(uploader_ftp.upload_file(self.ftp, local, verbose=False, state=self.state))
+        self.assertEqual(self.read_remote("caixa.zip"), content)
+        self.assertNotIn("REST 400000", self.server.commands)
+        self.assertFalse(any(command.startswith("APPE") for command in self.server.commands))
+
+    def test_changed_mtime_invalidates_the_journal(self):
+        content = make_content(FILE_SIZE)
+        local = self.write_local("caixa.zip", content)
+        self.write_remote("caixa.zip", content[:400_000])
+        # Registro de outra versão do arquivo local (mesmo tamanho, outra data)
+        stat = os.stat(local)
+        self.record_version(local, "caixa.zip", 400_000, mtime_ns=stat.st_mtime_ns - 10 ** 9)
+        self.assertTrue(uploader_ftp.upload_file(self.ftp, local, verbose=False, state=self.state))
+        self.assertEqual(self.read_remote("caixa.zip"), content)
+        # Nem a releitura do trecho remoto nem a retomada: envio do zero
+        self.assertFalse(any(command.startswith(("REST", "RETR", "APPE")) for command in self.server.commands))
+        self.assertEqual(self.state.get_transfer("caixa.zip"), (FILE_SIZE, stat.st_mtime_ns, FILE_SIZE, True))
+
+    def test_interrupted_upload_resumes_on_the_next_attempt(self):
+        content = make_content(FILE_SIZE)
+        local = self.write_local("caixa.zip", content)
+        self.server.fail_stor_after = 200_000
+        ftp_ref = {"ftp": None}
+        self.assertTrue(uploader_ftp.upload_with_retry(ftp_ref, local, "caixa.zip", state=self.state))
+        uploader_ftp.close_ftp(ftp_ref)
+        self.assertEqual(self.read_remote("caixa.zip"), content)
+        self.assertIn("REST 200000", self.server.commands)
+
+    def test_journal_writes_are_spaced_out(self):
+        content = make_content(FILE_SIZE)
+        local = self.write_local("caixa.zip", content)
+        settings = {
+            "chunk_tuner": uploader_ftp.ChunkSizeTuner(16 * 1024),
+            "ADAPTIVE_CHUNK_SIZE": False,
+            "JOURNAL_SAVE_BYTES": 256 * 1024,
+            "JOURNAL_SAVE_SECONDS": 3600,
+        }
+        with mock.patch.multiple(uploader_ftp, **settings), \
+                mock.patch.object(self.state, "save_transfer", wraps=self.state.save_transfer) as save:
+            self.assertTrue(uploader_ftp.upload_file(self.ftp, local, verbose=False, state=self.state))
+        # Início, a cada 256 KiB dos 64 blocos de 16 KiB e conclusão verificada
+        self.assertEqual(save.call_count, 1 + 4 + 1)
+        self.assertEqual(self.read_remote("caixa.zip"), content)
+
+    def test_final_verification_is_off_by_default(self):
+        local = self.write_local("caixa.zip", make_content(FILE_SIZE))
+        self.assertTrue(uploader_ftp.upload_file(self.ftp, local, verbose=False, state=self.state))
+        self.assertFalse(any(command.startswith(("FEAT", "HASH", "XCRC", "RETR")) for command in self.server.commands))
+
+    def test_opts_hash_is_sent_once_per_connection(self):
+        names = [f"caixa{index}.zip" for index in range(3)]
+        for index, name in enumerate(names):
+            self.write_local(name, make_content(100_000, seed=index))
+        with mock.patch.object(uploader_ftp, "UPLOAD_VERIFY", "auto"):
+            for name in names:
+                self.assertTrue(uploader_ftp.upload_file(self.ftp, os.path.join(self.local_dir, name), verbose=False))
+            self.assertEqual(self.server.commands.count("OPTS HASH SHA-256"), 1)
+            self.assertEqual([command for command in self.server.commands if command.startswith("HASH ")],
+                             [f"HASH {name}" for name in names])
+            # Uma nova sessão seleciona o algoritmo novamente
+            ftp = self.connect()
+            self.addCleanup(uploader_ftp.close_ftp, {"ftp": ftp})
+            self.assertTrue(uploader_ftp.upload_file(ftp, os.path.join(self.local_dir, names[0]), verbose=False))
+        self.assertEqual(self.server.commands.count("OPTS HASH SHA-256"), 2)
+        self.assertEqual(self.server.commands.count("FEAT"), 1)
+
+    def write_maildir(self, names):
+        """Grava mensagens em 'conta/cur' e retorna os caminhos locais."""
+        directory = os.path.join(self.local_dir, "conta", "cur")
+        os.makedirs(directory, exist_ok=True)
+        return [self.write_local(os.path.join("conta", "cur", name), make_content(5000, seed=index))
+                for index, name in enumerate(names)]
+
+    def test_pipeline_maps_maildir_names_and_uses_the_journal(self):
+        self.server.reject_names = ":"
+        paths = self.write_maildir(["1700000000.M1P2.host,S=5000:2,S", "1700000001.M2P2.host,S=5000:2,FS"])
+        pipeline = uploader_ftp.UploadPipeline(self.local_dir, workers=2, state=self.state)
+        for path in paths:
+            pipeline.submit(path)
+        stats = pipeline.close()
+        self.assertEqual((stats["files"], stats["failed"], stats["failed_paths"]), (2, 0, []))
+        remote_name = "conta/cur/1700000000.M1P2.host,S=5000;2,S"
+        with open(paths[0], "rb") as f:
+            self.assertEqual(self.read_remote(remote_name), f.read())
+        self.assertTrue(self.state.get_transfer(remote_name)[3])
+
+    def test_pipeline_retries_failures_at_close_and_keeps_failed_files(self):
+        paths = self.write_maildir(["instavel:2,S", "sempre-falha:2,S", "normal:2,S"])
+        attempts = []
+        upload_with_retry = uploader_ftp.upload_with_retry
+
+        def flaky_upload(ftp_ref, local_file, *args, **kwargs):
+            attempts.append(local_file)
+            if local_file == paths[1] or (local_file == paths[0] and attempts.count(local_file) == 1):
+                return False
+            return upload_with_retry(ftp_ref, local_file, *args, **kwargs)
+
+        with mock.patch.object(uploader_ftp, "upload_with_retry", side_effect=flaky_upload):
+            pipeline = uploader_ftp.UploadPipeline(self.local_dir, workers=1, delete_after_upload=True,
+                                                   state=self.state)
+            for path in paths:
+                pipeline.submit(path)
+            stats = pipeline.close()
+        self.assertEqual((stats["files"], stats["failed"], stats["failed_paths"]), (2, 1, [paths[1]]))
+        self.assertEqual(attempts.count(paths[0]), 2)
+        # Só o arquivo que não foi enviado continua no disco local
+        self.assertEqual([os.path.exists(path) for path in paths], [False, True, False])
+        self.assertTrue(os.path.exists(os.path.join(self.remote_dir, "conta", "cur", "instavel;2,S")))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,97 @@
+import ftplib
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import uploader_ftp
+import volume_packer
+from fake_ftp_server import FakeFtpServer
+
+# Teste de ida e volta do volume_packer.py contra o servidor de teste (fake_ftp_server.py):
+# empacota uma pequena árvore Maildir em volumes tar e zip, com e sem compressão, e
+# restaura mensagens individuais pelo deslocamento registrado no índice.
+# Execute com: python -m unittest test_volume_packer
+
+MESSAGES = {
+    "conta/cur/1700000000.M1P2.host,S=300:2,S": 300,
+    "conta/cur/1700000001.M2P2.host,S=70000:2,FS": 70_000,
+    "conta/.Sent/cur/1700000002.M3P2.host,S=5000:2,S": 5000,
+    "outra/cur/1700000003.M4P2.host,S=1200:2,": 1200,
+}
+
+
+def make_message(index: int, size: int) -> bytes:
+    line = f"Linha {index} da mensagem de teste\r\n".encode("ascii")
+    header = f"Subject: Mensagem {index}\r\nMessage-ID: <volume-{index}@example.org>\r\n\r\n".encode("ascii")
+    return (header + line * (size // len(line) + 1))[:size]
+
+
+class VolumePackerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix="test_volume_packer_")
+        self.addCleanup(shutil.rmtree, self.tmp, ignore_errors=True)
+        self.local_root = os.path.join(self.tmp, "store")
+        self.contents = {}
+        for index, (rel_path, size) in enumerate(sorted(MESSAGES.items())):
+            path = os.path.join(self.local_root, *rel_path.split("/"))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self.contents[rel_path] = make_message(index, size)
+            with open(path, "wb") as f:
+                f.write(self.contents[rel_path])
+        # Mensagem deduplicada: um segundo link físico para o mesmo arquivo
+        self.link = "conta/.Sent/cur/1700000004.M5P2.host,S=300:2,S"
+        target = "conta/cur/1700000000.M1P2.host,S=300:2,S"
+        os.link(os.path.join(self.local_root, *target.split("/")), os.path.join(self.local_root, *self.link.split("/")))
+        self.contents[self.link] = self.contents[target]
+        # Sem espera entre as tentativas de envio
+        patcher = mock.patch.object(uploader_ftp.time, "sleep")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_pack_and_restore_round_trip(self):
+        for pack_format, compression in (("tar", ""), ("tar", "gz"), ("zip", ""), ("zip", "deflate")):
+            with self.subTest(format=pack_format, compression=compression):
+                self.run_case(pack_format, compression)
+
+    def run_case(self, pack_format: str, compression: str):
+        case_dir = os.path.join(self.tmp, f"{pack_format}-{compression or 'raw'}")
+        remote_dir = os.path.join(case_dir, "remote")
+        os.makedirs(remote_dir)
+        with FakeFtpServer(remote_dir) as server:
+
+            def connect():
+                ftp = ftplib.FTP()
+                ftp.connect("127.0.0.1", server.port)
+                ftp.login("usuario", "senha")
+                return ftp
+
+            settings = {
+                "connect_ftp": connect,
+                "UPLOAD_STATE_DB": os.path.join(case_dir, "state.db"),
+                "PACK_FORMAT": pack_format,
+                "PACK_COMPRESSION": compression,
+                # Volumes pequenos, para que a árvore ocupe mais de um volume por usuário
+                "PACK_VOLUME_MAX_BYTES": 64 * 1024,
+            }
+            with mock.patch.multiple(volume_packer, **settings), mock.patch("builtins.print"):
+                volume_packer.pack_tree(self.local_root)
+                for rel_path in sorted(self.contents):
+                    dest_path = os.path.join(case_dir, "restaurada")
+                    volume_packer.restore_message(rel_path, dest_path)
+                    with open(dest_path, "rb") as f:
+                        self.assertEqual(f.read(), self.contents[rel_path], rel_path)
+                # Uma segunda execução não reenvia as mensagens já empacotadas
+                stor_count = sum(command.startswith("STOR") for command in server.commands)
+                volume_packer.pack_tree(self.local_root)
+                self.assertEqual(sum(command.startswith("STOR") for command in server.commands), stor_count)
+        # Restauração parcial: a mensagem foi lida a partir do seu deslocamento no volume
+        if not (pack_format == "tar" and compression):
+            self.assertTrue(any(command.startswith("REST ") and command != "REST 0" for command in server.commands))
+        self.assertGreater(stor_count, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,212 @@
+import sqlite3
+import threading
+import time
+
+
+class UploadState:
+    """
+    Estado persistente do upload FTP, armazenado em um banco SQLite local.
+
+    O diário de transferências guarda, para cada arquivo remoto, a versão do arquivo
+    local (tamanho e data de modificação) e o último deslocamento registrado durante o
+    envio. A retomada parte do tamanho informado pelo servidor; o diário apenas indica se
+    o arquivo remoto parcial é da versão atual do arquivo local, e um parcial de outra
+    versão é enviado novamente do zero.
+
+    No modo espelho, guarda também o manifesto da árvore local enviada (caminho, tamanho,
+    data de modificação e SHA-256 de cada arquivo) e a data de modificação de cada
+    diretório já sincronizado, para que a execução seguinte envie apenas a diferença.
+
+    Para os volumes gerados pelo volume_packer.py, guarda o índice de cada mensagem
+    empacotada: volume remoto, deslocamento e tamanho dos dados dentro do volume.
+    """
+
+    def __init__(self, db_path: str):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS transfer_journal (
+                remote_name      TEXT PRIMARY KEY,
+                local_path       TEXT NOT NULL,
+                size             INTEGER NOT NULL,
+                mtime_ns         INTEGER NOT NULL,
+                confirmed_offset INTEGER NOT NULL,
+                verified         INTEGER NOT NULL DEFAULT 0,
+                updated_at       REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS mirror_manifest (
+                path       TEXT PRIMARY KEY,
+                directory  TEXT NOT NULL,
+                size       INTEGER NOT NULL,
+                mtime_ns   INTEGER NOT NULL,
+                digest     TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS mirror_manifest_directory ON mirror_manifest (directory)"
+        )
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS mirror_directories (
+                path     TEXT PRIMARY KEY,
+                mtime_ns INTEGER NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS packed_messages (
+                path        TEXT PRIMARY KEY,
+                volume      TEXT NOT NULL,
+                offset      INTEGER NOT NULL,
+                stored_size INTEGER NOT NULL,
+                size        INTEGER NOT NULL,
+                compression TEXT NOT NULL,
+                link_target TEXT,
+                packed_at   REAL NOT NULL
+            )
+            """
+        )
+        self._conn.commit()
+
+    def get_transfer(self, remote_name: str):
+        """
+        Retorna (tamanho, mtime_ns, deslocamento confirmado, verificado) do arquivo remoto,
+        ou None se ele não consta no diário.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT size, mtime_ns, confirmed_offset, verified FROM transfer_journal "
+                "WHERE remote_name = ?",
+                (remote_name,)
+            ).fetchone()
+        if row is None:
+            return None
+        return row[0], row[1], row[2], bool(row[3])
+
+    def save_transfer(self, remote_name: str, local_path: str, size: int, mtime_ns: int,
+                      confirmed_offset: int, verified: bool = False):
+        """
+        Registra o deslocamento enviado do arquivo remoto para a versão local informada.
+        """
+        with self._lock:
+            self._conn.execute(
+                """
+                INSERT INTO transfer_journal
+                    (remote_name, local_path, size, mtime_ns, confirmed_offset, verified, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (remote_name) DO UPDATE SET
+                    local_path       = excluded.local_path,
+                    size             = excluded.size,
+                    mtime_ns         = excluded.mtime_ns,
+                    confirmed_offset = excluded.confirmed_offset,
+                    verified         = excluded.verified,
+                    updated_at       = excluded.updated_at
+                """,
+                (remote_name, local_path, size, mtime_ns, confirmed_offset, int(verified), time.time())
+            )
+            self._conn.commit()
+
+    def get_directory_mtime(self, path: str):
+        """
+        Retorna a data de modificação (ns) do diretório na última sincronização completa,
+        ou None se ele nunca foi sincronizado.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT mtime_ns FROM mirror_directories WHERE path = ?", (path,)
+            ).fetchone()
+        return row[0] if row is not None else None
+
+    def save_directory_mtime(self, path: str, mtime_ns: int):
+        """
+        Registra que todos os arquivos do diretório foram sincronizados nesta versão.
+        """
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO mirror_directories (path, mtime_ns) VALUES (?, ?)",
+                (path, mtime_ns)
+            )
+            self._conn.commit()
+
+    def get_manifest_entries(self, directory: str) -> dict:
+        """
+        Retorna {caminho: (tamanho, mtime_ns, hash)} dos arquivos do diretório no manifesto.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT path, size, mtime_ns, digest FROM mirror_manifest WHERE directory = ?",
+                (directory,)
+            ).fetchall()
+        return {row[0]: (row[1], row[2], row[3]) for row in rows}
+
+    def save_manifest_entry(self, path: str, directory: str, size: int, mtime_ns: int, digest: str):
+        """
+        Registra no manifesto a versão do arquivo presente no servidor.
+        """
+        with self._lock:
+            self._conn.execute(
+                """
+                INSERT OR REPLACE INTO mirror_manifest
+                    (path, directory, size, mtime_ns, digest, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                (path, directory, size, mtime_ns, digest, time.time())
+            )
+            self._conn.commit()
+
+    def get_packed_paths(self, prefix: str) -> set:
+        """
+        Retorna os caminhos já empacotados sob o diretório 'prefix'.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT path FROM packed_messages WHERE substr(path, 1, ?) = ?",
+                (len(prefix) + 1, prefix + "/")
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def find_packed(self, path: str):
+        """
+        Retorna (volume, deslocamento, tamanho armazenado, tamanho, compressão, alvo do link)
+        da mensagem empacotada, ou None se ela não consta no índice.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT volume, offset, stored_size, size, compression, link_target "
+                "FROM packed_messages WHERE path = ?",
+                (path,)
+            ).fetchone()
+        return tuple(row) if row is not None else None
+
+    def record_packed(self, rows):
+        """
+        Registra as mensagens de um volume enviado. Cada item de 'rows' é a tupla
+        (caminho, volume, deslocamento, tamanho armazenado, tamanho, compressão, alvo do link).
+        """
+        if not rows:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                """
+                INSERT OR REPLACE INTO packed_messages
+                    (path, volume, offset, stored_size, size, compression, link_target, packed_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                [tuple(row) + (now,) for row in rows]
+            )
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -1,5 +1,14 @@
-from ftplib import FTP_TLS
+from ftplib import FTP_TLS, error_perm, error_temp
+import hashlib
 import os
+import queue
+import threading
+import time
+import weakref
+import zlib
+
+from metrics import metrics
+from upload_state import UploadState
 
 # Credenciais e configurações
 FTP_HOST = ""
@@ -7,70 +16,927 @@ FTP_USER = ""
 FTP_PASS = ""
 REMOTE_PATH = ""  # Diretório de destino no servidor
 LOCAL_FOLDER = ""  # Pasta local onde os arquivos estão
-CHUNK_SIZE = 1024 * 1024 * 5  # 5MB (tentar reduzir se 10MB estiver causando problemas)
+CHUNK_SIZE = 1024 * 1024 * 5  # Tamanho inicial do bloco enviado a cada escrita no canal de dados
+
+# Ajuste automático do bloco: mede a vazão de cada janela de envio e dobra ou reduz
+# o bloco enquanto a vazão melhorar; a cada falha de transferência, o bloco cai pela metade
+ADAPTIVE_CHUNK_SIZE = True
+CHUNK_SIZE_MIN = 64 * 1024
+CHUNK_SIZE_MAX = 32 * 1024 * 1024
+CHUNK_TUNE_WINDOW = 2.0  # Segundos de envio medidos antes de cada ajuste
+
+# Limite de banda global, compartilhado por todas as transferências simultâneas:
+# lista de (hora inicial, hora final, bytes/s); fora dos intervalos, sem limite.
+# Ex.: [(8, 19, 4 * 1024 * 1024)] limita a 4 MB/s no horário comercial.
+BANDWIDTH_SCHEDULE = []
 
 # Lista dos arquivos ZIP a serem enviados
 FILE_LIST = [
     ""
 ]
 
-def upload_file(ftp, local_file):
-    """Realiza o upload de um único arquivo via FTP em chunks."""
-    file_size = os.path.getsize(local_file)
-    uploaded_size = 0
+# Upload concorrente
+UPLOAD_WORKERS = 4      # Conexões FTPS simultâneas (os maiores arquivos são enviados primeiro)
+UPLOAD_RETRIES = 3      # Tentativas por arquivo, reconectando a sessão da thread a cada falha
+
+# Retomada e verificação
+UPLOAD_STATE_DB = "upload_state.db"  # Diário local das transferências ("" desativa)
+# Verificação final de cada arquivo enviado: "auto": HASH/XCRC do servidor ou releitura do
+# final; "tail": só releitura; "": só tamanho. Cada verificação custa comandos extras por
+# arquivo (e, sem HASH/XCRC, uma nova conexão de dados), por isso fica desativada por padrão.
+UPLOAD_VERIFY = ""
+VERIFY_RESUME = True  # Confere o final do trecho já presente no servidor antes de retomar um upload
+VERIFY_TAIL_BYTES = 1024 * 1024  # Bytes relidos do servidor na verificação por releitura
+# Durante o envio, o deslocamento é gravado no diário a cada JOURNAL_SAVE_BYTES bytes ou
+# JOURNAL_SAVE_SECONDS segundos, o que vier primeiro (e sempre no início e no fim)
+JOURNAL_SAVE_BYTES = 32 * 1024 * 1024
+JOURNAL_SAVE_SECONDS = 5.0
+
+# Modo espelho: sincroniza uma árvore local inteira (ex.: o MAILSTORE_HOME do
+# maildownloader_improved.py) em vez de FILE_LIST, enviando apenas o que mudou desde
+# a execução anterior. O manifesto fica em UPLOAD_STATE_DB.
+MIRROR_LOCAL_ROOT = ""  # Raiz local a espelhar sob REMOTE_PATH ("" envia FILE_LIST)
+# Se True, os diretórios cur/ e new/ das pastas Maildir cuja data de modificação não mudou
+# não têm seus arquivos comparados com o manifesto. Só é seguro quando os e-mails nunca são
+# regravados no lugar (cada alteração cria ou renomeia um arquivo, como na entrega Maildir).
+MIRROR_SKIP_UNCHANGED_MAILDIRS = False
+# Se True, a árvore de MIRROR_LOCAL_ROOT é enviada em volumes tar/zip pelo volume_packer.py
+# (formato, compressão e tamanho configurados lá), com índice para restaurar cada mensagem,
+# em vez de espelhada arquivo a arquivo
+PACK_VOLUMES = False
+
+# Os nomes de arquivo Maildir contêm ":" (ex.: "1700000000.M1P2.host,S=1234:2,S"), recusado por
+# muitos servidores FTP e por destinos Windows: no servidor, ":" é substituído por este caractere
+# (o mesmo separador usado pelos clientes Maildir no Windows). "" mantém o nome local.
+REMOTE_COLON_REPLACEMENT = ";"
+
+# Pipeline de upload (usado pelo maildownloader_improved.py para enviar os e-mails durante o download)
+PIPELINE_WORKERS = 2                          # Conexões FTPS simultâneas do pipeline
+PIPELINE_MAX_PENDING_BYTES = 512 * 1024 * 1024  # Bytes aguardando upload antes de pausar o download
+
+metrics.describe("uploader_transfer_seconds", "Duração de cada envio (STOR/APPE) de arquivo via FTP.")
+metrics.describe("uploader_transfer_errors_total", "Envios de arquivo via FTP interrompidos por erro.")
+metrics.describe("uploader_verify_seconds", "Duração da verificação do arquivo remoto após o envio.")
+metrics.describe("uploader_verify_failures_total", "Arquivos remotos que não conferem com o local após o envio.")
+metrics.describe("uploader_bytes_total", "Bytes enviados via FTP.")
+metrics.describe("uploader_files_total", "Arquivos enviados e verificados.")
+
+class ChunkSizeTuner:
+    """
+    Ajusta o tamanho do bloco de upload pela vazão medida, compartilhado por todas as
+    transferências: a cada CHUNK_TUNE_WINDOW segundos de envio, compara a vazão com a
+    janela anterior e continua dobrando (ou reduzindo) o bloco enquanto ela melhorar
+    mais de 5%, invertendo a direção quando piorar.
+    """
+
+    def __init__(self, size=CHUNK_SIZE):
+        self.size = size
+        self._direction = 1
+        self._previous_rate = None
+        self._window_bytes = 0
+        self._window_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, nbytes, seconds):
+        """Registra o envio de um bloco de 'nbytes' que levou 'seconds'."""
+        if not ADAPTIVE_CHUNK_SIZE:
+            return
+        with self._lock:
+            self._window_bytes += nbytes
+            self._window_seconds += seconds
+            if self._window_seconds < CHUNK_TUNE_WINDOW:
+                return
+            rate = self._window_bytes / self._window_seconds
+            self._window_bytes, self._window_seconds = 0, 0.0
+            previous, self._previous_rate = self._previous_rate, rate
+            if previous is not None:
+                if rate < previous * 0.95:
+                    self._direction = -self._direction
+                elif rate <= previous * 1.05:
+                    return  # Vazão estável: mantém o bloco
+            self._resize(self._direction)
+
+    def record_error(self):
+        """Reduz o bloco pela metade após uma falha de transferência."""
+        if not ADAPTIVE_CHUNK_SIZE:
+            return
+        with self._lock:
+            self._direction = -1
+            self._previous_rate = None
+            self._window_bytes, self._window_seconds = 0, 0.0
+            self._resize(-1)
+
+    def _resize(self, direction):
+        size = self.size * 2 if direction > 0 else self.size // 2
+        self.size = max(CHUNK_SIZE_MIN, min(CHUNK_SIZE_MAX, size))
+
+def current_bandwidth_limit():
+    """Retorna o limite de banda (bytes/s) vigente pela BANDWIDTH_SCHEDULE, ou 0 se não houver."""
+    hour = time.localtime().tm_hour
+    for start, end, rate in BANDWIDTH_SCHEDULE:
+        # Intervalos como (22, 6) atravessam a meia-noite
+        if (start <= hour < end) if start <= end else (hour >= start or hour < end):
+            return rate
+    return 0
+
+class TokenBucket:
+    """
+    Balde de fichas global que limita a soma da vazão de todos os uploads ao valor
+    vigente de current_bandwidth_limit(), com rajada de até um segundo de envio.
+    """
+
+    def __init__(self):
+        self._tokens = 0.0
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, nbytes):
+        """Aguarda até que 'nbytes' possam ser enviados dentro do limite de banda."""
+        with self._lock:
+            rate = current_bandwidth_limit()
+            now = time.monotonic()
+            if not rate:
+                self._tokens, self._updated = 0.0, now
+                return
+            self._tokens = min(rate, self._tokens + (now - self._updated) * rate) - nbytes
+            self._updated = now
+            # Saldo negativo: o envio fica em débito e a thread espera o tempo de repô-lo
+            wait = -self._tokens / rate if self._tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+chunk_tuner = ChunkSizeTuner()
+bandwidth = TokenBucket()
+
+class AdaptiveReader:
+    """
+    Envolve o arquivo local entregue ao storbinary: cada read() devolve um bloco do
+    tamanho atual de chunk_tuner (ignorando o tamanho pedido), registra o tempo de envio
+    do bloco anterior e respeita o limite de banda global.
+    """
+
+    def __init__(self, f):
+        self._f = f
+        self._last_size = 0
+        self._last_return = None
+
+    def read(self, size=-1):
+        if self._last_return is not None:
+            # Entre duas leituras, o storbinary apenas enviou o bloco anterior
+            chunk_tuner.record(self._last_size, time.monotonic() - self._last_return)
+        data = self._f.read(chunk_tuner.size)
+        if data:
+            bandwidth.consume(len(data))
+        self._last_size = len(data)
+        self._last_return = time.monotonic()
+        return data
+
+def remote_file_name(rel_path):
+    """Converte o caminho relativo de um arquivo local no nome remoto (ver REMOTE_COLON_REPLACEMENT)."""
+    rel_path = rel_path.replace(os.sep, "/")
+    return rel_path.replace(":", REMOTE_COLON_REPLACEMENT) if REMOTE_COLON_REPLACEMENT else rel_path
+
+def connect_ftp():
+    """Abre uma sessão FTPS autenticada, com canal de dados protegido, no diretório de destino."""
+    ftp = FTP_TLS(FTP_HOST)
+    ftp.login(FTP_USER, FTP_PASS)
+    ftp.prot_p()  # Ativa transferência de dados segura
+    ftp.set_pasv(True)  # Modo passivo, se necessário
+    ftp.cwd(REMOTE_PATH)  # Muda para o diretório de destino
+    return ftp
+
+def ensure_remote_dir(ftp, remote_dir, known_dirs=None, listing=None):
+    """
+    Cria no servidor o diretório remoto (relativo a REMOTE_PATH) e os intermediários.
+    'known_dirs' é um conjunto dos diretórios já criados, para evitar novos MKD.
+    Os diretórios recém-criados são registrados como vazios em 'listing'.
+    """
+    parts = [part for part in remote_dir.split("/") if part]
+    for i in range(1, len(parts) + 1):
+        path = "/".join(parts[:i])
+        if known_dirs is not None and path in known_dirs:
+            continue
+        try:
+            ftp.mkd(path)
+            if listing is not None:
+                listing.mark_empty(path)
+        except error_perm:
+            pass  # Diretório já existe
+        if known_dirs is not None:
+            known_dirs.add(path)
+
+_UNKNOWN = object()
+
+class RemoteListingCache:
+    """
+    Cache em memória da listagem dos diretórios remotos ({nome: tamanho}), obtida uma
+    única vez por diretório com MLSD (ou LIST, se o servidor não suportar MLSD), para
+    que as verificações de existência, tamanho e retomada não custem um SIZE por arquivo.
+    Compartilhado pelas threads de upload e atualizado a cada transferência.
+    """
+
+    def __init__(self):
+        self._dirs = {}
+        self._listing_locks = {}
+        self._use_mlsd = True
+        self._lock = threading.Lock()
+
+    def size(self, ftp, remote_name):
+        """
+        Retorna o tamanho do arquivo remoto, ou None se ele não existir.
+        """
+        remote_dir, name = self._split(remote_name)
+        with self._lock:
+            entries = self._dirs.get(remote_dir)
+            size = entries.get(name) if entries is not None else None
+        if entries is None:
+            with self._lock:
+                listing_lock = self._listing_locks.setdefault(remote_dir, threading.Lock())
+            # Uma única listagem por diretório, mesmo com várias threads consultando ao mesmo tempo
+            with listing_lock:
+                with self._lock:
+                    entries = self._dirs.get(remote_dir)
+                if entries is None:
+                    entries = self._list_directory(ftp, remote_dir)
+                    with self._lock:
+                        self._dirs[remote_dir] = entries
+            with self._lock:
+                size = entries.get(name)
+        if size is _UNKNOWN:
+            try:
+                ftp.voidcmd("TYPE I")
+                size = ftp.size(remote_name)
+            except error_perm:
+                size = None
+            self._set(remote_name, size)
+        return size
+
+    def update(self, remote_name, size):
+        """Registra o tamanho do arquivo remoto após uma transferência concluída."""
+        self._set(remote_name, size)
+
+    def invalidate(self, remote_name):
+        """Marca o tamanho do arquivo como desconhecido (ex.: após uma transferência interrompida)."""
+        self._set(remote_name, _UNKNOWN)
+
+    def mark_empty(self, remote_dir):
+        """Registra um diretório recém-criado, sem arquivos."""
+        with self._lock:
+            self._dirs.setdefault(remote_dir.strip("/"), {})
+
+    def _set(self, remote_name, size):
+        remote_dir, name = self._split(remote_name)
+        with self._lock:
+            entries = self._dirs.get(remote_dir)
+            if entries is None:
+                # Diretório ainda não listado: a listagem completa é feita na primeira consulta
+                return
+            if size is None:
+                entries.pop(name, None)
+            else:
+                entries[name] = size
+
+    @staticmethod
+    def _split(remote_name):
+        remote_dir, _, name = remote_name.strip("/").rpartition("/")
+        return remote_dir, name
+
+    def _list_directory(self, ftp, remote_dir):
+        if self._use_mlsd:
+            try:
+                return {
+                    name: int(facts["size"])
+                    for name, facts in ftp.mlsd(remote_dir, ["type", "size"])
+                    if facts.get("type") == "file" and "size" in facts
+                }
+            except error_perm as e:
+                if not str(e).startswith("50"):
+                    return {}  # Diretório inexistente
+                self._use_mlsd = False  # Servidor sem MLSD
+        lines = []
+        try:
+            ftp.retrlines(f"LIST {remote_dir}" if remote_dir else "LIST", lines.append)
+        except error_perm:
+            return {}
+        return dict(filter(None, map(parse_list_line, lines)))
+
+def parse_list_line(line):
+    """
+    Interpreta uma linha de LIST no formato Unix ("-rw-r--r-- 1 dono grupo 1234 Jan 1 10:00 nome")
+    ou DOS ("01-01-24  10:00AM  1234 nome") e retorna (nome, tamanho) para arquivos comuns.
+    """
+    parts = line.split(None, 8)
+    if len(parts) == 9 and parts[0].startswith("-") and parts[4].isdigit():
+        return parts[8], int(parts[4])
+    parts = line.split(None, 3)
+    if len(parts) == 4 and parts[2].isdigit():
+        return parts[3], int(parts[2])
+    return None
+
+# Algoritmos do comando HASH reconhecidos, em ordem de preferência
+HASH_ALGORITHMS = {"SHA-256": "sha256", "SHA-1": "sha1", "SHA-512": "sha512", "MD5": "md5"}
+
+# Comando de checksum suportado por cada servidor, descoberto via FEAT, e o algoritmo
+# já selecionado com OPTS HASH em cada sessão (enviado uma única vez por conexão)
+_checksum_support = {}
+_hash_selected = weakref.WeakKeyDictionary()
+_checksum_lock = threading.Lock()
+
+def get_checksum_command(ftp):
+    """
+    Retorna ("HASH", algoritmo) ou ("XCRC", "CRC32") conforme o servidor anuncie em FEAT,
+    ou None se nenhum comando de checksum estiver disponível.
+    """
+    with _checksum_lock:
+        if FTP_HOST in _checksum_support:
+            return _checksum_support[FTP_HOST]
+    support = None
+    try:
+        features = {}
+        for line in ftp.sendcmd("FEAT").splitlines()[1:-1]:
+            name, _, args = line.strip().partition(" ")
+            features[name.upper()] = args
+        if "HASH" in features:
+            offered = [algo.rstrip("*").upper() for algo in features["HASH"].split(";")]
+            for algo in HASH_ALGORITHMS:
+                if algo in offered:
+                    support = ("HASH", algo)
+                    break
+        if support is None and "XCRC" in features:
+            support = ("XCRC", "CRC32")
+    except error_perm:
+        pass
+    with _checksum_lock:
+        _checksum_support[FTP_HOST] = support
+    return support
+
+def local_checksum(local_file, algo):
+    """Calcula o checksum do arquivo local no formato hexadecimal devolvido pelo servidor."""
+    crc = 0
+    digest = None if algo == "CRC32" else hashlib.new(HASH_ALGORITHMS[algo])
+    with open(local_file, "rb") as f:
+        while True:
+            data = f.read(CHUNK_SIZE)
+            if not data:
+                break
+            if digest is None:
+                crc = zlib.crc32(data, crc)
+            else:
+                digest.update(data)
+    return f"{crc:08x}" if digest is None else digest.hexdigest()
+
+def remote_checksum(ftp, remote_name, command, algo):
+    """Solicita ao servidor o checksum do arquivo remoto inteiro."""
+    if command == "HASH":
+        with _checksum_lock:
+            selected = _hash_selected.get(ftp)
+        if selected != algo:
+            ftp.sendcmd(f"OPTS HASH {algo}")
+            with _checksum_lock:
+                _hash_selected[ftp] = algo
+        # Resposta: "213 <algoritmo> <intervalo> <hash> <arquivo>"
+        return ftp.sendcmd(f"HASH {remote_name}").split(" ", 4)[3]
+    # Resposta: "250 <crc>" (alguns servidores incluem texto antes do valor)
+    return ftp.sendcmd(f"XCRC {remote_name}").split()[-1]
+
+def remote_tail_matches(ftp, remote_name, local_file, end, length=VERIFY_TAIL_BYTES):
+    """
+    Relê do servidor os bytes do arquivo remoto a partir de 'end' - 'length' e compara
+    com o trecho correspondente do arquivo local, que termina em 'end'.
+
+    A leitura para em 'end', mesmo que o arquivo remoto seja maior: o canal de dados é
+    fechado e a resposta de
+    transferência interrompida (426/451) é descartada. O ABOR do ftplib não é usado,
+    pois o envio fora de banda não é aceito em conexões TLS.
+    """
+    start = max(0, end - length)
+    wanted = end - start
+    received = bytearray()
+    ftp.voidcmd("TYPE I")
+    conn = ftp.transfercmd(f"RETR {remote_name}", rest=start)
+    try:
+        while len(received) < wanted:
+            data = conn.recv(min(CHUNK_SIZE, wanted - len(received)))
+            if not data:
+                break
+            received += data
+    finally:
+        conn.close()
+    try:
+        ftp.voidresp()
+    except (error_temp, error_perm):
+        pass  # Transferência interrompida antes do fim do arquivo remoto
+    with open(local_file, "rb") as f:
+        f.seek(start)
+        local_data = f.read(wanted)
+    return bytes(received) == local_data
+
+def verify_upload(ftp, remote_name, local_file, file_size):
+    """
+    Confere o conteúdo do arquivo remoto completo: pelo checksum do servidor (HASH/XCRC),
+    quando disponível e UPLOAD_VERIFY for "auto", ou relendo o final do arquivo.
+    """
+    if not UPLOAD_VERIFY:
+        return True
+    if UPLOAD_VERIFY == "auto":
+        support = get_checksum_command(ftp)
+        if support is not None:
+            command, algo = support
+            try:
+                remote = remote_checksum(ftp, remote_name, command, algo)
+                return int(remote, 16) == int(local_checksum(local_file, algo), 16)
+            except (error_perm, ValueError, IndexError) as e:
+                print(f"\nChecksum remoto indisponível para {remote_name} ({e}); relendo o final do arquivo.")
+    return remote_tail_matches(ftp, remote_name, local_file, file_size)
 
-    print(f"\nArquivo: {os.path.basename(local_file)}")
-    print(f"Tamanho local: {file_size} bytes")
+def upload_file(ftp, local_file, remote_name=None, verbose=True, progress=None, state=None, listing=None):
+    """
+    Realiza o upload de um único arquivo via FTP em chunks, retomando um upload
+    interrompido com REST (ou APPE, se o servidor não aceitar REST) a partir do
+    tamanho remoto informado pelo servidor (SIZE ou listagem).
+    'remote_name' é o caminho remoto relativo a REMOTE_PATH (padrão: o nome do arquivo local).
+    'progress', se informado, é chamado com o número de bytes de cada chunk enviado
+    (e, no início, com os bytes já presentes no servidor).
+    'state' é o diário de transferências (UploadState), usado apenas para saber se o
+    arquivo remoto parcial pertence à mesma versão (tamanho e data) do arquivo local;
+    com VERIFY_RESUME, o final do trecho já enviado é conferido antes da retomada.
+    'listing' (RemoteListingCache) substitui os comandos SIZE antes e depois do envio.
+    Retorna True se o arquivo remoto estiver completo e verificado.
+    """
+    if remote_name is None:
+        remote_name = os.path.basename(local_file)
+    stat = os.stat(local_file)
+    file_size = stat.st_size
+
+    if verbose:
+        print(f"\nArquivo: {remote_name}")
+        print(f"Tamanho local: {file_size} bytes")
 
     # Tenta verificar se o arquivo já existe no servidor para retomar upload (se aplicável)
     try:
-        remote_size = ftp.size(os.path.basename(local_file))
-        uploaded_size = remote_size if remote_size is not None else 0
-        print(f"Tamanho remoto antes do upload: {uploaded_size} bytes")
+        if listing is not None:
+            remote_size = listing.size(ftp, remote_name) or 0
+        else:
+            ftp.voidcmd("TYPE I")  # SIZE só é confiável (e aceito por muitos servidores) em modo binário
+            remote_size = ftp.size(remote_name) or 0
+        if verbose:
+            print(f"Tamanho remoto antes do upload: {remote_size} bytes")
     except Exception as e:
-        print("Arquivo remoto não encontrado, iniciando upload do zero.")
+        if verbose:
+            print("Arquivo remoto não encontrado, iniciando upload do zero.")
+        remote_size = 0
+
+    # O ponto de retomada é o tamanho remoto (bytes confirmados pelo servidor); o diário só
+    # indica se o trecho remoto pertence à versão atual do arquivo local
+    entry = state.get_transfer(remote_name) if state is not None else None
+    same_version = entry is not None and entry[:2] == (file_size, stat.st_mtime_ns)
+    if same_version and entry[3] and remote_size == file_size:
+        if progress is not None:
+            progress(file_size)
+        return True
+    if remote_size > file_size:
         uploaded_size = 0
+    elif state is None or same_version or (entry is None and remote_size == file_size):
+        uploaded_size = remote_size
+    else:
+        uploaded_size = 0  # Trecho de outra versão do arquivo local (ou sem registro no diário)
 
-    with open(local_file, "rb") as f:
-        f.seek(uploaded_size)  # Retoma upload, se necessário
+    # Confere o final do trecho já enviado antes de continuar a partir dele
+    if uploaded_size and VERIFY_RESUME:
+        if not remote_tail_matches(ftp, remote_name, local_file, uploaded_size):
+            print(f"\nO conteúdo remoto de {remote_name} não confere; reenviando do início.")
+            uploaded_size = 0
 
-        def upload_chunk(data):
-            nonlocal uploaded_size
-            uploaded_size += len(data)
-            print(f"Uploaded: {uploaded_size / file_size * 100:.2f}%", end="\r")
+    def save_offset(offset, verified=False):
+        if state is not None:
+            state.save_transfer(remote_name, local_file, file_size, stat.st_mtime_ns, offset, verified)
 
-        try:
-            ftp.storbinary(f"STOR {os.path.basename(local_file)}", f, CHUNK_SIZE, upload_chunk)
-        except Exception as e:
-            print(f"\nErro durante o upload de {os.path.basename(local_file)}: {e}")
+    save_offset(uploaded_size)
+    saved_offset, saved_at = uploaded_size, time.monotonic()
+    if progress is not None and uploaded_size:
+        progress(uploaded_size)
+
+    # O servidor confirma o fim de cada STOR/APPE; sem exceção, o tamanho remoto é conhecido
+    transferred = uploaded_size == file_size
+    if not transferred:
+        with open(local_file, "rb") as local:
+            local.seek(uploaded_size)  # Retoma upload, se necessário
+            f = AdaptiveReader(local)
+
+            def upload_chunk(data):
+                nonlocal uploaded_size, saved_offset, saved_at
+                uploaded_size += len(data)
+                metrics.inc("uploader_bytes_total", len(data))
+                now = time.monotonic()
+                if uploaded_size - saved_offset >= JOURNAL_SAVE_BYTES or now - saved_at >= JOURNAL_SAVE_SECONDS:
+                    save_offset(uploaded_size)
+                    saved_offset, saved_at = uploaded_size, now
+                if progress is not None:
+                    progress(len(data))
+                if verbose:
+                    print(f"Uploaded: {uploaded_size / file_size * 100:.2f}%", end="\r")
+
+            try:
+                with metrics.timer("uploader_transfer"):
+                    if uploaded_size == 0:
+                        ftp.storbinary(f"STOR {remote_name}", f, CHUNK_SIZE, upload_chunk)
+                    else:
+                        try:
+                            ftp.storbinary(f"STOR {remote_name}", f, CHUNK_SIZE, upload_chunk, rest=uploaded_size)
+                        except error_perm as e:
+                            if not str(e).startswith("50"):
+                                raise
+                            # Servidor sem REST para STOR: acrescenta ao arquivo parcial
+                            ftp.storbinary(f"APPE {remote_name}", f, CHUNK_SIZE, upload_chunk)
+                transferred = True
+            except Exception as e:
+                chunk_tuner.record_error()
+                print(f"\nErro durante o upload de {remote_name}: {e}")
 
     try:
-        final_size = ftp.size(os.path.basename(local_file))
-        print(f"\nTamanho remoto após o upload: {final_size} bytes")
-        if final_size == file_size:
-            print(f"Upload de {os.path.basename(local_file)} concluído com sucesso.")
+        if listing is not None and transferred:
+            final_size = uploaded_size
         else:
-            print(f"O arquivo remoto {os.path.basename(local_file)} não corresponde ao tamanho local.")
+            final_size = ftp.size(remote_name)
+        if verbose:
+            print(f"\nTamanho remoto após o upload: {final_size} bytes")
+        if final_size != file_size:
+            metrics.inc("uploader_verify_failures_total")
+            print(f"O arquivo remoto {remote_name} não corresponde ao tamanho local.")
+            if listing is not None:
+                listing.invalidate(remote_name)
+            return False
+        with metrics.timer("uploader_verify"):
+            verified = verify_upload(ftp, remote_name, local_file, file_size)
+        if not verified:
+            metrics.inc("uploader_verify_failures_total")
+            print(f"O conteúdo do arquivo remoto {remote_name} não confere com o local.")
+            save_offset(0)
+            if listing is not None:
+                listing.invalidate(remote_name)
+            return False
+        save_offset(file_size, verified=True)
+        metrics.inc("uploader_files_total")
+        if listing is not None:
+            listing.update(remote_name, file_size)
+        if verbose:
+            print(f"Upload de {remote_name} concluído com sucesso.")
+        return True
     except Exception as e:
-        print(f"Não foi possível verificar o tamanho do arquivo remoto {os.path.basename(local_file)}: {e}")
+        print(f"Não foi possível verificar o arquivo remoto {remote_name}: {e}")
+        if listing is not None:
+            listing.invalidate(remote_name)
+    return False
 
-def upload_file_list():
-    """Conecta ao FTP, percorre a lista de arquivos e realiza o upload de cada um."""
-    ftp = FTP_TLS(FTP_HOST)
-    ftp.login(FTP_USER, FTP_PASS)
-    ftp.prot_p()  # Ativa transferência de dados segura
-    ftp.set_pasv(True)  # Modo passivo, se necessário
-    ftp.cwd(REMOTE_PATH)  # Muda para o diretório de destino
+def upload_with_retry(ftp_ref, local_file, remote_name=None, progress=None, known_dirs=None, state=None,
+                      listing=None):
+    """
+    Envia um arquivo com até UPLOAD_RETRIES tentativas. 'ftp_ref' é um dicionário
+    {"ftp": sessão ou None} da thread chamadora: a sessão é aberta sob demanda e,
+    após uma falha, descartada e reaberta na tentativa seguinte.
+    Retorna True se o upload foi concluído.
+    """
+    if remote_name is None:
+        remote_name = os.path.basename(local_file)
+    for attempt in range(UPLOAD_RETRIES):
+        sent = 0
+
+        def count(nbytes):
+            nonlocal sent
+            sent += nbytes
+            if progress is not None:
+                progress(nbytes)
+
+        try:
+            if ftp_ref["ftp"] is None:
+                ftp_ref["ftp"] = connect_ftp()
+            remote_dir = os.path.dirname(remote_name)
+            if remote_dir:
+                ensure_remote_dir(ftp_ref["ftp"], remote_dir, known_dirs, listing)
+            if upload_file(ftp_ref["ftp"], local_file, remote_name, verbose=False, progress=count, state=state,
+                           listing=listing):
+                return True
+        except Exception as e:
+            print(f"\nFalha no upload de {remote_name} (tentativa {attempt + 1}/{UPLOAD_RETRIES}): {e}")
+        # Desconta do progresso os bytes desta tentativa e reconecta antes da próxima
+        if progress is not None and sent:
+            progress(-sent)
+        close_ftp(ftp_ref)
+        time.sleep(1)
+    return False
+
+def close_ftp(ftp_ref):
+    """Encerra a sessão FTP de 'ftp_ref', ignorando erros de uma conexão já caída."""
+    if ftp_ref["ftp"] is None:
+        return
+    try:
+        ftp_ref["ftp"].quit()
+    except Exception:
+        try:
+            ftp_ref["ftp"].close()
+        except Exception:
+            pass
+    ftp_ref["ftp"] = None
 
+class UploadProgress:
+    """Progresso agregado de vários uploads simultâneos, exibido no máximo uma vez por segundo."""
+
+    def __init__(self, total_bytes):
+        self.total_bytes = total_bytes
+        self.done_bytes = 0
+        self.started = time.monotonic()
+        self._last_print = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, nbytes):
+        with self._lock:
+            self.done_bytes += nbytes
+            now = time.monotonic()
+            if now - self._last_print < 1:
+                return
+            self._last_print = now
+            elapsed = now - self.started
+            percent = self.done_bytes / self.total_bytes * 100 if self.total_bytes else 100.0
+            rate = self.done_bytes / elapsed / (1024 * 1024) if elapsed else 0.0
+            print(
+                f"Uploaded: {percent:.2f}% ({self.done_bytes / (1024 * 1024):.1f} de "
+                f"{self.total_bytes / (1024 * 1024):.1f} MB, {rate:.2f} MB/s)",
+                end="\r"
+            )
+
+class UploadPipeline:
+    """
+    Estágio de upload que roda em paralelo ao download: os arquivos entregues pelo
+    downloader entram em uma fila e são enviados por PIPELINE_WORKERS threads, cada uma
+    com a sua conexão FTPS, mantendo sob 'local_root' a mesma estrutura de diretórios
+    no servidor (relativa a REMOTE_PATH).
+
+    A fila é limitada pelo total de bytes ainda não enviados: submit() bloqueia o
+    download enquanto esse limite estiver excedido. Com 'delete_after_upload', os
+    arquivos locais são removidos após o envio, mantendo o uso de disco limitado; os
+    arquivos cujo upload falhou nunca são removidos. 'state' (UploadState) é o diário de
+    transferências, usado para retomar os uploads interrompidos.
+
+    Os arquivos que falharam são reenviados uma última vez em close(); os que ainda
+    assim falharem ficam em stats["failed_paths"].
+    """
+
+    def __init__(self, local_root, workers=PIPELINE_WORKERS,
+                 max_pending_bytes=PIPELINE_MAX_PENDING_BYTES, delete_after_upload=False, state=None):
+        self.local_root = local_root
+        self.max_pending_bytes = max_pending_bytes
+        self.delete_after_upload = delete_after_upload
+        self.state = state
+        self.stats = {"files": 0, "bytes": 0, "failed": 0, "failed_paths": []}
+        self._failed = []
+        self._queue = queue.Queue()
+        self._pending_bytes = 0
+        self._condition = threading.Condition()
+        self._known_dirs = set()
+        self._listing = RemoteListingCache()
+        self._threads = [
+            threading.Thread(target=self._worker, name=f"upload-{i + 1}", daemon=True)
+            for i in range(max(1, workers))
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, local_path):
+        """
+        Enfileira um arquivo para upload, aguardando enquanto a fila estiver cheia.
+        """
+        size = os.path.getsize(local_path)
+        with self._condition:
+            while self._pending_bytes > 0 and self._pending_bytes + size > self.max_pending_bytes:
+                self._condition.wait()
+            self._pending_bytes += size
+        self._queue.put((local_path, size))
+
+    def close(self):
+        """
+        Aguarda o envio de todos os arquivos enfileirados, encerra as threads e reenvia,
+        em uma única sessão, os arquivos que falharam. Retorna as estatísticas.
+        """
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        failed, self._failed = self._failed, []
+        if failed:
+            print(f"\nReenviando {len(failed)} arquivos cujo upload falhou...")
+            ftp_ref = {"ftp": None}
+            for local_path, size in failed:
+                if self._upload(ftp_ref, local_path, size):
+                    self.stats["failed"] -= 1
+            close_ftp(ftp_ref)
+        self.stats["failed_paths"] = [local_path for local_path, _ in self._failed]
+        for local_path in self.stats["failed_paths"]:
+            print(f"Falha no upload: {local_path}")
+        return self.stats
+
+    def _remote_path(self, local_path):
+        return remote_file_name(os.path.relpath(local_path, self.local_root))
+
+    def _upload(self, ftp_ref, local_path, size):
+        ok = upload_with_retry(ftp_ref, local_path, self._remote_path(local_path), known_dirs=self._known_dirs,
+                               state=self.state, listing=self._listing)
+        with self._condition:
+            if ok:
+                self.stats["files"] += 1
+                self.stats["bytes"] += size
+            else:
+                self._failed.append((local_path, size))
+        if ok and self.delete_after_upload:
+            try:
+                os.remove(local_path)
+            except OSError as e:
+                print(f"\nNão foi possível remover {local_path} após o upload: {e}")
+        return ok
+
+    def _worker(self):
+        ftp_ref = {"ftp": None}
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            local_path, size = item
+            ok = self._upload(ftp_ref, local_path, size)
+            with self._condition:
+                self._pending_bytes -= size
+                if not ok:
+                    self.stats["failed"] += 1
+                self._condition.notify_all()
+        close_ftp(ftp_ref)
+
+def run_uploads(items, state=None, on_uploaded=None, verbose=True):
+    """
+    Envia 'items' — tuplas (tamanho, arquivo local, nome remoto) — usando UPLOAD_WORKERS
+    conexões FTPS simultâneas, dos maiores para os menores. Cada thread repete e reconecta
+    a própria sessão em caso de falha, sem interromper os demais uploads.
+    'on_uploaded(arquivo local)' é chamado, na thread do upload, para cada envio concluído.
+    Retorna a lista dos arquivos locais cujo upload falhou.
+    """
+    pending = queue.Queue()
+    for item in sorted(items, reverse=True):
+        pending.put(item)
+    progress = UploadProgress(sum(item[0] for item in items))
+    known_dirs = set()
+    listing = RemoteListingCache()
+    failed = []
+
+    def worker():
+        ftp_ref = {"ftp": None}
+        while True:
+            try:
+                size, local_file, remote_name = pending.get_nowait()
+            except queue.Empty:
+                break
+            if verbose:
+                print(f"\nEnviando {remote_name} ({size} bytes)")
+            if upload_with_retry(ftp_ref, local_file, remote_name, progress.add, known_dirs, state, listing):
+                if verbose:
+                    print(f"\nUpload de {remote_name} concluído com sucesso.")
+                if on_uploaded is not None:
+                    on_uploaded(local_file)
+            else:
+                failed.append(local_file)
+        close_ftp(ftp_ref)
+
+    threads = [
+        threading.Thread(target=worker, name=f"upload-{i + 1}")
+        for i in range(max(1, min(UPLOAD_WORKERS, len(items))))
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    elapsed = time.monotonic() - progress.started
+    print(
+        f"\n{len(items) - len(failed)} de {len(items)} arquivos enviados "
+        f"({progress.done_bytes / (1024 * 1024):.1f} MB em {elapsed:.1f}s, "
+        f"bloco final de {chunk_tuner.size // 1024} KB)."
+    )
+    for local_file in failed:
+        print(f"Falha no upload: {local_file}")
+    return failed
+
+def upload_file_list():
+    """
+    Envia os arquivos de FILE_LIST com run_uploads. Com UPLOAD_STATE_DB, uploads
+    interrompidos em execuções anteriores são retomados a partir do diário.
+    """
+    items = []
     for filename in FILE_LIST:
         local_file = os.path.join(LOCAL_FOLDER, filename)
-        if os.path.exists(local_file):
-            upload_file(ftp, local_file)
+        if os.path.isfile(local_file):
+            items.append((os.path.getsize(local_file), local_file, filename))
         else:
             print(f"\nArquivo não encontrado: {local_file}")
 
-    ftp.quit()
+    state = UploadState(UPLOAD_STATE_DB) if UPLOAD_STATE_DB else None
+    try:
+        run_uploads(items, state)
+    finally:
+        if state is not None:
+            state.close()
     print("\nTodos os uploads foram concluídos.")
 
+def scan_mirror_tree(local_root, state):
+    """
+    Percorre 'local_root' e retorna (itens a enviar, versões a registrar no manifesto,
+    diretórios percorridos, contadores).
+
+    O tamanho e a data de modificação de cada arquivo são comparados com o manifesto
+    (uma regravação no lugar não muda a data do diretório); só é calculado o hash dos
+    arquivos que diferem, e só são enviados os arquivos cujo conteúdo mudou. Com
+    MIRROR_SKIP_UNCHANGED_MAILDIRS, os diretórios cur/ e new/ das pastas Maildir cuja
+    data de modificação não mudou desde a última sincronização completa não são
+    consultados. Os diretórios tmp/ das pastas Maildir são ignorados.
+    """
+    items = []
+    versions = {}
+    scanned_dirs = []
+    counts = {"unchanged_dirs": 0, "touched": 0}
+    # (diretório relativo, se é cur/ ou new/ de uma pasta Maildir)
+    stack = [("", False)]
+    while stack:
+        rel_dir, maildir_messages = stack.pop()
+        abs_dir = os.path.join(local_root, *rel_dir.split("/")) if rel_dir else local_root
+        dir_mtime = os.stat(abs_dir).st_mtime_ns
+        unchanged = (MIRROR_SKIP_UNCHANGED_MAILDIRS and maildir_messages
+                     and state.get_directory_mtime(rel_dir) == dir_mtime)
+        with os.scandir(abs_dir) as it:
+            entries = list(it)
+        names = {entry.name for entry in entries}
+        manifest = None
+        for entry in entries:
+            rel_path = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+            if entry.is_dir(follow_symlinks=False):
+                if not (entry.name == "tmp" and "cur" in names):
+                    stack.append((rel_path, entry.name in ("cur", "new") and "cur" in names))
+                continue
+            if unchanged or not entry.is_file(follow_symlinks=False):
+                continue
+            if manifest is None:
+                manifest = state.get_manifest_entries(rel_dir)
+            stat = entry.stat()
+            previous = manifest.get(rel_path)
+            if previous is not None and previous[:2] == (stat.st_size, stat.st_mtime_ns):
+                continue
+            digest = local_checksum(entry.path, "SHA-256")
+            version = (rel_path, rel_dir, stat.st_size, stat.st_mtime_ns, digest)
+            if previous is not None and (previous[0], previous[2]) == (stat.st_size, digest):
+                # Apenas a data de modificação mudou: o conteúdo remoto continua válido
+                state.save_manifest_entry(*version)
+                counts["touched"] += 1
+                continue
+            items.append((stat.st_size, entry.path, remote_file_name(rel_path)))
+            versions[entry.path] = version
+        if unchanged:
+            counts["unchanged_dirs"] += 1
+        else:
+            scanned_dirs.append((rel_dir, dir_mtime))
+    return items, versions, scanned_dirs, counts
+
+def mirror_tree(local_root):
+    """
+    Espelha 'local_root' sob REMOTE_PATH, enviando apenas os arquivos novos ou alterados
+    desde a execução anterior e criando os diretórios remotos conforme necessário.
+    Arquivos removidos localmente são mantidos no servidor.
+    """
+    if not UPLOAD_STATE_DB:
+        print("O modo espelho requer UPLOAD_STATE_DB para guardar o manifesto.")
+        return
+    state = UploadState(UPLOAD_STATE_DB)
+    try:
+        started = time.monotonic()
+        items, versions, scanned_dirs, counts = scan_mirror_tree(local_root, state)
+        print(
+            f"Espelho: {len(items)} arquivos novos ou alterados, "
+            f"{counts['touched']} apenas com data alterada, "
+            f"{counts['unchanged_dirs']} diretórios inalterados "
+            f"(varredura em {time.monotonic() - started:.1f}s)."
+        )
+
+        def record(local_file):
+            state.save_manifest_entry(*versions[local_file])
+
+        failed = run_uploads(items, state, on_uploaded=record, verbose=False)
+        # Um diretório só é dado como sincronizado se todos os seus arquivos foram enviados
+        failed_dirs = {versions[local_file][1] for local_file in failed}
+        for rel_dir, dir_mtime in scanned_dirs:
+            if rel_dir not in failed_dirs:
+                state.save_directory_mtime(rel_dir, dir_mtime)
+    finally:
+        state.close()
+    print("\nSincronização do espelho concluída.")
+
 if __name__ == "__main__":
-    upload_file_list()
+    if MIRROR_LOCAL_ROOT and PACK_VOLUMES:
+        from volume_packer import pack_tree  # Importado aqui: o volume_packer.py importa este módulo
+        pack_tree(MIRROR_LOCAL_ROOT)
+    elif MIRROR_LOCAL_ROOT:
+        mirror_tree(MIRROR_LOCAL_ROOT)
+    else:
+        upload_file_list()
\ No newline at end of file
@@ -0,0 +1,281 @@
+import os
+import queue
+import shutil
+import sys
+import tarfile
+import threading
+import time
+import zipfile
+import zlib
+from ftplib import all_errors
+
+from upload_state import UploadState
+from uploader_ftp import (
+    CHUNK_SIZE, UPLOAD_RETRIES, UPLOAD_STATE_DB, UPLOAD_WORKERS, bandwidth, close_ftp, connect_ftp,
+    ensure_remote_dir,
+)
+
+# Configurações do empacotamento. Uso:
+#   python volume_packer.py                                  empacota e envia PACK_LOCAL_ROOT
+#   python volume_packer.py <caminho relativo> <destino>     restaura uma mensagem pelo índice
+# (o uploader_ftp.py também empacota MIRROR_LOCAL_ROOT com PACK_VOLUMES = True)
+PACK_LOCAL_ROOT = ""                        # Árvore a empacotar (normalmente o MAILSTORE_HOME)
+PACK_REMOTE_DIR = "volumes"                 # Diretório remoto dos volumes, relativo a REMOTE_PATH
+PACK_FORMAT = "tar"                         # "tar" ou "zip"
+PACK_COMPRESSION = ""                       # tar: "", "gz", "bz2" ou "xz"; zip: "" ou "deflate"
+PACK_VOLUME_MAX_BYTES = 2 * 1024 ** 3       # Limite de bytes de mensagens por volume
+
+# Bloco de tar: o conteúdo de cada membro é completado até um múltiplo deste tamanho
+TAR_BLOCK = tarfile.BLOCKSIZE
+
+
+class DataChannelWriter:
+    """
+    Objeto de arquivo somente-escrita sobre o canal de dados de um STOR, para que o
+    tarfile/zipfile gravem o volume diretamente na conexão, sem arquivo temporário.
+    As escritas respeitam o limite de banda global do uploader_ftp.py.
+    """
+
+    def __init__(self, conn):
+        self._conn = conn
+        self._position = 0
+
+    def write(self, data):
+        bandwidth.consume(len(data))
+        self._conn.sendall(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+
+def plan_volumes(local_root, user, state):
+    """
+    Lista os arquivos ainda não empacotados da árvore do usuário e os agrupa em volumes
+    de até PACK_VOLUME_MAX_BYTES. Os diretórios tmp/ das pastas Maildir são ignorados.
+    Retorna uma lista de volumes, cada um uma lista de (caminho local, caminho relativo).
+    """
+    packed = state.get_packed_paths(user)
+    volumes, current, current_bytes = [], [], 0
+    stack = [user]
+    while stack:
+        rel_dir = stack.pop()
+        with os.scandir(os.path.join(local_root, *rel_dir.split("/"))) as it:
+            entries = sorted(it, key=lambda entry: entry.name)
+        names = {entry.name for entry in entries}
+        for entry in entries:
+            rel_path = f"{rel_dir}/{entry.name}"
+            if entry.is_dir(follow_symlinks=False):
+                if not (entry.name == "tmp" and "cur" in names):
+                    stack.append(rel_path)
+                continue
+            if not entry.is_file(follow_symlinks=False) or rel_path in packed:
+                continue
+            size = entry.stat().st_size
+            if current and current_bytes + size > PACK_VOLUME_MAX_BYTES:
+                volumes.append(current)
+                current, current_bytes = [], 0
+            current.append((entry.path, rel_path))
+            current_bytes += size
+    if current:
+        volumes.append(current)
+    return volumes
+
+
+def write_tar_volume(writer, members, compression):
+    """
+    Grava os membros em um tar no 'writer' e retorna as linhas do índice. Arquivos com
+    vários hardlinks (ex.: mensagens deduplicadas) são gravados uma vez por volume; as
+    demais ocorrências viram entradas de link, apontando para a primeira no índice.
+    Com compressão, o deslocamento refere-se ao fluxo tar descomprimido.
+    """
+    rows = []
+    mode = f"w|{compression}" if compression else "w|"
+    with tarfile.open(fileobj=writer, mode=mode, bufsize=CHUNK_SIZE, format=tarfile.PAX_FORMAT) as tar:
+        for local_path, rel_path in members:
+            tarinfo = tar.gettarinfo(local_path, arcname=rel_path)
+            if tarinfo.islnk():
+                tar.addfile(tarinfo)
+                rows.append((rel_path, 0, 0, 0, tarinfo.linkname))
+                continue
+            with open(local_path, "rb") as f:
+                tar.addfile(tarinfo, f)
+            # O conteúdo termina no último bloco gravado, completado até TAR_BLOCK
+            padded = -(-tarinfo.size // TAR_BLOCK) * TAR_BLOCK
+            rows.append((rel_path, tar.offset - padded, tarinfo.size, tarinfo.size, None))
+    return rows
+
+
+def write_zip_volume(writer, members, compression):
+    """
+    Grava os membros em um zip no 'writer' e retorna as linhas do índice, com o
+    deslocamento dos dados (após o cabeçalho local) e o tamanho comprimido.
+    """
+    rows = []
+    compress_type = zipfile.ZIP_DEFLATED if compression == "deflate" else zipfile.ZIP_STORED
+    with zipfile.ZipFile(writer, "w", compression=compress_type) as zf:
+        for local_path, rel_path in members:
+            zinfo = zipfile.ZipInfo.from_file(local_path, arcname=rel_path)
+            zinfo.compress_type = compress_type
+            with open(local_path, "rb") as src, zf.open(zinfo, "w") as dst:
+                offset = writer.tell()
+                shutil.copyfileobj(src, dst, CHUNK_SIZE)
+            rows.append((rel_path, offset, zinfo.compress_size, zinfo.file_size, None))
+    return rows
+
+
+def upload_volume(ftp, remote_name, members):
+    """
+    Empacota 'members' diretamente no canal de dados de um STOR e retorna as linhas do
+    índice, já com o nome do volume e a compressão.
+    """
+    ftp.voidcmd("TYPE I")
+    conn = ftp.transfercmd(f"STOR {remote_name}")
+    try:
+        writer = DataChannelWriter(conn)
+        if PACK_FORMAT == "zip":
+            rows = write_zip_volume(writer, members, PACK_COMPRESSION)
+        else:
+            rows = write_tar_volume(writer, members, PACK_COMPRESSION)
+        if hasattr(conn, "unwrap"):
+            conn.unwrap()
+    finally:
+        conn.close()
+    ftp.voidresp()
+    return [
+        (rel_path, remote_name, offset, stored_size, size, PACK_COMPRESSION, link_target)
+        for rel_path, offset, stored_size, size, link_target in rows
+    ]
+
+
+def volume_name(user, run_id, number):
+    extension = ".zip" if PACK_FORMAT == "zip" else ".tar" + (f".{PACK_COMPRESSION}" if PACK_COMPRESSION else "")
+    return f"{PACK_REMOTE_DIR}/{user}/{user}-{run_id}-{number:04d}{extension}".lstrip("/")
+
+
+def pack_tree(local_root):
+    """
+    Empacota, para cada usuário (subdiretório de 'local_root'), as mensagens ainda não
+    empacotadas em volumes enviados por UPLOAD_WORKERS conexões FTPS, e registra no
+    índice de UPLOAD_STATE_DB a posição de cada mensagem. Um volume que falhar é
+    reenviado por inteiro, até UPLOAD_RETRIES vezes.
+    """
+    state = UploadState(UPLOAD_STATE_DB)
+    run_id = time.strftime("%Y%m%d-%H%M%S")
+    pending = queue.Queue()
+    total = 0
+    for user in sorted(os.listdir(local_root)):
+        if not os.path.isdir(os.path.join(local_root, user)):
+            continue
+        for number, members in enumerate(plan_volumes(local_root, user, state), start=1):
+            pending.put((volume_name(user, run_id, number), members))
+            total += 1
+    print(f"{total} volumes a enviar.")
+    failed = []
+
+    def worker():
+        ftp_ref = {"ftp": None}
+        while True:
+            try:
+                remote_name, members = pending.get_nowait()
+            except queue.Empty:
+                break
+            for attempt in range(UPLOAD_RETRIES):
+                started = time.monotonic()
+                try:
+                    if ftp_ref["ftp"] is None:
+                        ftp_ref["ftp"] = connect_ftp()
+                    ensure_remote_dir(ftp_ref["ftp"], os.path.dirname(remote_name))
+                    rows = upload_volume(ftp_ref["ftp"], remote_name, members)
+                except all_errors as e:
+                    print(f"\nFalha no envio de {remote_name} (tentativa {attempt + 1}/{UPLOAD_RETRIES}): {e}")
+                    close_ftp(ftp_ref)
+                    time.sleep(1)
+                    continue
+                state.record_packed(rows)
+                print(f"\n{remote_name}: {len(members)} mensagens em {time.monotonic() - started:.1f}s.")
+                break
+            else:
+                failed.append(remote_name)
+        close_ftp(ftp_ref)
+
+    threads = [
+        threading.Thread(target=worker, name=f"pack-{i + 1}")
+        for i in range(max(1, min(UPLOAD_WORKERS, total)))
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    state.close()
+    for remote_name in failed:
+        print(f"Falha no envio do volume: {remote_name}")
+    print("\nEmpacotamento concluído.")
+
+
+def restore_message(rel_path, dest_path):
+    """
+    Recupera uma única mensagem a partir do índice, lendo do servidor apenas o trecho
+    do volume que a contém. Em volumes tar comprimidos, o volume é lido em fluxo até a
+    mensagem.
+    """
+    # Um link físico é recuperado a partir do membro (e da linha do índice) do seu alvo
+    member_name = rel_path
+    state = UploadState(UPLOAD_STATE_DB)
+    try:
+        entry = state.find_packed(rel_path)
+        if entry is not None and entry[5]:
+            member_name = entry[5]
+            entry = state.find_packed(member_name)
+    finally:
+        state.close()
+    if entry is None:
+        raise FileNotFoundError(f"Mensagem não encontrada no índice: {rel_path}")
+    volume, offset, stored_size, size, compression, _ = entry
+
+    ftp = connect_ftp()
+    try:
+        ftp.voidcmd("TYPE I")
+        if compression and not volume.endswith(".zip"):
+            with ftp.transfercmd(f"RETR {volume}") as conn, conn.makefile("rb") as stream:
+                with tarfile.open(fileobj=stream, mode=f"r|{compression}") as tar:
+                    for tarinfo in tar:
+                        if tarinfo.name == member_name:
+                            with open(dest_path, "wb") as f:
+                                shutil.copyfileobj(tar.extractfile(tarinfo), f, CHUNK_SIZE)
+                            break
+                    else:
+                        raise FileNotFoundError(f"Mensagem {member_name} não encontrada no volume {volume}")
+        else:
+            data = bytearray()
+            with ftp.transfercmd(f"RETR {volume}", rest=offset) as conn:
+                while len(data) < stored_size:
+                    chunk = conn.recv(min(CHUNK_SIZE, stored_size - len(data)))
+                    if not chunk:
+                        break
+                    data += chunk
+            if compression == "deflate":
+                data = zlib.decompress(bytes(data), -zlib.MAX_WBITS)
+            with open(dest_path, "wb") as f:
+                f.write(data)
+        # A leitura foi interrompida antes do fim do volume: o servidor responde 426 ou 226
+        try:
+            ftp.voidresp()
+        except all_errors:
+            pass
+    finally:
+        close_ftp({"ftp": ftp})
+    if os.path.getsize(dest_path) != size:
+        raise IOError(f"Tamanho restaurado de {rel_path} não confere com o índice.")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3:
+        restore_message(sys.argv[1], sys.argv[2])
+        print(f"Mensagem {sys.argv[1]} restaurada em {sys.argv[2]}.")
+    else:
+        pack_tree(PACK_LOCAL_ROOT)
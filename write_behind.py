@@ -0,0 +1,86 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class WriteBehindPool:
+    """
+    Pool de threads de gravação: cada tarefa enviada por submit() é executada em segundo
+    plano, enquanto a thread que a enviou volta a buscar dados na rede.
+
+    A memória retida pelas gravações pendentes é limitada a 'max_pending_bytes': submit()
+    bloqueia (contrapressão) até que as gravações em andamento liberem espaço. Uma tarefa
+    maior que o limite é aceita quando não há nenhuma outra pendente.
+    """
+
+    def __init__(self, workers: int, max_pending_bytes: int):
+        self.max_pending_bytes = max_pending_bytes
+        self.stats = {"writes": 0, "bytes": 0, "stalls": 0, "stall_seconds": 0.0}
+        self._pending_bytes = 0
+        self._condition = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="gravacao")
+
+    def submit(self, nbytes: int, func, *args):
+        """
+        Agenda func(*args), que retém 'nbytes' de memória até terminar, e retorna o seu
+        Future. Aguarda enquanto os bytes pendentes excederem o limite.
+        """
+        with self._condition:
+            if self._over_limit(nbytes):
+                started = time.monotonic()
+                while self._over_limit(nbytes):
+                    self._condition.wait()
+                self.stats["stalls"] += 1
+                self.stats["stall_seconds"] += time.monotonic() - started
+            self._pending_bytes += nbytes
+        future = self._executor.submit(func, *args)
+        future.add_done_callback(lambda _: self._release(nbytes))
+        return future
+
+    def close(self):
+        """
+        Aguarda as gravações pendentes e encerra as threads. Retorna as estatísticas:
+        gravações, bytes, vezes em que submit() aguardou e o tempo total de espera.
+        """
+        self._executor.shutdown(wait=True)
+        with self._condition:
+            return dict(self.stats)
+
+    def _over_limit(self, nbytes: int) -> bool:
+        return self._pending_bytes > 0 and self._pending_bytes + nbytes > self.max_pending_bytes
+
+    def _release(self, nbytes: int):
+        with self._condition:
+            self._pending_bytes -= nbytes
+            self.stats["writes"] += 1
+            self.stats["bytes"] += nbytes
+            self._condition.notify_all()
+
+
+def fsync_files(paths):
+    """
+    Sincroniza com o disco (fsync) os arquivos de 'paths' e, em seguida, uma única vez
+    cada diretório que os contém, para que também as entradas criadas ou renomeadas
+    sejam duráveis. Arquivos que já não existem são ignorados: com o envio FTP em paralelo
+    e a exclusão após o envio, o uploader pode removê-los antes da sincronização.
+    """
+    directories = set()
+    for path in paths:
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except FileNotFoundError:
+            continue
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        directories.add(os.path.dirname(path))
+    if os.name == "nt":
+        return  # O Windows não permite abrir diretórios para fsync
+    for directory in directories:
+        fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)